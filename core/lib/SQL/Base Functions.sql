@@ -2,6 +2,7 @@ CREATE EXTENSION IF NOT EXISTS cube;
 CREATE EXTENSION IF NOT EXISTS earthdistance;
 DROP FUNCTION IF EXISTS pr_create_campaigns(int, varchar, varchar, varchar, varchar);
 DROP FUNCTION IF EXISTS pr_crear_serie(int, date, date, date, int);
+DROP FUNCTION IF EXISTS pr_crear_series(int, date, date, date, int);
 DROP FUNCTION IF EXISTS pr_año_agrario(date);
 DROP FUNCTION IF EXISTS pr_año_agrario(date, int);
 DROP FUNCTION IF EXISTS is_leap(int);
@@ -117,6 +118,17 @@ AS $$
 $$ LANGUAGE plpgsql;
 
 
+/* Crea las series combinadas de todas las campañas completas de una estación en una única consulta. */
+CREATE OR REPLACE FUNCTION pr_crear_series(omm_id int, fecha_inicio date, fecha_inflexion date, fecha_fin date, mes_fin_de_campaña int default 5)
+RETURNS TABLE (campaign int, fecha date, fecha_original date, tmax double precision, tmin double precision, prcp double precision, rad double precision)
+AS $$
+    SELECT c.pr_year, serie.fecha, serie.fecha_original, serie.tmax, serie.tmin, serie.prcp, serie.rad
+    FROM pr_campañas_completas($1, $5) c,
+         LATERAL pr_crear_serie($1, $2, $3, $4, c.pr_year) serie
+    ORDER BY c.pr_year, serie.fecha
+$$ LANGUAGE sql;
+
+
 CREATE OR REPLACE FUNCTION pr_serie_agraria(omm_id int, year_agrario int, mes_fin_de_campaña int default 5)
 RETURNS TABLE (fecha date, fecha_original date, tmax double precision, tmin double precision, prcp double precision, rad double precision)
 AS $$
@@ -0,0 +1,326 @@
+import re
+import copy
+from datetime import datetime
+
+__author__ = 'Federico Schmidt'
+
+
+class DSSATExpWriter:
+    """
+    Writes DSSAT experiment (FileX) and soil (.SOL) files from a pSIMS experiment template (data/templates), the
+    management and initial conditions of a simulation and a soil file, as camp2json.py and jsons2dssat.py do in pSIMS.
+
+    Every weather scenario is written as a treatment with its own field, the weather station of field N being
+    "WTH%05d" % (N - 1), so DSSAT reads scenario N from the file WTH%05d.WTH written by DSSATWthWriter.
+    """
+    # Max number of treatments of an experiment file (treatment numbers have two digits).
+    max_treatments = 99
+
+    # Management variables that apply to the N-th event that has the variable (eg. date_1, fecd_2).
+    indexed_variable = re.compile('^(.+)_(\d+)$')
+
+    def __init__(self):
+        pass
+
+    @staticmethod
+    def experiment(template, simulation, soil, ref_year):
+        """
+        Applies the management and initial conditions of a simulation to an experiment template.
+        :param template: The crop template dictionary.
+        :param simulation: A simulation (with its management and initial_conditions dictionaries).
+        :param soil: The soil dictionary of the simulation (the first element of the soil file "soils" list).
+        :param ref_year: The reference year, replaces the "yyyy" placeholder of dates.
+        :returns The experiment dictionary.
+        """
+        experiment = copy.deepcopy(template)
+        experiment['soil_id'] = soil['soil_id']
+        events = experiment['management']['events']
+
+        for var, value in simulation['management'].iteritems():
+            if var == 'mgmt_name':
+                continue
+            if var == 'soil_id':
+                experiment['soil_id'] = value
+                continue
+
+            indexed = DSSATExpWriter.indexed_variable.match(var)
+            if indexed and not any([var in e for e in events]):
+                var_name, var_index = indexed.group(1), int(indexed.group(2))
+                matching_events = [e for e in events if var_name in e]
+                if var_index > len(matching_events):
+                    raise RuntimeError('Variable "%s" refers to event %d but the template only has %d events with '
+                                       'variable "%s".' % (var, var_index, len(matching_events), var_name))
+                matching_events[var_index - 1][var_name] = value
+            else:
+                matching_events = [e for e in events if var in e]
+                if len(matching_events) == 0:
+                    experiment[var] = value
+                for e in matching_events:
+                    e[var] = value
+
+        for e in events:
+            e['date'] = DSSATExpWriter.replace_year(e['date'], ref_year)
+
+        soil_layers = soil['soilLayer']
+        initial_conditions = simulation['initial_conditions']
+        layers = []
+
+        for layer_idx, soil_layer in enumerate(soil_layers):
+            layer = {'icbl': soil_layer['sllb']}
+
+            for var, value in initial_conditions.iteritems():
+                if isinstance(value, list):
+                    layer[var] = value[layer_idx]
+                elif var != 'icbl':
+                    layer[var] = value
+
+            # Initial water content, as a fraction of the available water of the layer.
+            frac = layer.get('ich20_frac', initial_conditions.get('frac_full', None))
+            if frac is not None and 'ich2o' not in layer:
+                lower_limit = float(soil_layer['slll'])
+                layer['ich2o'] = lower_limit + float(frac) * (float(soil_layer['sldul']) - lower_limit)
+            layers.append(layer)
+
+        experiment['initial_conditions']['soilLayer'] = layers
+        return experiment
+
+    @staticmethod
+    def replace_year(date, ref_year):
+        return str(date).replace('yyyy', str(ref_year))
+
+    @staticmethod
+    def dssat_date(date):
+        """
+        Converts a YYYYMMDD date to the YYDDD DSSAT format. Other values (eg. days after planting) are returned as is.
+        """
+        date = str(date)
+        if len(date) != 8 or not date.isdigit():
+            return date
+        return datetime.strptime(date, '%Y%m%d').strftime('%y%j')
+
+    @staticmethod
+    def days_after(reference_date, date):
+        """
+        Returns the days between a YYYYMMDD reference date and a date, which can also be a number of days already.
+        """
+        date = str(date)
+        if len(date) != 8 or not date.isdigit():
+            return date
+        return (datetime.strptime(date, '%Y%m%d') - datetime.strptime(str(reference_date), '%Y%m%d')).days
+
+    @staticmethod
+    def fmt(value, width=5):
+        """
+        Formats a value to fit in a column of the given width.
+        """
+        if value is None:
+            value = -99
+        if isinstance(value, float):
+            if value == int(value) and abs(value) < 10 ** (width - 1):
+                value = str(int(value))
+            else:
+                for decimals in range(3, -1, -1):
+                    formatted = ('%.' + str(decimals) + 'f') % value
+                    if len(formatted) > width:
+                        # Strip the leading zero (eg. -0.218 -> -.218) before losing precision.
+                        formatted = formatted.replace('0.', '.', 1)
+                    if len(formatted) <= width:
+                        break
+                value = formatted
+        return ('%' + str(width) + 's') % value
+
+    @staticmethod
+    def write_exp(experiment, scenario_indexes, output_file_path, num_years=1):
+        """
+        Writes an experiment file with a treatment for each weather scenario.
+        :param scenario_indexes: The indexes of the weather scenarios of this file (at most max_treatments).
+        """
+        if len(scenario_indexes) > DSSATExpWriter.max_treatments:
+            raise RuntimeError('An experiment file can\'t have more than %d treatments.' %
+                               DSSATExpWriter.max_treatments)
+
+        f = DSSATExpWriter.fmt
+        d = DSSATExpWriter.dssat_date
+        events = experiment['management']['events']
+        planting = [e for e in events if e['event'] == 'planting'][0]
+        fertilizers = [e for e in events if e['event'] == 'fertilizer']
+        irrigations = [e for e in events if e['event'] == 'irrigation']
+        harvests = [e for e in events if e['event'] == 'harvest']
+        ic = experiment['initial_conditions']
+        control = experiment['dssat_simulation_control']['data'][0]
+        planting_date = d(planting['date'])
+
+        lines = ['*EXP.DETAILS: X1234567 %s' % experiment.get('exname_o', ''), '',
+                 '*TREATMENTS                        -------------FACTOR LEVELS------------',
+                 '@N R O C TNAME.................... CU FL SA IC MP MI MF MR MC MT ME MH SM']
+        for trno, scen_idx in enumerate(scenario_indexes, start=1):
+            lines.append('%2d 1 0 0 %-25s%3d%3d%3d%3d%3d%3d%3d%3d%3d%3d%3d%3d%3d' % (
+                trno, ('Scenario %d' % scen_idx)[0:25], 1, trno, 0, 1, 1, 1 if irrigations else 0,
+                1 if fertilizers else 0, 0, 0, 0, 1 if 'dssat_environment_modification' in experiment else 0,
+                1 if harvests else 0, 1))
+
+        lines += ['', '*CULTIVARS', '@C CR INGENO CNAME',
+                  ' 1 %2s %6s %s' % (planting['crid'], planting['cul_id'], planting.get('cul_name', '-99'))]
+
+        lines += ['', '*FIELDS',
+                  '@L ID_FIELD WSTA....  FLSA  FLOB  FLDT  FLDD  FLDS  FLST SLTX  SLDP  ID_SOIL    FLNAME']
+        for trno, scen_idx in enumerate(scenario_indexes, start=1):
+            lines.append('%2d %-8s %-8s %s %s %-5s %s %s %-5s %-5s%s  %-10s %s' % (
+                trno, experiment.get('id_field', 'Field')[0:8], 'WTH%05d' % scen_idx, f(experiment.get('flsl')),
+                f(experiment.get('flob')), experiment.get('fl_drntype', '-99'), f(experiment.get('fldrd')),
+                f(experiment.get('fldrs')), experiment.get('flst', '-99'), experiment.get('sltx', '-99'),
+                f(experiment.get('sldp')), experiment['soil_id'], experiment.get('fl_name', '-99')))
+        lines.append('@L ...........XCRD ...........YCRD .....ELEV .............AREA .SLEN .FLWR .SLAS FLHST FHDUR')
+        for trno in range(1, len(scenario_indexes) + 1):
+            lines.append('%2d %s %s %s %s %s %s %s %s %s' % (
+                trno, f(experiment.get('fl_long'), 15), f(experiment.get('fl_lat'), 15), f(experiment.get('flele'), 9),
+                f(experiment.get('farea'), 17), f(experiment.get('slen')), f(experiment.get('fllwr')),
+                f(experiment.get('flsla')), f(experiment.get('flhst')), f(experiment.get('fhdur'))))
+
+        ic_date = ic.get('icdat', '-99')
+        if str(ic_date) == '-99':
+            ic_date = planting_date
+        lines += ['', '*INITIAL CONDITIONS',
+                  '@C   PCR ICDAT  ICRT  ICND  ICRN  ICRE  ICWD ICRES ICREN ICREP ICRIP ICRID ICNAME',
+                  ' 1 %s %s %s %s %s %s %s %s %s %s %s %s %s' % (
+                      f(ic.get('icpcr')), f(d(ic_date)), f(ic.get('icrt')), f(ic.get('icnd')), f(ic.get('icrz#')),
+                      f(ic.get('icrze')), f(ic.get('icwt')), f(ic.get('icrag')), f(ic.get('icrn')),
+                      f(ic.get('icrp')), f(ic.get('icrip')), f(ic.get('icrdp')), ic.get('ic_name', '-99')),
+                  '@C  ICBL  SH2O  SNH4  SNO3']
+        for layer in ic['soilLayer']:
+            lines.append(' 1 %s %s %s %s' % (f(float(layer['icbl'])), f(layer.get('ich2o')), f(layer.get('icnh4')),
+                                             f(layer.get('icno3'))))
+
+        lines += ['', '*PLANTING DETAILS',
+                  '@P PDATE EDATE  PPOP  PPOE  PLME  PLDS  PLRS  PLRD  PLDP  PLWT  PAGE  PENV  PLPH  SPRL'
+                  '                        PLNAME',
+                  ' 1 %s %s %s %s %s %s %s %s %s %s %s %s %s %s                        %s' % (
+                      f(planting_date), f(planting.get('edate')), f(planting.get('plpop')), f(planting.get('plpoe')),
+                      f(planting.get('plma')), f(planting.get('plds')), f(planting.get('plrs')),
+                      f(planting.get('plrd')), f(planting.get('pldp')), f(planting.get('plmwt')),
+                      f(planting.get('page')), f(planting.get('plenv')), f(planting.get('plph')),
+                      f(planting.get('plspl')), planting.get('pl_name', '-99'))]
+
+        if irrigations:
+            irrigation = irrigations[0]
+            lines += ['', '*IRRIGATION AND WATER MANAGEMENT',
+                      '@I  EFIR  IDEP  ITHR  IEPT  IOFF  IAME  IAMT IRNAME',
+                      ' 1 %s %s %s %s %s %s %s %s' % (
+                          f(irrigation.get('ireff')), f(irrigation.get('irmdp')), f(irrigation.get('irthr')),
+                          f(irrigation.get('irept')), f(irrigation.get('irstg')), f(irrigation.get('iame')),
+                          f(irrigation.get('iamt')), irrigation.get('ir_name', '-99')),
+                      '@I IDATE  IROP IRVAL']
+            for irrigation in irrigations:
+                lines.append(' 1 %s %s %s' % (f(d(irrigation['date'])), f(irrigation.get('irop')),
+                                              f(irrigation.get('irval'))))
+
+        if fertilizers:
+            lines += ['', '*FERTILIZERS (INORGANIC)',
+                      '@F FDATE  FMCD  FACD  FDEP  FAMN  FAMP  FAMK  FAMC  FAMO  FOCD FERNAME']
+            for fertilizer in fertilizers:
+                fertilizer_date = d(fertilizer['date'])
+                if control['management'].get('ferti') == 'D':
+                    # Fertilizer dates are days after planting.
+                    fertilizer_date = DSSATExpWriter.days_after(planting['date'], fertilizer['date'])
+                lines.append(' 1 %s %s %s %s %s %s %s %s %s %s %s' % (
+                    f(fertilizer_date), f(fertilizer.get('fecd')), f(fertilizer.get('feacd')),
+                    f(fertilizer.get('fedep')), f(fertilizer.get('feamn')), f(fertilizer.get('feamp')),
+                    f(fertilizer.get('feamk')), f(fertilizer.get('feamc')), f(fertilizer.get('feamo')),
+                    f(fertilizer.get('feocd')), fertilizer.get('fe_name', '-99')))
+
+        if 'dssat_environment_modification' in experiment:
+            env = experiment['dssat_environment_modification']['data'][0]['data']
+            lines += ['', '*ENVIRONMENT MODIFICATIONS',
+                      '@E ODATE EDAY  ERAD  EMAX  EMIN  ERAIN ECO2  EDEW  EWIND ENVNAME',
+                      # Modifications apply from the start of the planting year.
+                      ' 1 %s %s %s %s %s %s %s %s %s %s' % (
+                          f(planting_date[0:2] + '001'), f(env.get('eday')), f(env.get('erad')),
+                          f(env.get('emax')), f(env.get('emin')), f(env.get('erain')), f(env.get('eco2')),
+                          f(env.get('edew')), f(env.get('ewind')), env.get('envnam', '-99'))]
+
+        if harvests:
+            lines += ['', '*HARVEST DETAILS', '@H HDATE  HSTG  HCOM HSIZE   HPC  HBPC HNAME']
+            for harvest in harvests:
+                lines.append(' 1 %s %s %s %s %s %s %s' % (
+                    f(d(harvest['date'])), f(harvest.get('hastg', 'GS000')), f(harvest.get('hacom')),
+                    f(harvest.get('hasiz')), f(harvest.get('happc')), f(harvest.get('habpc')),
+                    harvest.get('ha_name', '-99')))
+
+        general, options, methods = control['general'], control['options'], control['methods']
+        management, outputs, planting_auto = control['management'], control['outputs'], control['planting']
+        irrigation_auto, nitrogen_auto = control['irrigation'], control['nitrogen']
+        residues_auto, harvests_auto = control['residues'], control['harvests']
+
+        def section(name, values):
+            return ' 1 %-11s %s' % (name, ' '.join([f(v) for v in values]))
+
+        lines += ['', '*SIMULATION CONTROLS',
+                  '@N GENERAL     NYERS NREPS START SDATE RSEED SNAME.................... SMODEL',
+                  ' 1 GE          %s %s %s %s %s %-25s %s' % (
+                      f(num_years), f(general.get('nreps')), f(general.get('start')), f(planting_date),
+                      f(general.get('rseed')), general.get('sname', '-99')[0:25], general.get('smodel', '')),
+                  '@N OPTIONS     WATER NITRO SYMBI PHOSP POTAS DISES  CHEM  TILL   CO2',
+                  section('OP', [options.get(k) for k in ['water', 'nitro', 'symbi', 'phosp', 'potas', 'dises',
+                                                          'chem', 'till', 'co2']]),
+                  '@N METHODS     WTHER INCON LIGHT EVAPO INFIL PHOTO HYDRO NSWIT MESOM MESEV MESOL',
+                  section('ME', [methods.get(k) for k in ['wther', 'incon', 'light', 'evapo', 'infil', 'photo',
+                                                          'hydro', 'nswit', 'mesom', 'mesev', 'mesol']]),
+                  '@N MANAGEMENT  PLANT IRRIG FERTI RESID HARVS',
+                  section('MA', [management.get(k) for k in ['plant', 'irrig', 'ferti', 'resid', 'harvs']]),
+                  '@N OUTPUTS     FNAME OVVEW SUMRY FROPT GROUT CAOUT WAOUT NIOUT MIOUT DIOUT VBOSE CHOUT OPOUT',
+                  section('OU', [outputs.get(k) for k in ['fname', 'ovvew', 'sumry', 'fropt', 'grout', 'caout',
+                                                          'waout', 'niout', 'miout', 'diout', 'vbose', 'chout',
+                                                          'opout']]),
+                  '',
+                  '@  AUTOMATIC MANAGEMENT',
+                  '@N PLANTING    PFRST PLAST PH2OL PH2OU PH2OD PSTMX PSTMN',
+                  section('PL', [planting_date, planting_date] +
+                          [planting_auto.get(k) for k in ['ph2ol', 'ph2ou', 'ph2od', 'pstmx', 'pstmn']]),
+                  '@N IRRIGATION  IMDEP ITHRL ITHRU IROFF IMETH IRAMT IREFF',
+                  section('IR', [irrigation_auto.get(k) for k in ['imdep', 'ithrl', 'ithru', 'iroff', 'imeth',
+                                                                  'iramt', 'ireff']]),
+                  '@N NITROGEN    NMDEP NMTHR NAMNT NCODE NAOFF',
+                  section('NI', [nitrogen_auto.get(k) for k in ['nmdep', 'nmthr', 'namnt', 'ncode', 'naoff']]),
+                  '@N RESIDUES    RIPCN RTIME RIDEP',
+                  section('RE', [residues_auto.get(k) for k in ['ripcn', 'rtime', 'ridep']]),
+                  '@N HARVEST     HFRST HLAST HPCNP HPCNR',
+                  section('HA', [harvests_auto.get(k) for k in ['hfrst', 'hlday', 'hpcnp', 'hpcnr']])]
+
+        with open(output_file_path, mode='w') as exp_file:
+            exp_file.write('\n'.join(lines) + '\n')
+
+    @staticmethod
+    def write_sol(soil, output_file_path):
+        """
+        Writes a DSSAT soil file with a single soil profile.
+        :param soil: The soil dictionary (the first element of the soil file "soils" list).
+        """
+        f = DSSATExpWriter.fmt
+        layers = soil['soilLayer']
+
+        lines = ['*SOILS: PRinde', '',
+                 '*%-10s  %-11s %-5s %s %s' % (soil['soil_id'], soil.get('sl_source', '-99')[0:11],
+                                                soil.get('sltx', '-99'), f(float(layers[-1]['sllb'])),
+                                                soil.get('classification', '-99')),
+                 '@SITE        COUNTRY          LAT     LONG SCS FAMILY',
+                 ' %-11s %-12s %s %s %s' % (soil.get('sl_loc_3', '-99')[0:11], soil.get('sl_loc_1', '-99')[0:12],
+                                            f(soil.get('soil_lat'), 8), f(soil.get('soil_long'), 8),
+                                            soil.get('classification', '-99')),
+                 '@ SCOM  SALB  SLU1  SLDR  SLRO  SLNF  SLPF  SMHB  SMPX  SMKE',
+                 ' %s %s %s %s %s %s %s %s %s %s' % (f(soil.get('sscol')), f(soil.get('salb')), f(soil.get('slu1')),
+                                                     f(soil.get('sldr')), f(soil.get('slro')), f(soil.get('slnf')),
+                                                     f(soil.get('slpf')), f(soil.get('smhb')), f(soil.get('smpx')),
+                                                     f(soil.get('smke'))),
+                 '@  SLB  SLMH  SLLL  SDUL  SSAT  SRGF  SSKS  SBDM  SLOC  SLCL  SLSI  SLCF  SLNI  SLHW  SLHB  SCEC'
+                 '  SADC']
+
+        for layer in layers:
+            lines.append(' %s %s %s %s %s %s %s %s %s %s %s %s %s %s %s %s %s' % (
+                f(float(layer['sllb'])), f(layer.get('slmh')), f(layer.get('slll')), f(layer.get('sldul')),
+                f(layer.get('slsat')), f(layer.get('slrgf')), f(layer.get('sksat')), f(layer.get('slbdm')),
+                f(layer.get('sloc')), f(layer.get('slcly')), f(layer.get('slsil')), f(layer.get('slcf')),
+                f(layer.get('slni')), f(layer.get('slphw')), f(layer.get('slphb')), f(layer.get('slcec')),
+                f(layer.get('sladc'))))
+
+        with open(output_file_path, mode='w') as sol_file:
+            sol_file.write('\n'.join(lines) + '\n')
@@ -0,0 +1,255 @@
+import os
+import re
+import numpy as np
+
+__author__ = 'Federico Schmidt'
+
+
+class DSSATOutReader:
+    """
+    Reads the output files of a DSSAT execution: Summary.OUT, with a row for each run (one per treatment and simulated
+    year), and the daily files (PlantGro.OUT, SoilWat.OUT, ET.OUT, etc.), with a table for each run.
+
+    Tables are fixed width: the rows of a table are loaded in a character matrix and each column is sliced and
+    converted to numbers at once, only the requested columns are converted.
+    """
+    header_token = re.compile('\S+')
+    run_header = re.compile('^\*RUN\s+(\d+)')
+    summary_file_name = 'Summary.OUT'
+
+    def __init__(self):
+        pass
+
+    @staticmethod
+    def read_summary(file_path, variables=None):
+        """
+        :param variables: The columns to read besides RUNNO and TRNO (all of them if None).
+        :returns A dictionary with an array of values (one per run, in file order) for each column.
+        """
+        tables = DSSATOutReader.read_tables(file_path, variables=DSSATOutReader.with_run_columns(variables))
+        if len(tables) == 0:
+            raise RuntimeError('No runs found in DSSAT summary "%s".' % file_path)
+        return tables[0][1]
+
+    @staticmethod
+    def read_daily(file_path, variables=None):
+        """
+        :returns A list of (run number, table) tuples, a table being a dictionary with an array of values (one per day)
+        for each column. Dates are returned in the DATE column as YYDDD integers.
+        """
+        tables = DSSATOutReader.read_tables(file_path, variables=DSSATOutReader.with_date_columns(variables))
+        for run_number, table in tables:
+            table['DATE'] = (table.pop('YEAR') % 100) * 1000 + table.pop('DOY')
+        return tables
+
+    @staticmethod
+    def read_tables(file_path, variables=None):
+        """
+        Reads every table of a DSSAT output file, a table being the rows that follow a header line (starting with "@").
+        :param variables: The columns to read (all of them if None), columns not found in a table are ignored.
+        :returns A list of (run number, table) tuples, the run number being the one of the last "*RUN" line before the
+        table (or None).
+        """
+        tables = []
+        run_number = None
+        columns = None
+        rows = []
+
+        def end_table():
+            if columns is not None and len(rows) > 0:
+                tables.append((run_number, DSSATOutReader.parse_table(rows, columns, variables)))
+
+        with open(file_path) as out_file:
+            for line in out_file:
+                line = line.rstrip('\r\n')
+
+                if line.startswith('@'):
+                    end_table()
+                    columns = DSSATOutReader.columns(line)
+                    rows = []
+                    continue
+
+                if line.startswith('*'):
+                    end_table()
+                    columns = None
+                    run = DSSATOutReader.run_header.match(line)
+                    if run:
+                        run_number = int(run.group(1))
+                    continue
+
+                if columns is not None and len(line.strip()) > 0 and line[0] not in '!$':
+                    rows.append(line)
+        end_table()
+        return tables
+
+    @staticmethod
+    def columns(header):
+        """
+        Finds the columns of a header line. Values are right aligned to the end of their column name, or left aligned to
+        its start for text columns, so a column spans from the end of the previous column name to the end of its own.
+        :returns A list of (name, start, end) tuples.
+        """
+        columns = []
+        previous_end = 1
+
+        for token in DSSATOutReader.header_token.finditer(header):
+            if token.group() == '@':
+                continue
+            columns.append((token.group().strip('@.'), previous_end, token.end()))
+            previous_end = token.end()
+
+        # The last column (usually a text one) takes the rest of the line.
+        if len(columns) > 0:
+            name, start, end = columns[-1]
+            columns[-1] = (name, start, None)
+        return columns
+
+    @staticmethod
+    def parse_table(rows, columns, variables=None):
+        """
+        Parses the rows of a table.
+        :returns A dictionary with an array for each column: ints if every value is an integer, floats if every value is
+        a number and strings otherwise.
+        """
+        width = max([len(row) for row in rows])
+        # Character matrix with a row for each line (shorter lines are padded with nulls).
+        chars = np.array(rows, dtype='S%d' % width).view(np.uint8).reshape(len(rows), width)
+
+        table = {}
+        for name, start, end in columns:
+            if variables is not None and name not in variables:
+                continue
+            end = width if end is None else min(end, width)
+            if end <= start:
+                # The column is beyond the end of every row.
+                table[name] = np.array([''] * len(rows))
+                continue
+            values = np.ascontiguousarray(chars[:, start:end]).view('S%d' % (end - start)).ravel()
+            table[name] = DSSATOutReader.to_numbers(values)
+        return table
+
+    @staticmethod
+    def to_numbers(values):
+        try:
+            numbers = values.astype(np.float64)
+        except ValueError:
+            return np.char.strip(values)
+
+        if np.all(np.isfinite(numbers)) and np.all(numbers == np.floor(numbers)):
+            return numbers.astype(np.int64)
+        return numbers
+
+    @staticmethod
+    def with_run_columns(variables):
+        if variables is None:
+            return None
+        return set(variables) | {'RUNNO', 'TRNO'}
+
+    @staticmethod
+    def with_date_columns(variables):
+        if variables is None:
+            return None
+        return set(variables) | {'YEAR', 'DOY'}
+
+    @staticmethod
+    def cycle_results(summary, variables, scenario_indexes, num_years=1):
+        """
+        Groups the runs of an experiment written by DSSATExpWriter (one treatment per weather scenario) by scenario.
+        :param summary: The summary table (see read_summary).
+        :param variables: The variables to extract.
+        :param scenario_indexes: The weather scenario of each treatment, in treatment order.
+        :returns A dictionary that maps each scenario index to the values of each variable, or to a list of values (one
+        per year) if num_years is greater than one.
+        """
+        for var in variables:
+            if var not in summary:
+                raise RuntimeError('Variable "%s" not found in DSSAT summary.' % var)
+
+        trno = summary['TRNO']
+        if np.any(trno < 1) or np.any(trno > len(scenario_indexes)):
+            raise RuntimeError('Unexpected treatment number in DSSAT summary (%s).' % trno.tolist())
+
+        runs_count = np.bincount(trno, minlength=len(scenario_indexes) + 1)[1:]
+        if np.any(runs_count != num_years):
+            raise RuntimeError('Expected %d runs for each scenario in DSSAT summary, found %s.' %
+                               (num_years, runs_count.tolist()))
+
+        # Sort runs by treatment and by run number (ie. by year) inside each treatment.
+        order = np.lexsort((summary['RUNNO'], trno))
+        results = dict([(scen_idx, {}) for scen_idx in scenario_indexes])
+
+        for var in variables:
+            values = summary[var][order].reshape(len(scenario_indexes), num_years).tolist()
+            for scen_idx, scenario_values in zip(scenario_indexes, values):
+                results[scen_idx][var] = scenario_values[0] if num_years == 1 else scenario_values
+        return results
+
+    @staticmethod
+    def daily_results(daily_tables, summary, variables, scenario_indexes, omitted_value=0):
+        """
+        Groups the daily values of the runs of an experiment by scenario. Days with the omitted value are not included
+        (as the pSIMS DailyOUT2Mongo hook does), the years of a scenario are concatenated.
+        :param daily_tables: The (run number, table) tuples of every daily file (see read_daily).
+        :param summary: The summary table, used to find the treatment of each run.
+        :returns A dictionary that maps each scenario index to a {'dates': [...], 'values': [...]} dictionary for each
+        variable.
+        """
+        run_treatments = dict(zip(summary['RUNNO'].tolist(), summary['TRNO'].tolist()))
+        results = dict([(scen_idx, dict([(var, {'dates': [], 'values': []}) for var in variables]))
+                        for scen_idx in scenario_indexes])
+        found_variables = set()
+        # (run number, variable) pairs already read, a variable is read from the first file that has it.
+        read_variables = set()
+
+        for run_number, table in sorted(daily_tables, key=lambda t: t[0]):
+            if run_number not in run_treatments:
+                raise RuntimeError('Daily output of run %s not found in DSSAT summary.' % run_number)
+            scenario_results = results[scenario_indexes[run_treatments[run_number] - 1]]
+
+            for var in variables:
+                if var not in table or (run_number, var) in read_variables:
+                    continue
+                found_variables.add(var)
+                read_variables.add((run_number, var))
+                kept_days = table[var] != omitted_value
+                scenario_results[var]['dates'].extend(table['DATE'][kept_days].tolist())
+                scenario_results[var]['values'].extend(table[var][kept_days].tolist())
+
+        missing_variables = set(variables) - found_variables
+        if len(missing_variables) > 0:
+            raise RuntimeError('Daily variables not found in DSSAT outputs: %s.' % ', '.join(sorted(missing_variables)))
+        return results
+
+    @staticmethod
+    def read_results(output_path, cycle_variables, daily_variables, scenario_indexes, num_years=1):
+        """
+        Reads the results of an experiment from the output files of a DSSAT execution.
+        :returns The cycle and daily results of each scenario (see cycle_results and daily_results).
+        """
+        summary = DSSATOutReader.read_summary(os.path.join(output_path, DSSATOutReader.summary_file_name),
+                                              variables=cycle_variables)
+        cycle_results = DSSATOutReader.cycle_results(summary, cycle_variables, scenario_indexes, num_years=num_years)
+
+        daily_results = None
+        if len(daily_variables) > 0:
+            daily_tables = []
+            for file_name in sorted(os.listdir(output_path)):
+                if not file_name.upper().endswith('.OUT') or file_name == DSSATOutReader.summary_file_name:
+                    continue
+                file_path = os.path.join(output_path, file_name)
+                if DSSATOutReader.has_columns(file_path, ['YEAR', 'DOY'], daily_variables):
+                    daily_tables.extend(DSSATOutReader.read_daily(file_path, variables=daily_variables))
+            daily_results = DSSATOutReader.daily_results(daily_tables, summary, daily_variables, scenario_indexes)
+        return cycle_results, daily_results
+
+    @staticmethod
+    def has_columns(file_path, required_columns, any_columns):
+        """
+        Checks whether the first table of an output file has all the required columns and any of the other ones.
+        """
+        with open(file_path) as out_file:
+            for line in out_file:
+                if line.startswith('@'):
+                    names = set([name for name, start, end in DSSATOutReader.columns(line.rstrip('\r\n'))])
+                    return names.issuperset(required_columns) and len(names.intersection(any_columns)) > 0
+        return False
@@ -1,4 +1,4 @@
-from datetime import date, datetime
+from datetime import datetime
 import os
 import csv
 import numpy as np
@@ -42,78 +42,138 @@ class DSSATWthWriter:
 
     @staticmethod
     def write_wth_file(scenario_index, file_rows_content, output_file_path, location, write_original_date=False):
+        """
+        Writes a weather file from a stream of rows, the first one being the header with the variable names.
+        This is an adapter around write_wth_array, kept for row producers (database cursors and CSV readers).
+        """
+        series = DSSATWthWriter.series_from_rows(file_rows_content, write_original_date)
+        return DSSATWthWriter.write_wth_array(scenario_index, series, output_file_path, location, write_original_date)
+
+    @staticmethod
+    def series_dtype(write_original_date=False):
+        """
+        Returns the NumPy structured type of a weather series: dates as datetime64 and values as floats.
+        """
+        fields = [('fecha', 'M8[D]'), ('rad', 'f8'), ('tmax', 'f8'), ('tmin', 'f8'), ('prcp', 'f8')]
+        if write_original_date:
+            fields.append(('fecha_original', 'M8[D]'))
+        return np.dtype(fields)
+
+    @staticmethod
+    def create_series(fecha, rad, tmax, tmin, prcp, fecha_original=None):
+        """
+        Builds a structured weather series array from its columns.
+        :param fecha: Dates, either datetime64 values or anything NumPy can convert to them (date objects, ISO strings).
+        """
+        series = np.empty(len(fecha), dtype=DSSATWthWriter.series_dtype(fecha_original is not None))
+        series['fecha'] = DSSATWthWriter.to_datetime64(fecha)
+        series['rad'] = rad
+        series['tmax'] = tmax
+        series['tmin'] = tmin
+        series['prcp'] = prcp
+        if fecha_original is not None:
+            series['fecha_original'] = DSSATWthWriter.to_datetime64(fecha_original)
+        return series
+
+    @staticmethod
+    def to_datetime64(dates):
+        dates = np.asarray(dates)
+        if dates.dtype == np.dtype('M8[D]'):
+            return dates
+        # Go through microseconds so datetime objects are also accepted, then truncate to days.
+        return dates.astype('M8[us]').astype('M8[D]')
+
+    @staticmethod
+    def check_variables(variables, write_original_date=False):
+        """
+        Raises a RuntimeError if any of the expected variables (and fecha_original, if it's written) is missing.
+        """
+        expected_var_set = DSSATWthWriter.expected_var_set
+        if write_original_date:
+            expected_var_set = expected_var_set | {'fecha_original'}
+
+        if not expected_var_set.issubset(variables):
+            raise RuntimeError("The variables in the weather stream (%s) don't match the expected ones (%s)"
+                               "." % (list(variables), DSSATWthWriter.expected_variables))
+
+    @staticmethod
+    def series_from_rows(file_rows_content, write_original_date=False):
+        _expected_variables = DSSATWthWriter.expected_variables
+        if write_original_date:
+            _expected_variables = DSSATWthWriter.expected_variables + ['fecha_original']
+
+        rows = iter(file_rows_content)
+        csv_variables = list(next(rows))
+
+        # Check that the header variables match the expected variables.
+        DSSATWthWriter.check_variables(csv_variables, write_original_date)
+
+        columns = zip(*rows)
+        if len(columns) == 0:
+            raise RuntimeError('The weather stream has no rows.')
+
+        csv_content = dict()
+        for var_name in _expected_variables:
+            values = columns[csv_variables.index(var_name)]
+
+            if var_name not in ('fecha', 'fecha_original'):
+                values = np.array(values, dtype=np.float64)
+                if np.isnan(values).any():
+                    raise RuntimeError('Found missing values for variable "%s" in the weather stream.' % var_name)
+            csv_content[var_name] = values
+
+        return DSSATWthWriter.create_series(fecha_original=csv_content.get('fecha_original'), **dict(
+            [(v, csv_content[v]) for v in DSSATWthWriter.expected_variables]
+        ))
+
+    @staticmethod
+    def write_wth_array(scenario_index, series, output_file_path, location, write_original_date=False):
+        """
+        Writes a weather file from a structured series array (see series_dtype). Dates codes, TAV and AMP are computed
+        with vectorized operations and the file body is formatted in memory and written with a single call.
+        :returns A dictionary with the written variables, dates are converted to DSSAT's YYDDD integer codes.
+        """
+        DSSATWthWriter.check_variables(series.dtype.names or (), write_original_date)
+
         lat = float(location['coord_y'])
         lon = float(location['coord_x'])
 
         filler, filler2 = -99, 10  # used for ELEV, REFHT, WNDHT, respectively
         var_names = ['SRAD', 'TMAX', 'TMIN', 'RAIN']
 
-        _expected_variables = DSSATWthWriter.expected_variables
-        _expected_variables_set = DSSATWthWriter.expected_var_set
         _variables_format = ['%.5d'] + ['%6.1f'] * len(var_names)
         if write_original_date:
-            _expected_variables = DSSATWthWriter.expected_variables + ['fecha_original']
-            _expected_variables_set.add('fecha_original')
             _variables_format += ['     !%2.d']
 
+        nt = len(series)
+        dates = series['fecha']
+        years = dates.astype('M8[Y]')
+        months = dates.astype('M8[M]').astype(int) % 12
+
         csv_content = dict()
-        csv_variables = []
-        months = []
-
-        for r_index, row in enumerate(file_rows_content):
-                if r_index == 0:
-                    # Header
-                    csv_variables = row
-
-                    # Check that the header variables match the expected variables.
-                    if len(_expected_variables_set.intersection(csv_variables)) != len(_expected_variables):
-                        raise RuntimeError("The variables in the weather stream (%s) don't match the expected ones (%s)"
-                                           "." % (csv_variables, DSSATWthWriter.expected_variables))
-
-                    for column in row:
-                        csv_content[column] = []
-
-                else:
-                    for v, value in enumerate(row):
-                        var_name = csv_variables[v]
-
-                        if var_name not in DSSATWthWriter.expected_variables:
-                            continue
-
-                        if var_name == 'fecha':
-                            dt = value
-                            if not isinstance(value, date):
-                                dt = datetime.strptime(value, '%Y-%m-%d')
-                            csv_content[var_name].append(int(dt.strftime("%y%j")))
-                            months.append(dt.month)
-                        elif var_name == 'fecha_original':
-                            dt = value
-                            if not isinstance(value, date):
-                                dt = datetime.strptime(value, '%Y-%m-%d')
-                            csv_content[var_name].append(int(dt.strftime("%Y%m%d")))
-                        else:
-                            csv_content[var_name].append(float(value))
-
-        nt = len(csv_content['fecha'])
-        tmin, tmax = np.array(csv_content['tmin']), np.array(csv_content['tmax'])
-        months = np.array(months)
+        # DSSAT dates are "%y%j" integers (eg. 15032 for February 1st, 2015).
+        csv_content['fecha'] = ((years.astype(int) + 1970) % 100) * 1000 + (dates - years).astype(int) + 1
+        for v in DSSATWthWriter.expected_variables[1:]:
+            csv_content[v] = series[v]
+
+        tmin, tmax = csv_content['tmin'], csv_content['tmax']
         tav = float(0.5 * (tmin.sum() + tmax.sum()) / nt)  # function of scen
 
         # compute amp
-        month_averages = []
-        for j in range(1, 13):
-            month_indexes = np.where(months == j)[0]
-            t = 0.5 * (tmin[month_indexes].sum() + tmax[month_indexes].sum()) / len(month_indexes)
-            month_averages.append(t)
-        amp = max(month_averages) - min(month_averages)
-
-        data = None
-        for index, v in enumerate(DSSATWthWriter.expected_variables):
-            if index == 0:
-                data = (csv_content[v], )
-                continue
-            data = data + (csv_content[v], )
-        data = np.column_stack(data)
+        month_counts = np.bincount(months, minlength=12)
+        month_sums = np.bincount(months, weights=tmin, minlength=12) + np.bincount(months, weights=tmax, minlength=12)
+        present_months = month_counts > 0
+        month_averages = 0.5 * month_sums[present_months] / month_counts[present_months]
+        amp = month_averages.max() - month_averages.min()
+
+        columns = [csv_content[v] for v in DSSATWthWriter.expected_variables]
+        if write_original_date:
+            original_dates = series['fecha_original']
+            original_months = original_dates.astype('M8[M]')
+            csv_content['fecha_original'] = (original_dates.astype('M8[Y]').astype(int) + 1970) * 10000 + \
+                                            (original_months.astype(int) % 12 + 1) * 100 + \
+                                            (original_dates - original_months).astype(int) + 1
+            columns.append(csv_content['fecha_original'])
 
         filename = os.path.join(output_file_path, ('WTH' + str(scenario_index).zfill(5) + '.WTH'))
 
@@ -126,13 +186,16 @@ class DSSATWthWriter:
         head += '%6d' % filler + '%6d' % filler2 + '\n'
         head += '@DATE' + ''.join(['%6s' % v for v in var_names]) + '\n'
 
+        # Format every row at once: a row format repeated nt times applied to the row-major flattened values.
+        row_format = ''.join(_variables_format) + '\n'
+        body = (row_format * nt) % tuple(np.column_stack(columns).ravel().tolist())
+
         if os.path.exists(filename):
             raise RuntimeError('Attempted to write a weather file that was already created (%s).\n'
                                'Increase the weather grid resolution to avoid collisions.' % filename)
         # write body
         with open(filename, 'w') as f:
-            f.write(head)
-            np.savetxt(f, data, fmt=_variables_format, delimiter='')
+            f.write(head + body)
 
         return csv_content
 
@@ -1,5 +1,15 @@
 # coding=utf-8
 import os
+import stat
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        # Backport of os.scandir for Python 2 (pip install scandir).
+        from scandir import scandir
+    except ImportError:
+        scandir = None
 
 __author__ = 'Federico Schmidt'
 
@@ -30,6 +40,45 @@ def listdir_fullpath(d, onlyFiles=False, recursive=False, filter=None):
     return full_path
 
 
+def scan_tree(d, filter=None):
+    """
+    Walks a directory tree in a single pass, with os.scandir if it's available (it doesn't have to stat an entry to know
+    if it's a directory) or with a single stat per entry otherwise.
+    @param d: the root directory.
+    @param filter: a function that receives a file path and returns whether it should be included.
+    @return: a tuple with a list of (path, mtime) for every file and a dictionary of path -> mtime for every directory
+    of the tree (including the root).
+    """
+    files = []
+    dirs = {d: os.path.getmtime(d)}
+    pending = [d]
+
+    while len(pending) > 0:
+        folder = pending.pop()
+
+        if scandir:
+            entries = ((e.path, e.is_dir(), e.is_file(), e.stat) for e in scandir(folder))
+        else:
+            entries = (_stat_entry(os.path.join(folder, f)) for f in os.listdir(folder))
+
+        for path, is_dir, is_file, get_stat in entries:
+            if is_dir:
+                dirs[path] = get_stat().st_mtime
+                pending.append(path)
+            elif is_file and (not filter or filter(path)):
+                files.append((path, get_stat().st_mtime))
+    return files, dirs
+
+
+def _stat_entry(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        # Broken symlink.
+        return path, False, False, None
+    return path, stat.S_ISDIR(st.st_mode), stat.S_ISREG(st.st_mode), lambda: st
+
+
 def clean_folder(folder, onlyfiles=False):
     """
     Vacía el contenido de una carpeta de ser posible.
@@ -2,6 +2,7 @@ from abc import abstractmethod
 import time
 from datetime import datetime
 import copy
+from core.lib.metrics import registry
 
 __author__ = 'Federico Schmidt'
 
@@ -20,6 +21,9 @@ JOB_STATUS_FINISHED = 3
 JOB_STATUS_ERROR = 4
 JOB_STATUS_INACTIVE = 5
 
+job_duration = registry.histogram('prinde_job_duration_seconds', 'Duration of the jobs and subjobs that ended.',
+                                  ['kind', 'status'], buckets=(1, 5, 15, 30, 60, 300, 900, 1800, 3600, 7200, 14400))
+
 
 class ProgressObserver(object):
     @abstractmethod
@@ -68,6 +72,13 @@ class ProgressMonitor(ProgressObserver):
         self.job_status = JOB_STATUS_INACTIVE
         self.sub_jobs = {}
 
+    @property
+    def job_id(self):
+        """
+        The id of the monitored job (None if the monitor isn't attached to a job), used to identify lock holders.
+        """
+        return self.job.id if self.job else None
+
     def job_started(self, initial_status=None):
         if not initial_status:
             initial_status = JOB_STATUS_RUNNING
@@ -98,6 +109,10 @@ class ProgressMonitor(ProgressObserver):
         if end_status != JOB_STATUS_ERROR:
             end_status = JOB_STATUS_FINISHED
         self.job_status = end_status
+        job_duration.observe(time.time() - self.start_time, labels={
+            'kind': 'subjob' if self.job and self.job.parent_job else 'job',
+            'status': 'error' if end_status == JOB_STATUS_ERROR else 'finished'
+        })
         self._set_progress(self.end_value, JOB_ENDED)
 
     def add_subjob(self, subjob_progress_monitor, job_name=None):
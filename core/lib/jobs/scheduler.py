@@ -1,10 +1,16 @@
+from apscheduler.events import EVENT_JOB_EXECUTED, EVENT_JOB_ERROR, EVENT_JOB_MISSED
 from apscheduler.schedulers.background import BackgroundScheduler
 
 from core.lib.jobs.base import MonitoredFunctionJob, BaseJob
 from core.lib.jobs.monitor import ProgressMonitor, EVENT_ALL
+from core.lib.metrics import registry
 
 __author__ = 'Federico Schmidt'
 
+scheduled_jobs = registry.gauge('prinde_scheduler_jobs', 'Jobs in the scheduler queue (pending or periodic).')
+added_jobs = registry.counter('prinde_scheduler_jobs_added_total', 'Jobs added to the scheduler.')
+job_runs = registry.counter('prinde_scheduler_job_runs_total', 'Scheduled job runs, by outcome.', ['outcome'])
+
 
 class MonitoringScheduler(BackgroundScheduler):
 
@@ -12,6 +18,9 @@ class MonitoringScheduler(BackgroundScheduler):
         super(MonitoringScheduler, self).__init__(*args, **kwargs)
         self._progress_listeners = []
 
+        scheduled_jobs.set_function(lambda: len(self.get_jobs()))
+        self.add_listener(MonitoringScheduler.count_job_run, EVENT_JOB_EXECUTED | EVENT_JOB_ERROR | EVENT_JOB_MISSED)
+
     def add_job(self, func, name=None, *args, **kwargs):
         """
         Adds a job to the scheduler. The func param can be either a function/method or a BaseJob instance.
@@ -28,6 +37,7 @@ class MonitoringScheduler(BackgroundScheduler):
         j = BackgroundScheduler.add_job(self, job.start, name=(name or job.name), *args, **kwargs)
         job.id = j.id
         job.name = j.name
+        added_jobs.inc()
 
         for l in self._progress_listeners:
             job.progress_monitor.add_listener(l['listener'], mask=l['mask'])
@@ -36,3 +46,12 @@ class MonitoringScheduler(BackgroundScheduler):
 
     def add_progress_listener(self, l, mask=EVENT_ALL):
         self._progress_listeners.append({'mask': mask, 'listener': l})
+
+    @staticmethod
+    def count_job_run(event):
+        if event.code & EVENT_JOB_MISSED:
+            job_runs.inc(labels={'outcome': 'missed'})
+        elif event.code & EVENT_JOB_ERROR:
+            job_runs.inc(labels={'outcome': 'error'})
+        else:
+            job_runs.inc(labels={'outcome': 'executed'})
@@ -0,0 +1,207 @@
+from __future__ import absolute_import
+import logging
+import threading
+from bisect import bisect_left
+from core.lib.utils.log import log_format_exception
+
+__author__ = 'Federico Schmidt'
+
+
+class Metric(object):
+    """
+    A metric with a value for each combination of its labels values (label values are given as a dictionary with a
+    value for every label name).
+    """
+    metric_type = None
+
+    def __init__(self, name, documentation, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.lock = threading.Lock()
+        # Label values tuple -> value.
+        self.values = dict()
+
+    def label_values(self, labels):
+        labels = labels or {}
+        if set(labels.keys()) != set(self.label_names):
+            raise RuntimeError('Metric "%s" expects the labels %s (got %s).' %
+                               (self.name, list(self.label_names), sorted(labels.keys())))
+        return tuple([unicode(labels[name]) for name in self.label_names])
+
+    def samples(self):
+        """
+        :returns A list of (name suffix, labels, value) tuples, labels being a list of (name, value) pairs.
+        """
+        with self.lock:
+            return [('', zip(self.label_names, label_values), value)
+                    for label_values, value in sorted(self.values.items())]
+
+
+class Counter(Metric):
+    metric_type = 'counter'
+
+    def inc(self, amount=1, labels=None):
+        if amount < 0:
+            raise RuntimeError('Counter "%s" can only be increased (amount=%s).' % (self.name, amount))
+        label_values = self.label_values(labels)
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+
+class Gauge(Metric):
+    """
+    A value that goes up and down. Its value can be set by the instrumented code or read when the metrics are exported,
+    calling a function (see set_function).
+    """
+    metric_type = 'gauge'
+
+    def __init__(self, name, documentation, label_names=()):
+        super(Gauge, self).__init__(name, documentation, label_names)
+        # Label values tuple -> function that returns the value.
+        self.functions = dict()
+
+    def set(self, value, labels=None):
+        label_values = self.label_values(labels)
+        with self.lock:
+            self.values[label_values] = value
+
+    def inc(self, amount=1, labels=None):
+        label_values = self.label_values(labels)
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def dec(self, amount=1, labels=None):
+        self.inc(-amount, labels=labels)
+
+    def set_function(self, function, labels=None):
+        label_values = self.label_values(labels)
+        with self.lock:
+            self.functions[label_values] = function
+
+    def samples(self):
+        samples = super(Gauge, self).samples()
+
+        with self.lock:
+            functions = sorted(self.functions.items())
+        for label_values, function in functions:
+            try:
+                samples.append(('', zip(self.label_names, label_values), function()))
+            except Exception:
+                logging.getLogger().error('Failed to read the value of gauge "%s". Reason: %s' %
+                                          (self.name, log_format_exception()))
+        return samples
+
+
+class Histogram(Metric):
+    """
+    Counts observations (eg. durations) in cumulative buckets, with their sum and count.
+    """
+    metric_type = 'histogram'
+    default_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+    def __init__(self, name, documentation, label_names=(), buckets=None):
+        super(Histogram, self).__init__(name, documentation, label_names)
+        if 'le' in self.label_names:
+            raise RuntimeError('Histogram "%s" can\'t have a label named "le".' % name)
+        self.buckets = sorted(buckets or self.default_buckets)
+
+    def observe(self, value, labels=None):
+        label_values = self.label_values(labels)
+        with self.lock:
+            if label_values not in self.values:
+                self.values[label_values] = {'buckets': [0] * (len(self.buckets) + 1), 'sum': 0., 'count': 0}
+            histogram = self.values[label_values]
+            histogram['buckets'][bisect_left(self.buckets, value)] += 1
+            histogram['sum'] += value
+            histogram['count'] += 1
+
+    def samples(self):
+        samples = []
+        with self.lock:
+            for label_values, histogram in sorted(self.values.items()):
+                labels = zip(self.label_names, label_values)
+                cumulative_count = 0
+                for bound, count in zip(self.buckets + [float('inf')], histogram['buckets']):
+                    cumulative_count += count
+                    samples.append(('_bucket', labels + [('le', bound)], cumulative_count))
+                samples.append(('_sum', labels, histogram['sum']))
+                samples.append(('_count', labels, histogram['count']))
+        return samples
+
+
+class MetricsRegistry(object):
+    """
+    The metrics of the system, exported in the Prometheus text format (see text_format).
+
+    Metrics are created (or looked up, if a metric with the same name was already created) with the counter, gauge and
+    histogram methods, so modules can declare the metrics they feed at import time.
+    """
+    content_type = 'text/plain; version=0.0.4; charset=utf-8'
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = dict()
+
+    def counter(self, name, documentation, label_names=()):
+        return self.__metric__(Counter, name, documentation, label_names)
+
+    def gauge(self, name, documentation, label_names=()):
+        return self.__metric__(Gauge, name, documentation, label_names)
+
+    def histogram(self, name, documentation, label_names=(), buckets=None):
+        return self.__metric__(Histogram, name, documentation, label_names, buckets=buckets)
+
+    def __metric__(self, metric_class, name, documentation, label_names, **kwargs):
+        with self.lock:
+            if name in self.metrics:
+                metric = self.metrics[name]
+                if not isinstance(metric, metric_class) or metric.label_names != tuple(label_names):
+                    raise RuntimeError('Metric "%s" was already registered as a %s with labels %s.' %
+                                       (name, metric.metric_type, list(metric.label_names)))
+                return metric
+
+            metric = metric_class(name, documentation, label_names, **kwargs)
+            self.metrics[name] = metric
+            return metric
+
+    def text_format(self):
+        with self.lock:
+            metrics = sorted(self.metrics.items())
+
+        lines = []
+        for name, metric in metrics:
+            lines.append('# HELP %s %s' % (name, metric.documentation.replace('\\', '\\\\').replace('\n', '\\n')))
+            lines.append('# TYPE %s %s' % (name, metric.metric_type))
+            for suffix, labels, value in metric.samples():
+                lines.append('%s%s%s %s' % (name, suffix, MetricsRegistry.format_labels(labels),
+                                            MetricsRegistry.format_value(value)))
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def format_labels(labels):
+        if len(labels) == 0:
+            return ''
+        return '{%s}' % ','.join(['%s="%s"' % (name, MetricsRegistry.format_label_value(value))
+                                  for name, value in labels])
+
+    @staticmethod
+    def format_label_value(value):
+        if isinstance(value, (int, long, float)):
+            return MetricsRegistry.format_value(value)
+        return unicode(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+    @staticmethod
+    def format_value(value):
+        value = float(value)
+        if value == float('inf'):
+            return '+Inf'
+        if value == float('-inf'):
+            return '-Inf'
+        if value != value:
+            return 'NaN'
+        return repr(value)
+
+
+# The registry exported by the web server.
+registry = MetricsRegistry()
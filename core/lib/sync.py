@@ -1,7 +1,138 @@
 __author__ = 'Federico Schmidt'
 
+import copy
+import time
+import heapq
+import thread
+from bisect import bisect_left
+from collections import deque
+from datetime import datetime
 from contextlib import contextmanager
-from threading import RLock, Semaphore
+from itertools import count
+from threading import RLock, Event
+
+
+class WaitStats(object):
+    """
+    Wait times of the acquisitions of a priority class.
+    """
+    def __init__(self):
+        self.count = 0
+        self.timeouts = 0
+        self.total_wait = 0.
+        self.max_wait = 0.
+
+    def record(self, wait_time):
+        self.count += 1
+        self.total_wait += wait_time
+        self.max_wait = max(self.max_wait, wait_time)
+
+    def merge(self, other):
+        self.count += other.count
+        self.timeouts += other.timeouts
+        self.total_wait += other.total_wait
+        self.max_wait = max(self.max_wait, other.max_wait)
+
+    def view(self):
+        return {
+            'count': self.count,
+            'timeouts': self.timeouts,
+            'total_wait': self.total_wait,
+            'mean_wait': self.total_wait / self.count if self.count > 0 else 0.,
+            'max_wait': self.max_wait
+        }
+
+
+class LockMetrics(object):
+    """
+    Keeps the last max_records acquisitions of a lock (holder job id, priority class, queue depth when it was requested,
+    wait time and hold time), and rolling histograms of their wait and hold times by priority class: when an acquisition
+    is dropped from the records, it's also removed from the histograms.
+
+    Hold times are measured by thread, a lock must be released by the thread that acquired it.
+    """
+    # Upper bounds (in seconds) of the histogram buckets, the last bucket has no upper bound.
+    histogram_bounds = [0.01, 0.1, 1, 10, 60, 600, 3600]
+
+    def __init__(self, max_records=1000):
+        self.max_records = max_records
+        self.records = deque()
+        # Priority class -> {'wait': bucket counts, 'hold': bucket counts}.
+        self.histograms = dict()
+        # Thread id -> records of the locks held by the thread.
+        self.holders = dict()
+
+    def acquired(self, waiter, mode):
+        record = {
+            'job_id': waiter.job_id,
+            'mode': mode,
+            'priority': waiter.priority_class,
+            'queue_depth': waiter.queue_depth,
+            'requested_at': datetime.fromtimestamp(waiter.queued_time).strftime('%Y-%m-%d %H:%M:%S'),
+            'wait_time': time.time() - waiter.queued_time,
+            'hold_time': None
+        }
+        self.records.append(record)
+        self.__histogram_add__(record, 'wait', record['wait_time'], 1)
+        self.holders.setdefault(waiter.thread_id, []).append((record, time.time()))
+
+        if len(self.records) > self.max_records:
+            dropped = self.records.popleft()
+            self.__histogram_add__(dropped, 'wait', dropped['wait_time'], -1)
+            if dropped['hold_time'] is not None:
+                self.__histogram_add__(dropped, 'hold', dropped['hold_time'], -1)
+            dropped['dropped'] = True
+
+    def released(self, thread_id):
+        thread_records = self.holders.get(thread_id)
+        if not thread_records:
+            return
+        record, acquired_time = thread_records.pop()
+        if len(thread_records) == 0:
+            del self.holders[thread_id]
+
+        record['hold_time'] = time.time() - acquired_time
+        if not record.get('dropped', False):
+            self.__histogram_add__(record, 'hold', record['hold_time'], 1)
+
+    def __histogram_add__(self, record, histogram, seconds, value):
+        if record['priority'] not in self.histograms:
+            self.histograms[record['priority']] = {
+                'wait': [0] * (len(self.histogram_bounds) + 1),
+                'hold': [0] * (len(self.histogram_bounds) + 1)
+            }
+        self.histograms[record['priority']][histogram][bisect_left(self.histogram_bounds, seconds)] += value
+
+    def view(self, max_records=100):
+        """
+        :returns The histograms, the last max_records acquisitions (newest first) and the acquisitions that are still
+        held.
+        """
+        records = list(self.records)
+        return {
+            'histogram_bounds': self.histogram_bounds,
+            'histograms': copy.deepcopy(self.histograms),
+            'acquisitions': [dict(r) for r in reversed(records[-max_records:])] if max_records > 0 else [],
+            'holding': [dict(r) for r in records if r['hold_time'] is None]
+        }
+
+
+class LockWaiter(object):
+    """
+    A thread waiting for a lock, it's woken up by the thread that grants it the lock.
+    """
+    def __init__(self, priority_class, job_id=None, queue_depth=0):
+        self.priority_class = priority_class
+        self.job_id = job_id
+        self.queue_depth = queue_depth
+        self.thread_id = thread.get_ident()
+        self.queued_time = time.time()
+        self.granted = False
+        self.event = Event()
+
+    def grant(self):
+        self.granted = True
+        self.event.set()
 
 
 class PrioritizedRWLock(object):
@@ -9,91 +140,164 @@ class PrioritizedRWLock(object):
     Read-write lock. Writers go first, readers can read all at the same time.
     Writers access order is determined by priority.
 
+    Queued writers are kept in a heap. If priority_aging is greater than zero, a writer gains that amount of priority
+    for each minute it waits, so low priority writers aren't starved by a stream of higher priority ones. Every writer
+    ages at the same rate, so the order of two writers doesn't change while they wait and the heap key is fixed when a
+    writer is queued (priority - priority_aging * queued minutes). Writers with the same priority are FIFO.
+
+    Acquisitions may time out, and their wait times are recorded by priority class (see wait_stats). The last
+    acquisitions, with the job that requested them, are recorded too (see LockMetrics).
+
     Based on: https://hdknr.github.io/docs/django/modules/django/utils/synch.html#RWLock
     """
-    def __init__(self):
+    reader_class = 'reader'
+
+    def __init__(self, priority_aging=0, max_records=1000):
         self.inner_lock = RLock()
-        self.read_lock = Semaphore(0)
+        self.priority_aging = priority_aging
+        self.metrics = LockMetrics(max_records=max_records)
         self.active_readers = 0
         self.waiting_readers = 0
         self.active_writers = 0
-        self.queued_writers = dict()
+        # Heap of (key, sequence number, waiter) tuples.
+        self.queued_writers = []
+        self.readers_queue = deque()
+        self.sequence = count()
+        # Priority class -> WaitStats.
+        self.stats = dict()
 
-    def acquire_read(self):
+    def acquire_read(self, timeout=None, job_id=None):
+        """
+        :param timeout: Max seconds to wait for the lock (None waits forever).
+        :param job_id: The id of the job that requests the lock (see LockMetrics).
+        :returns True if the lock was acquired, False if it timed out.
+        """
         with self.inner_lock:
-            if self.active_writers == 0 and len(self.queued_writers) == 0:
+            waiter = LockWaiter(self.reader_class, job_id=job_id, queue_depth=self.queue_depth())
+            if self.active_writers == 0 and len(self.queued_writers) == 0 and self.__reader_slot_available__():
                 self.active_readers += 1
-                self.read_lock.release()
-            else:
-                self.waiting_readers += 1
-        self.read_lock.acquire()
-
-    def acquire_write(self, priority=0):
-        self.inner_lock.acquire()
-        # Check if a write lock can be acquired.
-        if self.active_writers == 0 and len(self.queued_writers) == 0 and self.active_readers == 0:
-            self.active_writers += 1
-            self.inner_lock.release()
-        else:
-            # Queue writer with it's own lock.
-            new_lock = Semaphore(0)
-            # Enqueue writer.
-            if priority in self.queued_writers:
-                self.queued_writers[priority].append(new_lock)
-            else:
-                self.queued_writers[priority] = [new_lock]
-            # We must release the inner lock before locking the writer, otherwise we could end up with a deadlock.
-            self.inner_lock.release()
-            # Calling new_lock.acquire() will lock the writer.
-            new_lock.acquire()
+                self.__acquired__(waiter)
+                return True
+            self.readers_queue.append(waiter)
+            self.waiting_readers += 1
+        return self.__wait__(waiter, timeout)
+
+    def acquire_write(self, priority=0, timeout=None, job_id=None):
+        """
+        :param timeout: Max seconds to wait for the lock (None waits forever).
+        :param job_id: The id of the job that requests the lock (see LockMetrics).
+        :returns True if the lock was acquired, False if it timed out.
+        """
+        with self.inner_lock:
+            waiter = LockWaiter(priority, job_id=job_id, queue_depth=self.queue_depth())
+            # Check if a write lock can be acquired.
+            if self.active_writers == 0 and len(self.queued_writers) == 0 and self.active_readers == 0:
+                self.active_writers += 1
+                self.__acquired__(waiter)
+                return True
+            # Queue writer with it's own event.
+            key = self.priority_aging * waiter.queued_time / 60. - priority
+            heapq.heappush(self.queued_writers, (key, next(self.sequence), waiter))
+        return self.__wait__(waiter, timeout)
 
     def release_read(self):
         with self.inner_lock:
             self.active_readers -= 1
-            if self.active_readers == 0 and len(self.queued_writers) != 0:
-                self.__unlock_writer__()
+            self.metrics.released(thread.get_ident())
+            self.__dispatch__()
 
     def release_write(self):
         with self.inner_lock:
             self.active_writers -= 1
-            if len(self.queued_writers) != 0:
-                # Writers go first, unlock the most prioritized writer.
+            self.metrics.released(thread.get_ident())
+            self.__dispatch__()
+
+    def queue_depth(self):
+        return len(self.queued_writers) + self.waiting_readers
+
+    def __reader_slot_available__(self):
+        return True
+
+    def __dispatch__(self):
+        """
+        Grants the lock to the waiting threads that can run now. Writers go first: the most prioritized writer is
+        unlocked once there are no active readers, waiting readers are only unlocked if there are no queued writers.
+        """
+        if self.active_writers > 0:
+            return
+
+        if len(self.queued_writers) > 0:
+            if self.active_readers == 0:
                 self.__unlock_writer__()
-            elif self.waiting_readers != 0:
-                # Release readers lock.
-                for i in range(0, self.waiting_readers):
-                    self.read_lock.release()
-                # Update active and waiting readers count.
-                self.active_readers += self.waiting_readers
-                self.waiting_readers = 0
+            return
+
+        while len(self.readers_queue) > 0 and self.__reader_slot_available__():
+            self.active_readers += 1
+            self.waiting_readers -= 1
+            self.readers_queue.popleft().grant()
 
     def __unlock_writer__(self):
         """
-        Releases the lock on the writer with the highest priority inside the queued_writers dict.
-
-        Priority is determined by sorting the dictionary's keys in descending order. If more than one writer with max
-         priority is found, the order is FIFO.
+        Releases the lock on the writer with the highest (aged) priority.
         """
         self.active_writers += 1
-        # Release a writer inside the highest priority group.
-        highest_priority = sorted(self.queued_writers, reverse=True)[0]
-        self.queued_writers[highest_priority].pop(0).release()
+        heapq.heappop(self.queued_writers)[2].grant()
+
+    def __wait__(self, waiter, timeout):
+        waiter.event.wait(timeout)
+
+        with self.inner_lock:
+            if waiter.granted:
+                self.__acquired__(waiter)
+                return True
+
+            # Timed out, stop waiting.
+            if waiter.priority_class == self.reader_class:
+                self.readers_queue.remove(waiter)
+                self.waiting_readers -= 1
+            else:
+                self.queued_writers = [w for w in self.queued_writers if w[2] is not waiter]
+                heapq.heapify(self.queued_writers)
+                # Readers may have been waiting only for this writer.
+                self.__dispatch__()
+            self.stats.setdefault(waiter.priority_class, WaitStats()).timeouts += 1
+            return False
 
-        if len(self.queued_writers[highest_priority]) == 0:
-            # Remove the highest priority section for it has no more writers waiting.
-            del self.queued_writers[highest_priority]
+    def __acquired__(self, waiter):
+        self.stats.setdefault(waiter.priority_class, WaitStats()).record(time.time() - waiter.queued_time)
+        self.metrics.acquired(waiter, 'read' if waiter.priority_class == self.reader_class else 'write')
+
+    def metrics_view(self, max_records=100):
+        """
+        :returns The wait statistics (see wait_stats) and the last acquisitions (see LockMetrics.view) of the lock.
+        """
+        with self.inner_lock:
+            view = self.metrics.view(max_records=max_records)
+            view['wait_stats'] = self.wait_stats()
+            view['queue_depth'] = self.queue_depth()
+            return view
+
+    def wait_stats(self):
+        """
+        :returns A dictionary with the wait statistics of each priority class (see WaitStats.view), readers are grouped
+        in the "reader" class.
+        """
+        with self.inner_lock:
+            return dict([(priority_class, stats.view()) for priority_class, stats in self.stats.iteritems()])
 
     @contextmanager
-    def reader(self):
-        self.acquire_read()
+    def reader(self, timeout=None, job_id=None):
+        if not self.acquire_read(timeout=timeout, job_id=job_id):
+            raise RuntimeError('Timed out waiting for read lock (timeout=%ss).' % timeout)
         try:
             yield
         finally:
             self.release_read()
 
     @contextmanager
-    def writer(self, priority=0):
-        self.acquire_write(priority)
+    def writer(self, priority=0, timeout=None, job_id=None):
+        if not self.acquire_write(priority, timeout=timeout, job_id=job_id):
+            raise RuntimeError('Timed out waiting for write lock (priority=%s, timeout=%ss).' % (priority, timeout))
         try:
             yield
         finally:
@@ -106,54 +310,143 @@ class JobsLock(PrioritizedRWLock):
     Ideal for controlling blocking tasks (writers) and parallel tasks (readers) with a maximum degree of parallelism.
     """
 
-    def __init__(self, max_parallel_tasks=1):
-        super(JobsLock, self).__init__()
+    def __init__(self, max_parallel_tasks=1, priority_aging=0, max_records=1000):
+        super(JobsLock, self).__init__(priority_aging=priority_aging, max_records=max_records)
         self.max_concurrent_readers = max_parallel_tasks
 
-    def acquire_read(self):
+    def __reader_slot_available__(self):
         """
         Readers (non blocking jobs) are restricted to a max parallel amount.
-        :return:
         """
+        return self.active_readers < self.max_concurrent_readers
+
+    # Create aliases for the reader and writer context managers.
+    def parallel_job(self, timeout=None, job_id=None):
+        return self.reader(timeout=timeout, job_id=job_id)
+
+    def blocking_job(self, priority=0, timeout=None, job_id=None):
+        return self.writer(priority, timeout=timeout, job_id=job_id)
+
+
+class ResourceLocks(object):
+    """
+    A PrioritizedRWLock for each named resource (eg. a weather station, a collection or a configuration file). Jobs
+    declare the resources they read (shared) and the ones they modify (exclusive), so jobs that don't need the same
+    resources run at the same time. Exclusive requests are ordered by priority, like JobsLock blocking jobs.
+
+    Locks are acquired in the order of their names, so jobs that request overlapping resources can't deadlock. A job
+    that already holds some resources may only request resources whose names sort after the ones it holds.
+    """
+    def __init__(self, priority_aging=0):
+        self.inner_lock = RLock()
+        self.priority_aging = priority_aging
+        self.locks = dict()
+
+    def lock(self, name):
         with self.inner_lock:
-            if self.active_writers == 0 and len(self.queued_writers) == 0 and \
-               self.active_readers < self.max_concurrent_readers:
-                self.active_readers += 1
-                self.read_lock.release()
+            if name not in self.locks:
+                self.locks[name] = PrioritizedRWLock(priority_aging=self.priority_aging)
+            return self.locks[name]
+
+    def acquire(self, shared=(), exclusive=(), priority=0, timeout=None, job_id=None):
+        """
+        Acquires a read lock on each shared resource and a write lock on each exclusive one (resources in both lists are
+        locked exclusively).
+        :param timeout: Max seconds to wait for all the resources (None waits forever).
+        :returns The acquired (name, exclusive) pairs, to be given to release, or None if it timed out (no resource is
+        kept locked).
+        """
+        exclusive = set(exclusive)
+        resources = sorted([(name, name in exclusive) for name in set(shared) | exclusive])
+        deadline = time.time() + timeout if timeout is not None else None
+
+        for idx, (name, is_exclusive) in enumerate(resources):
+            remaining = max(deadline - time.time(), 0) if deadline is not None else None
+            if is_exclusive:
+                acquired = self.lock(name).acquire_write(priority, timeout=remaining, job_id=job_id)
             else:
-                self.waiting_readers += 1
-        self.read_lock.acquire()
+                acquired = self.lock(name).acquire_read(timeout=remaining, job_id=job_id)
 
-    def release_write(self):
+            if not acquired:
+                self.release(resources[0:idx])
+                return None
+        return resources
+
+    def release(self, resources):
+        for name, is_exclusive in reversed(resources):
+            if is_exclusive:
+                self.lock(name).release_write()
+            else:
+                self.lock(name).release_read()
+
+    def queue_depth(self):
+        """
+        :returns The amount of requests waiting for any resource.
+        """
         with self.inner_lock:
-            self.active_writers -= 1
-            if len(self.queued_writers) != 0:
-                # Writers go first, unlock the most prioritized writer.
-                self.__unlock_writer__()
-            elif self.waiting_readers != 0:
-                # Release readers lock.
-                for i in range(0, min(self.waiting_readers, self.max_concurrent_readers)):
-                    self.read_lock.release()
-                    # Update active and waiting readers count.
-                    self.active_readers += 1
-                    self.waiting_readers -= 1
+            locks = self.locks.values()
+        return sum([lock.queue_depth() for lock in locks])
 
-    def release_read(self):
+    def wait_stats(self):
+        """
+        :returns The wait statistics of each priority class (see PrioritizedRWLock.wait_stats), of every resource.
+        """
         with self.inner_lock:
-            self.active_readers -= 1
-            if len(self.queued_writers) != 0:
-                if self.active_readers == 0:
-                    self.__unlock_writer__()
-            elif self.waiting_readers > 0:
-                # Release a reader.
-                self.read_lock.release()
-                # Update active and waiting readers count.
-                self.active_readers += 1
-                self.waiting_readers -= 1
+            locks = self.locks.values()
 
-    # Create aliases for the reader and writer context managers.
-    def parallel_job(self):
-        return self.reader()
+        stats = dict()
+        for lock in locks:
+            with lock.inner_lock:
+                for priority_class, lock_stats in lock.stats.iteritems():
+                    stats.setdefault(priority_class, WaitStats()).merge(lock_stats)
+        return dict([(priority_class, class_stats.view()) for priority_class, class_stats in stats.iteritems()])
+
+    def metrics_view(self, max_records=100):
+        """
+        Merges the metrics of every resource: histograms are added up and acquisitions have the name of their resource.
+        :returns The same view than PrioritizedRWLock.metrics_view, and the wait statistics of each resource.
+        """
+        with self.inner_lock:
+            locks = self.locks.items()
+
+        view = {
+            'histogram_bounds': LockMetrics.histogram_bounds,
+            'histograms': dict(),
+            'acquisitions': [],
+            'holding': [],
+            'wait_stats': self.wait_stats(),
+            'queue_depth': 0,
+            'resources': dict()
+        }
+        for name, lock in locks:
+            lock_view = lock.metrics_view(max_records=max_records)
+            view['resources'][name] = lock_view['wait_stats']
+            view['queue_depth'] += lock_view['queue_depth']
+
+            for priority_class, histograms in lock_view['histograms'].iteritems():
+                class_histograms = view['histograms'].setdefault(priority_class, {
+                    'wait': [0] * (len(LockMetrics.histogram_bounds) + 1),
+                    'hold': [0] * (len(LockMetrics.histogram_bounds) + 1)
+                })
+                for histogram in ['wait', 'hold']:
+                    class_histograms[histogram] = [a + b for a, b in zip(class_histograms[histogram],
+                                                                         histograms[histogram])]
 
-    def blocking_job(self, priority=0):
-        return self.writer(priority)
+            for key in ['acquisitions', 'holding']:
+                for record in lock_view[key]:
+                    record['resource'] = name
+                    view[key].append(record)
+
+        view['acquisitions'] = sorted(view['acquisitions'], key=lambda r: r['requested_at'],
+                                      reverse=True)[0:max_records]
+        return view
+
+    @contextmanager
+    def resources(self, shared=(), exclusive=(), priority=0, timeout=None, job_id=None):
+        acquired = self.acquire(shared=shared, exclusive=exclusive, priority=priority, timeout=timeout, job_id=job_id)
+        if acquired is None:
+            raise RuntimeError('Timed out waiting for resources (priority=%s, timeout=%ss).' % (priority, timeout))
+        try:
+            yield
+        finally:
+            self.release(acquired)
@@ -1,9 +1,19 @@
 import os
+import time
+import logging
+import threading
+from contextlib import contextmanager
 import psycopg2
+import psycopg2.extensions
 import pymongo
+from pymongo import monitoring
+from core.lib.metrics import registry
 
 __author__ = 'Federico Schmidt'
 
+db_round_trips = registry.counter('prinde_db_round_trips_total', 'Requests sent to each database.',
+                                  ['database', 'operation'])
+
 
 class DatabaseUtils:
 
@@ -32,12 +42,35 @@ class DatabaseUtils:
                                     user=conn_dictionary['user'],
                                     database=conn_dictionary['db_name'],
                                     port=conn_dictionary['port'],
-                                    password=conn_dictionary['password'])
+                                    password=conn_dictionary['password'],
+                                    connection_factory=CountingConnection,
+                                    cursor_factory=CountingCursor)
+            conn.database_name = conn_name
 
             return conn
         except Exception as e:
             raise RuntimeError('Failed to create database connection "%s". Reason: "%s".' % (conn_name, e.message))
 
+    @staticmethod
+    def postgresql_pool(conn_dictionary, config_path='.'):
+        """
+        Creates a pool of PostgreSQL connections. The pool size is configured with the "pool" key of the connection
+        dictionary (eg. pool: {min_size: 1, max_size: 8}).
+        :rtype : PostgreSQLConnectionPool
+        """
+        pool_config = conn_dictionary.get('pool', None) or {}
+        min_size = pool_config.get('min_size', 1)
+        max_size = pool_config.get('max_size', 8)
+
+        if not isinstance(min_size, int) or not isinstance(max_size, int) or min_size < 0 or max_size < 1 or \
+                min_size > max_size:
+            raise RuntimeError('Invalid pool size for database connection "%s" (min_size: %s, max_size: %s).' %
+                               (conn_dictionary.get('name'), min_size, max_size))
+
+        return PostgreSQLConnectionPool(connect=lambda: DatabaseUtils.connect_postgresql(conn_dictionary, config_path),
+                                        min_size=min_size, max_size=max_size,
+                                        name=conn_dictionary.get('name'))
+
     @staticmethod
     def connect_mongodb(conn_dictionary, config_path='.'):
         conn_dictionary = DatabaseUtils.__validate_connection_dict__(conn_dictionary)
@@ -63,7 +96,7 @@ class DatabaseUtils:
         uri += conn_dictionary['host'] + ':' + str(conn_dictionary['port'])
 
         try:
-            client = pymongo.MongoClient(uri)
+            client = pymongo.MongoClient(uri, event_listeners=[MongoRoundTripsListener(conn_name)])
             db_name = conn_dictionary['db_name']
 
             if db_name not in client.database_names():
@@ -73,6 +106,13 @@ class DatabaseUtils:
         except Exception as e:
             raise RuntimeError('Failed to create database connection "%s". Reason: "%s".' % (conn_name, e.message))
 
+    @staticmethod
+    def close_quietly(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
     @staticmethod
     def __validate_connection_dict__(conn_dictionary):
         if 'name' not in conn_dictionary:
@@ -94,3 +134,185 @@ class DatabaseUtils:
             return None
         with open(pwd_file_path, mode='r') as f:
             return f.read()
+
+
+class PostgreSQLConnectionPool(object):
+    """
+    A thread safe pool of PostgreSQL connections.
+
+    Connections are checked out with the connection() context manager, which is reentrant: nested calls made by the
+    same thread get the connection that thread is already using. Threads block when max_size connections are in use.
+
+    When a connection is given back, any transaction left open is rolled back, and connections that are closed or
+    broken are discarded and replaced on the next checkout.
+    """
+    # Idle connections older than this amount of seconds are checked with a query before being handed out.
+    health_check_interval = 30
+
+    def __init__(self, connect, min_size=1, max_size=8, name=None):
+        self.connect = connect
+        self.name = name
+        self.min_size = min_size
+        self.max_size = max_size
+
+        self._lock = threading.Lock()
+        self._available = threading.BoundedSemaphore(max_size)
+        self._local = threading.local()
+        # Idle connections with the time they were given back.
+        self._idle = []
+
+        for i in range(0, min_size):
+            self._idle.append((self.connect(), time.time()))
+
+    @contextmanager
+    def connection(self):
+        conn = self.getconn()
+        try:
+            yield conn
+        finally:
+            self.putconn(conn)
+
+    def getconn(self):
+        """
+        Checks out a connection for the current thread, blocking while the pool is exhausted. Every call must be
+        matched with a putconn call, prefer the connection() context manager.
+        """
+        conn = getattr(self._local, 'connection', None)
+
+        if conn is not None:
+            # This thread already has a connection checked out.
+            self._local.depth += 1
+            return conn
+
+        self._available.acquire()
+        try:
+            conn = self.__checkout__()
+        except:
+            self._available.release()
+            raise
+
+        self._local.connection = conn
+        self._local.depth = 1
+        return conn
+
+    def putconn(self, conn):
+        self._local.depth -= 1
+        if self._local.depth > 0:
+            return
+
+        self._local.connection = None
+        try:
+            self.__checkin__(conn)
+        finally:
+            self._available.release()
+
+    def close(self):
+        """
+        Closes every idle connection. Connections in use are closed when they're given back.
+        """
+        with self._lock:
+            idle = self._idle
+            self._idle = []
+            self.max_size = 0
+
+        for conn, idle_since in idle:
+            DatabaseUtils.close_quietly(conn)
+
+    def __checkout__(self):
+        while True:
+            with self._lock:
+                if len(self._idle) == 0:
+                    break
+                conn, idle_since = self._idle.pop()
+
+            if conn.closed:
+                continue
+
+            if time.time() - idle_since > self.health_check_interval:
+                try:
+                    cursor = conn.cursor()
+                    cursor.execute('SELECT 1')
+                    cursor.close()
+                    conn.rollback()
+                except psycopg2.Error:
+                    logging.getLogger().warning('Discarding broken connection from pool "%s".' % self.name)
+                    DatabaseUtils.close_quietly(conn)
+                    continue
+            return conn
+
+        return self.connect()
+
+    def __checkin__(self, conn):
+        if not conn.closed:
+            try:
+                if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except psycopg2.Error:
+                DatabaseUtils.close_quietly(conn)
+
+        with self._lock:
+            if not conn.closed and len(self._idle) < self.max_size:
+                self._idle.append((conn, time.time()))
+                return
+
+        DatabaseUtils.close_quietly(conn)
+
+
+class CountingConnection(psycopg2.extensions.connection):
+    """
+    A PostgreSQL connection that knows the name of its database connection, used to label the requests counted by
+    CountingCursor.
+    """
+    database_name = None
+
+
+class CountingCursor(psycopg2.extensions.cursor):
+    """
+    A PostgreSQL cursor that counts the requests it sends to the database (see db_round_trips).
+    """
+
+    def execute(self, *args, **kwargs):
+        self.__count__('execute')
+        return super(CountingCursor, self).execute(*args, **kwargs)
+
+    def executemany(self, *args, **kwargs):
+        self.__count__('executemany')
+        return super(CountingCursor, self).executemany(*args, **kwargs)
+
+    def callproc(self, *args, **kwargs):
+        self.__count__('callproc')
+        return super(CountingCursor, self).callproc(*args, **kwargs)
+
+    def copy_from(self, *args, **kwargs):
+        self.__count__('copy_from')
+        return super(CountingCursor, self).copy_from(*args, **kwargs)
+
+    def copy_to(self, *args, **kwargs):
+        self.__count__('copy_to')
+        return super(CountingCursor, self).copy_to(*args, **kwargs)
+
+    def copy_expert(self, *args, **kwargs):
+        self.__count__('copy_expert')
+        return super(CountingCursor, self).copy_expert(*args, **kwargs)
+
+    def __count__(self, operation):
+        db_round_trips.inc(labels={'database': getattr(self.connection, 'database_name', None),
+                                   'operation': operation})
+
+
+class MongoRoundTripsListener(monitoring.CommandListener):
+    """
+    Counts the commands sent to a MongoDB database (see db_round_trips), labelled with the command name.
+    """
+
+    def __init__(self, database_name):
+        self.database_name = database_name
+
+    def started(self, event):
+        db_round_trips.inc(labels={'database': self.database_name, 'operation': event.command_name})
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
@@ -0,0 +1,88 @@
+import time
+from datetime import datetime
+from contextlib import contextmanager
+
+__author__ = 'Federico Schmidt'
+
+
+class StageProfiler(object):
+    """
+    Records the timings of the stages of a job as a tree: stages started inside another stage are its children, so the
+    result can be drawn as a flame graph. Each stage has its start (seconds since the profiler was created), its
+    duration and the list of its children stages.
+
+    Stages are either timed with the stage context manager or opened with start and closed with end (stages still open
+    when the job fails are closed by end_all). Stages must be opened from the thread that created the profiler, timings
+    measured in other threads or processes are added with add_stage.
+    """
+
+    def __init__(self):
+        self.start_time = time.time()
+        self.stages = []
+        # Open stages, the last one is the parent of new stages.
+        self.open_stages = []
+
+    @contextmanager
+    def stage(self, name, **attributes):
+        """
+        Times the body of a with statement.
+        """
+        stage = self.start(name, **attributes)
+        try:
+            yield stage
+        finally:
+            self.end()
+
+    def start(self, name, **attributes):
+        """
+        Opens a stage, stages opened before it's closed are its children.
+        :param attributes: Other values to store with the stage (eg. its amount of items).
+        :returns The stage dictionary.
+        """
+        stage = self.add_stage(name, time.time(), None, **attributes)
+        self.open_stages.append(stage)
+        return stage
+
+    def end(self):
+        """
+        Closes the last opened stage.
+        :returns The stage dictionary.
+        """
+        stage = self.open_stages.pop()
+        stage['duration'] = time.time() - self.start_time - stage['start']
+        return stage
+
+    def end_all(self):
+        while len(self.open_stages) > 0:
+            self.end()
+
+    def add_stage(self, name, start_time, duration, **attributes):
+        """
+        Adds a stage timed elsewhere as a child of the currently open stage.
+        :param start_time: The start time of the stage (as returned by time.time()).
+        :param duration: The duration of the stage in seconds.
+        :returns The stage dictionary.
+        """
+        stage = dict(attributes)
+        stage.update({
+            'name': name,
+            'start': start_time - self.start_time,
+            'duration': duration,
+            'stages': []
+        })
+
+        if len(self.open_stages) > 0:
+            self.open_stages[-1]['stages'].append(stage)
+        else:
+            self.stages.append(stage)
+        return stage
+
+    def total_time(self):
+        return time.time() - self.start_time
+
+    def view(self):
+        return {
+            'start_date': datetime.fromtimestamp(self.start_time),
+            'total_time': self.total_time(),
+            'stages': self.stages
+        }
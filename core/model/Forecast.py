@@ -146,6 +146,9 @@ class Forecast(DotDict):
         if 'job_id' in view:
             del view['job_id']
 
+        if 'weather_max_dates' in view:
+            del view['weather_max_dates']
+
         view['_id'] = self.id
         view['campaign_name'] = self.campaign_name
         view['locations'] = []
@@ -178,6 +181,9 @@ class Forecast(DotDict):
         if 'rainfall' in view:
             del view['rainfall']
 
+        if 'weather_max_dates' in view:
+            del view['weather_max_dates']
+
         view['locations'] = []
         for loc_key, loc in self.locations.iteritems():
             view['locations'].append(loc['name'])
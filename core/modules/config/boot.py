@@ -4,6 +4,8 @@ import os
 import subprocess
 from core.lib.io.file import create_folder_with_permissions
 from core.lib.xplatform.cmd import print_same_line
+from core.modules.simulations_manager.soil.SoilDAO import soil_repository
+from core.modules.simulations_manager.weather.WeatherSeriesCache import WeatherSeriesCache
 
 
 def run_boot_hook(hook_path):
@@ -54,6 +56,17 @@ def boot_system(config):
     create_folder_with_permissions(tmp_folder)
     config.temp_folder = tmp_folder
 
+    # Weather series are cached between forecasts unless the cache path is explicitly disabled.
+    weather_cache = paths.get('weather_cache', os.path.join(tmp_folder, 'weather_cache'))
+
+    if weather_cache:
+        if not os.path.isabs(weather_cache):
+            weather_cache = os.path.join(root_path, weather_cache)
+        config.weather_cache = WeatherSeriesCache(weather_cache)
+
+    # Reuse the soils catalogue between restarts.
+    soil_repository.manifest_path = os.path.join(tmp_folder, 'soils_manifest.json')
+
     boot_hook = os.path.join(root_path, 'hooks', 'boot.sh')
 
     # If the boot hook file exists and the software has run permissions then we call it.
@@ -16,20 +16,20 @@ class CheckWeatherDB(BaseJob):
             raise RuntimeError('No weather database connection was provided. '
                                'Plase provide one under the "weather_db" key.')
 
-        wth_db_connection = self.system_config.database['weather_db']
-        cursor = wth_db_connection.cursor()
+        with self.system_config.database['weather_db'].connection() as wth_db_connection:
+            cursor = wth_db_connection.cursor()
 
-        cursor.execute("SELECT tablename FROM pg_tables WHERE schemaname = 'public'")
-        tables_set = {r[0] for r in cursor}
+            cursor.execute("SELECT tablename FROM pg_tables WHERE schemaname = 'public'")
+            tables_set = {r[0] for r in cursor}
+
+            cursor.execute("SELECT relname FROM pg_class WHERE relkind = 'm'")
+            materialized_views_set = {r[0] for r in cursor}
 
         if self.needed_tables & tables_set != self.needed_tables:
             table_diff = list(self.needed_tables - tables_set)
             raise RuntimeError('Weather database schema has missing tables: %s. '
                                'Consider running setup.sh again.' % table_diff)
 
-        cursor.execute("SELECT relname FROM pg_class WHERE relkind = 'm'")
-        materialized_views_set = {r[0] for r in cursor}
-
         if self.needed_materialized_views & materialized_views_set != self.needed_materialized_views:
             views_diff = list(self.needed_materialized_views - materialized_views_set)
             raise RuntimeError('Weather database schema has missing materialized views: %s. '
@@ -40,13 +40,15 @@ class CheckYieldDB(BaseJob):
     def __init__(self, system_config):
         super(CheckYieldDB, self).__init__(name='Check Mongo output DB')
         self.needed_collections = {'locations', 'forecasts', 'reference_rainfall', 'reference_simulations',
-                                   'simulations'}
+                                   'simulations', 'forecast_runs'}
         self.collection_indexes = {
-            'locations': {'_id'},
-            'reference_simulations': {'water_content', 'location_id', '_id', 'soil_id', 'crop_type'},
-            'reference_rainfall': {'omm_id', '_id'},
-            'forecasts': {'_id', 'forecast_date'},
-            'simulations': {'forecast_date', 'location_id', '_id', 'crop_type'}
+            'locations': {'_id', 'last_modified'},
+            'reference_simulations': {'water_content', 'location_id', '_id', 'soil_id', 'crop_type', 'last_modified',
+                                      'input_fingerprint'},
+            'reference_rainfall': {'omm_id', '_id', 'last_modified'},
+            'forecasts': {'_id', 'forecast_date', 'last_modified'},
+            'simulations': {'forecast_date', 'location_id', '_id', 'crop_type', 'input_fingerprint'},
+            'forecast_runs': {'_id', 'forecast_id', 'forecast_name', 'last_modified'}
         }
         self.system_config = system_config
 
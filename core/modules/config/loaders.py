@@ -3,7 +3,7 @@ import yaml
 from apscheduler.jobstores.base import JobLookupError
 from core.lib.utils.extended_collections import DotDict
 from core.model.ForecastBuilder import ForecastBuilder
-from core.modules.config import priority
+from core.modules.config import priority, resources
 from core.lib.utils.log import log_format_exception
 from core.model.Location import Location
 from core.modules.simulations_manager.weather.CombinedSeriesMaker import CombinedSeriesMaker
@@ -30,7 +30,10 @@ class ForecastLoader:
             self.__load_file__(forecast_file)
 
     def reload_file(self, forecast_file, scheduler, forecast_manager):
-        with self.jobs_lock.blocking_job(priority=priority.LOAD_FORECAST):
+        with self.jobs_lock.blocking_job(priority=priority.LOAD_FORECAST), \
+                self.system_config.resource_locks.resources(shared=[resources.CONFIGURATION],
+                                                            exclusive=[resources.forecast_file(forecast_file)],
+                                                            priority=priority.LOAD_FORECAST):
             file_forecasts = self.system_config.forecasts[forecast_file]
 
             for f in file_forecasts:
@@ -0,0 +1,26 @@
+__author__ = 'Federico Schmidt'
+
+# Names of the resources jobs lock with the system ResourceLocks (see core.lib.sync). Locks are acquired in name order,
+# jobs that hold some resources must only lock resources whose names sort after them (eg. a forecast locks its weather
+# stations after its configuration and soils).
+
+# The system configuration.
+CONFIGURATION = 'config'
+# The soil files and the soils collection.
+SOILS = 'soils'
+
+
+def forecast_file(file_name):
+    return 'config:%s' % file_name
+
+
+def forecast(forecast_file_name, forecast_name):
+    return 'forecast:%s:%s' % (forecast_file_name, forecast_name)
+
+
+def weather_station(omm_id):
+    return 'weather_station:%s' % omm_id
+
+
+def weather_stations(omm_ids):
+    return [weather_station(omm_id) for omm_id in omm_ids]
@@ -8,10 +8,11 @@ from core.lib.io.file import listdir_fullpath
 from core.lib.utils.extended_collections import DotDict
 from core.lib.utils.database import DatabaseUtils
 from core.lib.jobs.monitor import NullMonitor, JOB_STATUS_WAITING, JOB_STATUS_RUNNING
-from core.lib.sync import JobsLock
+from core.lib.sync import JobsLock, ResourceLocks
 from core.modules.config.database_check import CheckWeatherDB, CheckYieldDB
 from core.modules.config.loaders import ForecastLoader
 from core.modules.config.priority import LOAD_CONFIGURATION
+from core.modules.config import resources
 
 __author__ = 'Federico Schmidt'
 
@@ -81,6 +82,7 @@ class SystemConfiguration(DotDict):
         self.alias_dict = None
         self.max_parallelism = 1
         self.jobs_lock = None
+        self.resource_locks = None
         self.observer = None
 
     @staticmethod
@@ -99,13 +101,26 @@ class SystemConfiguration(DotDict):
         # Update this class __dict__ property to add the properties defined in the config yaml.
         config_object.update(system_config_yaml)
 
+        # Priority gained by queued jobs for each minute they wait for a lock.
+        priority_aging = system_config_yaml.get('lock_priority_aging', 0)
+        if (not isinstance(priority_aging, (int, float))) or (priority_aging < 0):
+            raise RuntimeError('Invalid lock_priority_aging value (%s).' % priority_aging)
+
         # Create the system's job syncing lock if it doesn't exist.
         if not config_object.jobs_lock:
-            config_object.jobs_lock = JobsLock(max_parallel_tasks=config_object.max_parallelism)
+            config_object.jobs_lock = JobsLock(max_parallel_tasks=config_object.max_parallelism,
+                                               priority_aging=priority_aging)
         else:
             # Otherwise, just update the max concurrent parallel jobs. If we reinstantiate it we'll leave
             # every thread waiting for a lock permanently blocked.
             config_object.jobs_lock.max_concurrent_readers = config_object.max_parallelism
+            config_object.jobs_lock.priority_aging = priority_aging
+
+        # Locks of the resources used by forecasts and data updates (kept across reloads for the same reason).
+        if not config_object.resource_locks:
+            config_object.resource_locks = ResourceLocks(priority_aging=priority_aging)
+        else:
+            config_object.resource_locks.priority_aging = priority_aging
 
         # Load databases configurations and open connections.
         db_config = yaml.safe_load(open(config_object.databases_config_path))
@@ -120,7 +135,8 @@ class SystemConfiguration(DotDict):
             properties['name'] = db_conn
 
             if properties['type'] == 'postgresql':
-                connection = DatabaseUtils.connect_postgresql(properties, config_object.config_path)
+                # PostgreSQL connections are pooled, consumers must check them out with connection().
+                connection = DatabaseUtils.postgresql_pool(properties, config_object.config_path)
             elif properties['type'] == 'mongodb':
                 connection = DatabaseUtils.connect_mongodb(properties, config_object.config_path)
             else:
@@ -180,7 +196,9 @@ class SystemConfiguration(DotDict):
         progress_monitor.job_started()
         progress_monitor.update_progress(job_status=JOB_STATUS_WAITING)
 
-        with self.jobs_lock.blocking_job(priority=LOAD_CONFIGURATION):
+        with self.jobs_lock.blocking_job(priority=LOAD_CONFIGURATION, job_id=progress_monitor.job_id), \
+                self.resource_locks.resources(exclusive=[resources.CONFIGURATION], priority=LOAD_CONFIGURATION,
+                                              job_id=progress_monitor.job_id):
             progress_monitor.update_progress(job_status=JOB_STATUS_RUNNING)
             # Create a temporal backup of the current configuration.
             config_clone = copy.copy(self)
@@ -201,7 +219,10 @@ class SystemConfiguration(DotDict):
         del view['observer']
         del view['alias_dict']
         del view['jobs_lock']
+        del view['resource_locks']
         del view['system_config_yaml']
         del view['forecasts_files']
         del view['forecasts_loader']
+        if 'weather_cache' in view:
+            del view['weather_cache']
         return view.to_json()
@@ -1,7 +1,13 @@
+import os
+import numpy as np
+from datetime import datetime
+from pymongo import UpdateOne
 from core.lib.jobs.base import BaseJob
 from core.lib.jobs.monitor import ProgressMonitor, JOB_STATUS_WAITING, JOB_STATUS_RUNNING
+from core.modules.config import resources
 from core.modules.config.priority import UPDATE_DB_DATA
-from core.modules.simulations_manager.soil.SoilDAO import SoilDAO, load_soils, soils_dict
+from core.modules.simulations_manager.soil.SoilDAO import soil_repository
+from core.modules.simulations_manager.soil.SoilRepository import SoilRepository
 
 __author__ = 'Daniel Bonhaure'
 
@@ -13,46 +19,87 @@ class SoilsUpdater(BaseJob):
         self.system_config = system_config
         self.db = system_config.database['yield_db']
 
-    def run(self):
-        # Reload Soils
-        soils_dict.clear()
-        load_soils()
+    def run(self, full_update=False):
+        """
+        Updates the metrics of the soils stored in the soils collection.
+        :param full_update: If False, only the soils whose file changed since they were last updated are updated.
+        """
+        # Reload Soils (this invalidates the soils cached by the repository).
+        soil_repository.reload()
 
         self.progress_monitor.start_value = 0
-        self.progress_monitor.end_value = len(soils_dict)
+        self.progress_monitor.end_value = len(soil_repository.soils) + 1
         self.progress_monitor.update_progress(job_status=JOB_STATUS_WAITING)
 
-        # Acquire a blocking job lock with the update database priority
-        with self.system_config.jobs_lock.blocking_job(priority=UPDATE_DB_DATA):
+        # Lock the soils with the update database priority.
+        with self.system_config.resource_locks.resources(exclusive=[resources.SOILS], priority=UPDATE_DB_DATA,
+                                                         job_id=self.id):
             # Lock acquired, notify observers.
             self.progress_monitor.update_progress(job_status=JOB_STATUS_RUNNING)
 
-            for pm_actual_value, (soil_name, soil_file_name) in enumerate(soils_dict.iteritems(), 1):
-                soil_json = SoilDAO.get_soil(soil_name)['soils'][0]
-                soil_id = soil_json['soil_id']
-                soil_layers = soil_json['soilLayer']
-                soil_metrics = self.calculate_metrics(soil_layers)
-                # Update (or insert) soils.
-                self.db['soils'].update_one({'_id':soil_id}, {'$set':{'metrics': soil_metrics}}, upsert=True)
-                # Update progress information.
+            soils_mtimes = dict([(soil_id, os.path.getmtime(soil_file))
+                                 for soil_id, soil_file in soil_repository.soils.iteritems()])
+
+            if not full_update:
+                updated_soils = self.db['soils'].find({'file_mtime': {'$exists': True}}, projection=['file_mtime'])
+                for soil in updated_soils:
+                    if soils_mtimes.get(soil['_id']) == soil['file_mtime']:
+                        del soils_mtimes[soil['_id']]
+
+            soil_ids = sorted(soils_mtimes.keys())
+            self.progress_monitor.end_value = len(soil_ids) + 1
+
+            # Soil file names are the soil id's.
+            soils_layers = []
+            for pm_actual_value, soil_id in enumerate(soil_ids, 1):
+                soils_layers.append(soil_repository.layers(soil_id))
                 self.progress_monitor.update_progress(new_value=pm_actual_value)
 
+            if len(soil_ids) > 0:
+                metrics = SoilsUpdater.calculate_metrics_batch(soils_layers)
+                modified_date = datetime.utcnow()
+
+                # Update (or insert) soils.
+                self.db['soils'].bulk_write([
+                    UpdateOne({'_id': soil_id}, {'$set': {
+                        'metrics': dict([(metric, float(values[idx])) for metric, values in metrics.iteritems()]),
+                        'file_mtime': soils_mtimes[soil_id],
+                        'last_modified': modified_date
+                    }}, upsert=True)
+                    for idx, soil_id in enumerate(soil_ids)
+                ], ordered=False)
+
+            self.progress_monitor.update_progress(new_value=len(soil_ids) + 1)
+
     @staticmethod
     def calculate_metrics(soil_layers):
-        prev_layer_depth = 0
-        wilting_point = 0
-        field_capacity = 0
-        field_saturation = 0
+        metrics = SoilsUpdater.calculate_metrics_batch([SoilRepository.layers_matrix(soil_layers)])
+        return dict([(metric, float(values[0])) for metric, values in metrics.iteritems()])
+
+    @staticmethod
+    def calculate_metrics_batch(soils_layers):
+        """
+        Calculates the metrics of many soils at once.
+        :param soils_layers: A list with the layers matrix (see SoilRepository.layers) of each soil.
+        :returns A dictionary with an array of values (one per soil) for each metric.
+        """
+        fields = SoilRepository.layer_fields
+        max_layers = max([len(layers) for layers in soils_layers])
 
-        for layer in soil_layers:
-            layer_depth = int(layer['sllb']) * 10
-            layer_depth_diff = layer_depth - prev_layer_depth
+        # Pad the layers of every soil to the same count. Padding layers have the depth of the deepest layer of their
+        # soil, so their thickness is zero.
+        stacked = np.zeros((len(soils_layers), max_layers, len(fields)))
+        for soil_idx, layers in enumerate(soils_layers):
+            if len(layers) > 0:
+                stacked[soil_idx, :len(layers)] = layers
+                stacked[soil_idx, len(layers):, fields.index('sllb')] = layers[-1, fields.index('sllb')]
 
-            wilting_point += float(layer['slll']) * layer_depth_diff
-            field_capacity += float(layer['sldul']) * layer_depth_diff
-            field_saturation += float(layer['slsat']) * layer_depth_diff
+        layer_depth = stacked[:, :, fields.index('sllb')] * 10
+        layer_thickness = np.diff(layer_depth, axis=1, prepend=0)
 
-            prev_layer_depth = layer_depth
+        wilting_point = (stacked[:, :, fields.index('slll')] * layer_thickness).sum(axis=1)
+        field_capacity = (stacked[:, :, fields.index('sldul')] * layer_thickness).sum(axis=1)
+        field_saturation = (stacked[:, :, fields.index('slsat')] * layer_thickness).sum(axis=1)
 
         return {
             'wilting_point': wilting_point,
@@ -3,6 +3,7 @@ import numpy as np
 from core.lib.utils.log import log_format_exception
 from core.lib.jobs.monitor import NullMonitor, ProgressMonitor
 import requests
+from core.modules.config import resources
 from core.modules.config.priority import UPDATE_DB_DATA, UPDATE_MAX_WEATHER_DATES
 from core.lib.jobs.monitor import JOB_STATUS_WAITING, JOB_STATUS_RUNNING
 from core.lib.utils.database import DatabaseUtils
@@ -10,14 +11,20 @@ from datetime import datetime, timedelta
 from core.lib.utils.extended_collections import group_by, DotDict
 import cStringIO
 from core.modules.data_updater.impute import RunImputation
+from core.lib.metrics import registry
 
 __author__ = 'Federico Schmidt'
 
+api_requests = registry.counter('prinde_weather_api_requests_total', 'Requests sent to the weather update API.',
+                                ['status'])
+api_bytes = registry.counter('prinde_weather_api_bytes_total', 'Bytes received from the weather update API.')
+received_records = registry.counter('prinde_weather_records_received_total',
+                                    'Daily weather records received from the weather update API.')
+
 
 class WeatherUpdater:
     def __init__(self, system_config):
         self.system_config = system_config
-        self.wth_db = None
         self.weather_stations_ids = set()
         self.wth_max_date = DotDict()
 
@@ -31,14 +38,19 @@ class WeatherUpdater:
 
     def update_weather_db(self, progress_monitor=None):
         if not progress_monitor:
-            progress_monitor = NullMonitor
+            progress_monitor = NullMonitor()
 
-        if len(self.weather_stations_ids) == 0:
+        # Stations can be added while the update runs, work with (and lock) the ones known when it started.
+        omm_ids = set(self.weather_stations_ids)
+        if len(omm_ids) == 0:
             return
 
         # Notify observers we're going to wait for a lock acquisition.
         progress_monitor.job_started(initial_status=JOB_STATUS_WAITING)
-        with self.system_config.jobs_lock.blocking_job(priority=UPDATE_DB_DATA):
+        # Lock the updated stations, forecasts wait only if they're creating weather series from these stations.
+        with self.system_config.resource_locks.resources(
+                exclusive=resources.weather_stations(omm_ids), priority=UPDATE_DB_DATA,
+                job_id=progress_monitor.job_id):
             # Lock acquired, notify observers.
             progress_monitor.update_progress(job_status=JOB_STATUS_RUNNING)
 
@@ -69,17 +81,19 @@ class WeatherUpdater:
                 'table': 'estacion_registro_diario'
             }
 
-            stations_max_data_date = self.find_max_data_dates(self.weather_stations_ids)
+            stations_max_data_date = self.find_max_data_dates(omm_ids)
             progress_monitor.end_value = len(stations_max_data_date)
 
             request_groups = group_by(stations_max_data_date, lambda x: x[1])
 
             stations_updated = set()
             n_stations_updated = 0
+            wth_db_pool = self.system_config.database['weather_db']
+            wth_db = None
             cursor = None
 
             try:
-                wth_db = self.system_config.database['weather_db']
+                wth_db = wth_db_pool.getconn()
                 cursor = wth_db.cursor()
                 cursor.execute('BEGIN TRANSACTION')
 
@@ -94,6 +108,7 @@ class WeatherUpdater:
 
                     response = requests.get('%(url)s?login=%(user)s&password=%(password)s'
                                             '&tabla=%(table)s&fecha_desde=%(min_date)s&omm_id=%(omm_ids)s' % req_params)
+                    api_requests.inc(labels={'status': response.status_code})
 
                     if not response.ok:
                         raise RuntimeError('API request failed (status: %s). Reason: %s.' %
@@ -102,6 +117,7 @@ class WeatherUpdater:
                     if 'text/csv' not in response.headers['content-type']:
                         raise RuntimeError('Wrong response type in update API: %s.' % response.headers['content-type'])
 
+                    api_bytes.inc(len(response.content))
                     update_data = response.content.strip().split('\n')
 
                     progress_monitor.update_progress(new_value=n_stations_updated)
@@ -110,6 +126,7 @@ class WeatherUpdater:
                         continue
 
                     header = update_data[0].split('\t')
+                    received_records.inc(len(update_data) - 1)
                     update_data = cStringIO.StringIO('\n'.join(update_data[1:]))
 
                     # Insert new data into the database.
@@ -118,9 +135,15 @@ class WeatherUpdater:
 
                 if len(stations_updated) > 0:
                     cursor.execute("COMMIT")
+
+                    # Weather series created with the old data aren't valid anymore.
+                    weather_cache = self.system_config.get('weather_cache', None)
+                    if weather_cache:
+                        weather_cache.invalidate(stations_updated)
+
                     impute_job = RunImputation(system_config=self.system_config, parent_task_monitor=progress_monitor)
 
-                    stations_to_impute = stations_updated.intersection(self.weather_stations_ids)
+                    stations_to_impute = stations_updated.intersection(omm_ids)
 
                     if len(stations_to_impute) > 0:
                         ret_val = impute_job.start(weather_stations=stations_to_impute)
@@ -134,7 +157,7 @@ class WeatherUpdater:
 
                     if ret_val == 0:
                         # Update max dates again.
-                        self.update_max_dates(run_blocking=False)
+                        self.update_max_dates(omm_ids=omm_ids, run_blocking=False)
                         logging.info('Updated weather data for station(s): %s.' % stations_updated)
                         return 0
                     else:
@@ -155,10 +178,18 @@ class WeatherUpdater:
             finally:
                 if cursor:
                     cursor.close()
+                if wth_db is not None:
+                    wth_db_pool.putconn(wth_db)
         return 1
 
-    def update_max_dates(self, progress_monitor=None, run_blocking=True):
-        if len(self.weather_stations_ids) == 0:
+    def update_max_dates(self, progress_monitor=None, run_blocking=True, omm_ids=None):
+        """
+        :param omm_ids: Stations to update, all the known weather stations if None.
+        """
+        if omm_ids is None:
+            omm_ids = set(self.weather_stations_ids)
+
+        if len(omm_ids) == 0:
             return
 
         if not progress_monitor:
@@ -166,20 +197,19 @@ class WeatherUpdater:
 
         if run_blocking:
             progress_monitor.update_progress(job_status=JOB_STATUS_WAITING)
-            # Acquire a blocking job lock with the update weather dates priority.
-            with self.system_config.jobs_lock.blocking_job(priority=UPDATE_MAX_WEATHER_DATES):
+            # Wait until the stations aren't being updated, with the update weather dates priority.
+            with self.system_config.resource_locks.resources(
+                    shared=resources.weather_stations(omm_ids), priority=UPDATE_MAX_WEATHER_DATES,
+                    job_id=progress_monitor.job_id):
                 # Lock acquired, notify observers.
                 progress_monitor.update_progress(job_status=JOB_STATUS_RUNNING)
-                self.__update_max_dates__(progress_monitor)
+                self.__update_max_dates__(omm_ids, progress_monitor)
         else:
-            self.__update_max_dates__(progress_monitor)
+            self.__update_max_dates__(omm_ids, progress_monitor)
 
-    def __update_max_dates__(self, progress_monitor=None):
+    def __update_max_dates__(self, omm_ids, progress_monitor=None):
         try:
-            self.wth_db = self.system_config.database['weather_db']
-            cursor = self.wth_db.cursor()
-
-            ids = list(self.weather_stations_ids)
+            ids = list(omm_ids)
 
             # Find the max "useful" date for each station.
             # This means the minimum date between: a) the max date that we have data for a given station; and,
@@ -200,12 +230,14 @@ class WeatherUpdater:
                 ) GROUP BY erdc.omm_id, min_date
             """
 
-            cursor.execute(max_date_query, (ids, ids))
+            with self.system_config.database['weather_db'].connection() as wth_db:
+                cursor = wth_db.cursor()
+                cursor.execute(max_date_query, (ids, ids))
 
-            for record in cursor:
-                self.wth_max_date[record[0]] = record[1]
+                for record in cursor:
+                    self.wth_max_date[record[0]] = record[1]
 
-            cursor.close()
+                cursor.close()
             logging.getLogger().info('Updated weather series max date.')
         except Exception, ex:
             logging.getLogger().error('Failed to update weather series max date. Reason: %s.',
@@ -218,9 +250,6 @@ class WeatherUpdater:
         max_dates = {}
 
         try:
-            self.wth_db = self.system_config.database['weather_db']
-            cursor = self.wth_db.cursor()
-
             ids = omm_ids
             if not isinstance(ids, list):
                 ids = list(ids)
@@ -234,13 +263,15 @@ class WeatherUpdater:
                 ) GROUP BY erdc.omm_id
             """
 
-            # Find max dates for stations in use and their neighbors.
-            cursor.execute(max_date_query, (ids, ids))
+            with self.system_config.database['weather_db'].connection() as wth_db:
+                cursor = wth_db.cursor()
+                # Find max dates for stations in use and their neighbors.
+                cursor.execute(max_date_query, (ids, ids))
 
-            for record in cursor:
-                max_dates[record[0]] = record[1]
+                for record in cursor:
+                    max_dates[record[0]] = record[1]
 
-            cursor.close()
+                cursor.close()
         except Exception, ex:
             logging.getLogger().error('Failed to find weather series max date. Reason: %s.',
                                       log_format_exception())
@@ -256,18 +287,19 @@ class WeatherUpdater:
         # CREATE INDEX erdi_index ON estacion_registro_diario_completo (omm_id, fecha);
         progress_monitor.end_value = 3
         progress_monitor.job_started()
-        cursor = self.system_config.database['weather_db'].cursor()
-        cursor.execute('DROP INDEX IF EXISTS erdi_index;')
-        progress_monitor.update_progress(1)
-        cursor.execute('REFRESH MATERIALIZED VIEW estacion_registro_diario_completo;')
-        progress_monitor.update_progress(2)
-        cursor.execute('CREATE INDEX erdi_index ON estacion_registro_diario_completo (omm_id, fecha);')
-        cursor.execute('COMMIT')
+        with self.system_config.database['weather_db'].connection() as wth_db:
+            cursor = wth_db.cursor()
+            cursor.execute('DROP INDEX IF EXISTS erdi_index;')
+            progress_monitor.update_progress(1)
+            cursor.execute('REFRESH MATERIALIZED VIEW estacion_registro_diario_completo;')
+            progress_monitor.update_progress(2)
+            cursor.execute('CREATE INDEX erdi_index ON estacion_registro_diario_completo (omm_id, fecha);')
+            cursor.execute('COMMIT')
         progress_monitor.job_ended()
 
     def update_rainfall_quantiles(self, omm_ids=None, progress_monitor=None):
         if not omm_ids:
-            omm_ids = self.weather_stations_ids
+            omm_ids = set(self.weather_stations_ids)
 
         if isinstance(omm_ids, int):
             omm_ids = [omm_ids]
@@ -280,11 +312,12 @@ class WeatherUpdater:
             progress_monitor.end_value = len(omm_ids)
 
             for index, omm_id in enumerate(omm_ids):
-                wth_db = self.system_config.database['weather_db']
-                cursor = wth_db.cursor()
-                cursor.execute('SELECT campaign, sum FROM pr_campaigns_acum_rainfall(%s,%s)', (omm_id,self.system_config.campaign_first_month))
+                with self.system_config.database['weather_db'].connection() as wth_db:
+                    cursor = wth_db.cursor()
+                    cursor.execute('SELECT campaign, sum FROM pr_campaigns_acum_rainfall(%s,%s)',
+                                   (omm_id, self.system_config.campaign_first_month))
 
-                np_prcp_sums = WeatherUpdater.parse_rainfalls(cursor)
+                    np_prcp_sums = WeatherUpdater.parse_rainfalls(cursor)
 
                 # daily_cursor = wth_db.cursor()
                 # daily_cursor.execute('SELECT campaign, sum FROM pr_campaigns_rainfall(%s)', (omm_id,))
@@ -296,7 +329,8 @@ class WeatherUpdater:
                 db.reference_rainfall.update_one(
                     {"omm_id": omm_id},
                     {"$set": {
-                        "quantiles": WeatherUpdater.get_quantiles(np_prcp_sums, quantiles=[5, 25, 50, 75, 95])
+                        "quantiles": WeatherUpdater.get_quantiles(np_prcp_sums, quantiles=[5, 25, 50, 75, 95]),
+                        "last_modified": datetime.utcnow()
                     }}, upsert=True)
                 # Update progress information.
                 progress_monitor.update_progress(index)
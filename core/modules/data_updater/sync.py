@@ -1,3 +1,8 @@
+import logging
+import threading
+import Queue
+from datetime import datetime, timedelta
+from pymongo import ReplaceOne, DESCENDING
 from pymongo.errors import BulkWriteError
 from core.lib.jobs.base import BaseJob
 from core.lib.jobs.monitor import ProgressMonitor, JOB_STATUS_WAITING, JOB_STATUS_RUNNING
@@ -6,111 +11,246 @@ __author__ = 'Federico Schmidt'
 
 
 class YieldDatabaseSync(BaseJob):
+    """
+    Copies the documents of the results database to the sync database.
+
+    Every writer of the results database stamps the documents it creates or modifies with a last_modified date, once
+    they're final (see final_documents). For each collection, the most recent date that was synced is stored as a
+    checkpoint in the target database and the next sync only transfers documents modified after it. Collections without a checkpoint (or every collection, if
+    the job is ran with full_reconcile=True) are reconciled comparing the id's of both databases by chunks.
+    """
+    modified_field = 'last_modified'
+    checkpoints_collection = 'sync_checkpoints'
+    # Documents modified up to this amount of time before the checkpoint are synced again, to include writes that were
+    # in progress when the checkpoint was taken. Writes are upserts, so syncing a document twice is harmless.
+    checkpoint_margin = timedelta(minutes=10)
+    batch_size = 500
+    # Max number of batches read from the source database ahead of the writes to the target database (0 disables
+    # overlapping reads and writes).
+    prefetch_size = 2
+    # Only final documents are synced: documents are stamped with a last_modified date once they're final, and forecasts
+    # are stored with a "running" status until their results are validated (see ForecastManager.mark_finished).
+    final_documents = {modified_field: {'$exists': True}, 'status': {'$ne': 'running'}}
 
     def __init__(self, system_config):
-        super(YieldDatabaseSync, self).__init__(progress_monitor=ProgressMonitor(end_value=4))
+        super(YieldDatabaseSync, self).__init__(progress_monitor=ProgressMonitor(end_value=5))
         self.system_config = system_config
 
-    def run(self):
+    def run(self, full_reconcile=False):
         self.progress_monitor.update_progress(job_status=JOB_STATUS_WAITING)
 
         # Acquire a read lock (parallel job).
-        with self.system_config.jobs_lock.parallel_job():
+        with self.system_config.jobs_lock.parallel_job(job_id=self.id):
             self.progress_monitor.update_progress(job_status=JOB_STATUS_RUNNING)
             if 'yield_sync_db' in self.system_config.database:
                 source_db = self.system_config.database['yield_db']
                 target_db = self.system_config.database['yield_sync_db']
 
-                new_forecasts = self.__find_collection_diff__(collection_name='forecasts', source_db=source_db,
-                                                              target_db=target_db)
-
-                if new_forecasts.count() > 0:
-                    forecasts_insert_monitor = ProgressMonitor(end_value=new_forecasts.count())
-                    self.progress_monitor.add_subjob(forecasts_insert_monitor, job_name='Synchronize forecasts')
-                    inserted_forecasts_count = 0
-
-                    # Sync new forecasts.
-                    for f in new_forecasts:
-                        simulations_ids = f['simulations']
-
-                        bulk_op = target_db.simulations.initialize_unordered_bulk_op()
-
-                        # Fetch this forecast' simulations.
-                        for simulation in source_db.simulations.find({'_id': {'$in': simulations_ids}}):
-                            bulk_op.insert(simulation)
-
-                        try:
-                            bulk_op.execute()
-                        except BulkWriteError as bwe:
-                            # Check if every error that was raised was a duplicate key error (11000).
-                            for err in bwe.details['writeErrors']:
-                                if err['code'] != 11000:
-                                    raise RuntimeError('Non recoverable error found while trying to sync yield '
-                                                       'databases. Details: %s' % bwe.details)
-
-                        target_db.forecasts.insert(f)
-                        inserted_forecasts_count += 1
-                        forecasts_insert_monitor.update_progress(inserted_forecasts_count)
-
+                # Sync new forecasts, the simulations of each forecast are copied before the forecast itself.
+                self.__sync_collection__('forecasts', source_db, target_db, full_reconcile=full_reconcile,
+                                         before_write=lambda forecasts: self.__sync_simulations__(forecasts,
+                                                                                                  source_db,
+                                                                                                  target_db))
                 # Notify we finished syncing forecasts (the first part of the job).
                 self.progress_monitor.update_progress(new_value=1)
 
                 # Sync new reference simulations.
-                self.__insert_missing_documents__(collection_name='reference_simulations',
-                                                  source_db=source_db,
-                                                  target_db=target_db)
-
+                self.__sync_collection__('reference_simulations', source_db, target_db, full_reconcile=full_reconcile)
                 self.progress_monitor.update_progress(new_value=2)
 
                 # Sync new locations.
-                self.__insert_missing_documents__(collection_name='locations',
-                                                  source_db=source_db,
-                                                  target_db=target_db)
-
+                self.__sync_collection__('locations', source_db, target_db, full_reconcile=full_reconcile)
                 self.progress_monitor.update_progress(new_value=3)
 
                 # Sync new reference rainfalls.
-                self.__insert_missing_documents__(collection_name='reference_rainfall',
-                                                  id_field='omm_id',
-                                                  source_db=source_db,
-                                                  target_db=target_db)
-
+                self.__sync_collection__('reference_rainfall', source_db, target_db, id_field='omm_id',
+                                         full_reconcile=full_reconcile)
                 self.progress_monitor.update_progress(new_value=4)
 
                 # Sync new soils.
-                self.__insert_missing_documents__(collection_name='soils',
-                                                  source_db=source_db,
-                                                  target_db=target_db)
+                self.__sync_collection__('soils', source_db, target_db, full_reconcile=full_reconcile)
+                self.progress_monitor.update_progress(new_value=5)
 
-    def __insert_missing_documents__(self, collection_name, source_db, target_db, id_field='_id'):
+    def __sync_collection__(self, collection_name, source_db, target_db, id_field='_id', full_reconcile=False,
+                            before_write=None):
         """
-        Finds documents inside the given collection that are present in the source database but not in the target
-        database and inserts them.
+        Syncs a collection incrementally, from its checkpoint, or reconciling it if it doesn't have one.
         :param collection_name: A collection name.
         :param source_db: Source database Pymongo connection.
         :param target_db: Target database Pymongo connection.
+        :param id_field: The field that identifies a document in both databases.
+        :param before_write: A function called with each batch of documents before writing it to the target database.
+        :returns The number of documents written.
         """
-        new_documents = self.__find_collection_diff__(collection_name, source_db, target_db, id_field)
+        start_time = datetime.now()
+        checkpoint = target_db[self.checkpoints_collection].find_one({'_id': collection_name})
+
+        # Take the new checkpoint before copying, documents modified while we copy will be synced next time.
+        latest_modified = list(source_db[collection_name].find({self.modified_field: {'$exists': True}},
+                                                               projection=[self.modified_field])
+                               .sort(self.modified_field, DESCENDING).limit(1))
 
-        if new_documents.count() > 0:
-            bulk_operator = target_db[collection_name].initialize_unordered_bulk_op()
+        if full_reconcile or not checkpoint:
+            mode = 'full'
+            synced_count = self.__reconcile_collection__(collection_name, source_db, target_db, id_field, before_write)
+        else:
+            mode = 'incremental'
+            modified_documents = source_db[collection_name].find({
+                self.modified_field: {'$gte': checkpoint[self.modified_field] - self.checkpoint_margin},
+                'status': self.final_documents['status']
+            })
+            synced_count = self.__write_documents__(modified_documents, target_db[collection_name], id_field,
+                                                    before_write)
 
-            for document in new_documents:
-                bulk_operator.insert(document)
+        if len(latest_modified) > 0:
+            target_db[self.checkpoints_collection].replace_one({'_id': collection_name}, {
+                '_id': collection_name,
+                self.modified_field: latest_modified[0][self.modified_field],
+                'sync_date': datetime.utcnow()
+            }, upsert=True)
 
-            bulk_operator.execute()
+        logging.getLogger().info('Synced %d documents of collection "%s" (mode: %s, time=%s).' %
+                                 (synced_count, collection_name, mode, datetime.now() - start_time))
+        return synced_count
 
-    def __find_collection_diff__(self, collection_name, source_db, target_db, id_field='_id'):
+    def __reconcile_collection__(self, collection_name, source_db, target_db, id_field='_id', before_write=None):
         """
         Finds documents inside the given collection that are present in the source database but not in the target
-        database.
-        :param collection_name: A collection name.
-        :param source_db: Source database Pymongo connection.
-        :param target_db: Target database Pymongo connection.
-        :returns The list of documents that are missing in the target_db's collection.
+        database and inserts them. Id's are compared by chunks, so no query has to hold the whole list of id's.
+        :returns The number of documents written.
+        """
+        synced_count = 0
+        source_ids = source_db[collection_name].find(self.final_documents,
+                                                     projection=[id_field]).batch_size(self.batch_size)
+
+        for ids_chunk in YieldDatabaseSync.chunks((d[id_field] for d in source_ids if id_field in d), self.batch_size):
+            found_ids = target_db[collection_name].find({id_field: {'$in': ids_chunk}}, projection=[id_field])
+            found_ids = set([d[id_field] for d in found_ids])
+            missing_ids = [i for i in ids_chunk if i not in found_ids]
+
+            if len(missing_ids) > 0:
+                missing_documents = source_db[collection_name].find({id_field: {'$in': missing_ids}})
+                synced_count += self.__write_documents__(missing_documents, target_db[collection_name], id_field,
+                                                         before_write)
+        return synced_count
+
+    def __sync_simulations__(self, forecasts, source_db, target_db):
+        """
+        Copies the simulations of a batch of forecasts that aren't in the target database yet. Simulations are fetched
+        with a few large $in queries and inserted with unordered bulk inserts.
+        :returns The number of simulations inserted.
         """
-        found_ids = target_db[collection_name].distinct(id_field)
-        # Find documents in source DB with id's that are NOT in the "found_ids" list.
-        return source_db[collection_name].find({
-            id_field: {'$nin': found_ids}
-        })
+        simulations_ids = [sim_id for f in forecasts for sim_id in f.get('simulations', [])]
+
+        def missing_simulations():
+            for ids_chunk in YieldDatabaseSync.chunks(simulations_ids, self.batch_size):
+                # Simulations don't change once their forecast is stored, skip the ones that were already synced (e.g.
+                # the simulations of a reference forecast that got new simulations appended).
+                found_ids = target_db.simulations.find({'_id': {'$in': ids_chunk}}, projection=['_id'])
+                found_ids = set([s['_id'] for s in found_ids])
+                missing_ids = [i for i in ids_chunk if i not in found_ids]
+
+                if len(missing_ids) > 0:
+                    yield list(source_db.simulations.find({'_id': {'$in': missing_ids}}))
+
+        inserted_count = 0
+        for simulations in self.__prefetch__(missing_simulations()):
+            inserted_count += YieldDatabaseSync.insert_documents(target_db.simulations, simulations)
+        return inserted_count
+
+    def __write_documents__(self, documents, target_collection, id_field='_id', before_write=None):
+        """
+        Upserts documents in the target collection with unordered bulk writes of batch_size documents.
+        :returns The number of documents written.
+        """
+        written_count = 0
+
+        for batch in self.__prefetch__(YieldDatabaseSync.chunks(documents, self.batch_size)):
+            if before_write:
+                before_write(batch)
+
+            requests = []
+            for document in batch:
+                if id_field != '_id':
+                    # The document may exist in the target database with a different _id, which can't be replaced.
+                    document = dict(document)
+                    del document['_id']
+                requests.append(ReplaceOne({id_field: document[id_field]}, document, upsert=True))
+
+            target_collection.bulk_write(requests, ordered=False)
+            written_count += len(requests)
+        return written_count
+
+    def __prefetch__(self, iterable):
+        if self.prefetch_size > 0:
+            return YieldDatabaseSync.prefetched(iterable, self.prefetch_size)
+        return iterable
+
+    @staticmethod
+    def insert_documents(collection, documents):
+        """
+        Inserts documents with an unordered bulk insert, ignoring the ones that already exist in the collection.
+        :returns The number of documents inserted.
+        """
+        try:
+            return len(collection.insert_many(documents, ordered=False).inserted_ids)
+        except BulkWriteError as ex:
+            # 11000 is MongoDB's duplicate key error code.
+            if any([e['code'] != 11000 for e in ex.details['writeErrors']]):
+                raise
+            return ex.details['nInserted']
+
+    @staticmethod
+    def prefetched(iterable, queue_size):
+        """
+        Iterates an iterable in a background thread, keeping up to queue_size items ahead of the consumer. Errors
+        raised by the iterable are raised to the consumer.
+        """
+        items = Queue.Queue(maxsize=queue_size)
+        stopped = threading.Event()
+        end_marker = object()
+
+        def put(item):
+            while not stopped.is_set():
+                try:
+                    items.put(item, timeout=0.5)
+                    return True
+                except Queue.Full:
+                    pass
+            return False
+
+        def produce():
+            try:
+                for item in iterable:
+                    if not put((item, None)):
+                        return
+                put((end_marker, None))
+            except Exception as ex:
+                put((end_marker, ex))
+
+        producer = threading.Thread(target=produce, name='YieldDatabaseSync prefetch')
+        producer.daemon = True
+        producer.start()
+
+        try:
+            while True:
+                item, error = items.get()
+                if error is not None:
+                    raise error
+                if item is end_marker:
+                    return
+                yield item
+        finally:
+            # Release the producer if the consumer stops before the end.
+            stopped.set()
+
+    @staticmethod
+    def chunks(iterable, size):
+        chunk = []
+        for item in iterable:
+            chunk.append(item)
+            if len(chunk) == size:
+                yield chunk
+                chunk = []
+        if len(chunk) > 0:
+            yield chunk
@@ -1,9 +1,11 @@
 import json
 import os
 import numpy as np
+from collections import OrderedDict
 
 from core.lib.io.file import create_folder_with_permissions
 from core.modules.simulations_manager.soil.SoilDAO import SoilDAO
+from core.modules.statistics.metrics import rundir_bytes
 
 __author__ = 'Federico Schmidt'
 
@@ -35,33 +37,8 @@ class CampaignWriter:
         cycle_variables = ','.join(res_variables)
         daily_variables = ','.join(set(forecast.results.daily))
 
-        if 'reference_year' in forecast.configuration:
-            ref_year = int(forecast.configuration.reference_year)
-        else:
-            # Get the reference year from the campaign start date (if such date is actually defined).
-            ref_year = forecast.campaign_start_date
-
-            planting_after_new_year = [d.month < forecast.campaign_first_month for d in forecast.planting_dates()]
-
-            if any(planting_after_new_year) and any([not i for i in planting_after_new_year]):
-                raise RuntimeError('Forecast "%s" contains planting dates that happen both before and after the'
-                                   ' new year. This is currently not supported since pSIMS needs a unique reference'
-                                   'year configured. Plase consider splitting the conflicting locations in two '
-                                   'forecasts.' % forecast.name)
-
-            if all(planting_after_new_year):
-                ref_year = forecast.campaign_end_date
-
-            if ref_year is None:
-                    raise RuntimeError("Missing reference year in forecast.configuration and we can't get it from "
-                                       "the campaign start date since the forecast_date is None.")
-            else:
-                ref_year = ref_year.year
-
-        num_years = 1
-        if 'num_years' in forecast.configuration:
-            num_years = int(forecast.configuration.num_years)
-            assert num_years > 0, 'Number of years must be greater than zero (found %d).' % num_years
+        ref_year = CampaignWriter.reference_year(forecast)
+        num_years = CampaignWriter.num_years(forecast)
 
         delta = forecast.configuration.grid_resolution
         out_collection_name = forecast.configuration['simulation_collection']
@@ -89,12 +66,15 @@ class CampaignWriter:
                     delta,
                     n_scens,
                     num_years,
+                    root_path,
                     'mongodb://%s:%d' % (forecast.configuration.database.host, forecast.configuration.database.port),
                     forecast.configuration.database.name,
                     out_collection_name,
                     'mongodb://%s:%d' % (forecast.configuration.database.host, forecast.configuration.database.port),
                     forecast.configuration.database.name,
                     out_collection_name,
+                    root_path,
+                    root_path,
                     dssat_executable
                 ))
 
@@ -102,8 +82,10 @@ class CampaignWriter:
             sh_script = sh_template.read()
 
             with open(run_sh_path, mode='w') as run_sh:
+                # pSIMS reads the campaign from the rundir, the working directory is given when the script is ran.
                 run_sh.write(sh_script % (
-                    psims_path,
+                    root_path,
+                    root_path,
                     root_path
                 ))
 
@@ -114,8 +96,47 @@ class CampaignWriter:
         forecast.paths.params_path = params_file_path
         forecast.paths.gridlist_path = gridlist_file_path
 
+        rundir_bytes.inc(sum([os.path.getsize(f) for f in [netcdf_file_path, params_file_path, gridlist_file_path,
+                                                           run_sh_path]]), labels={'kind': 'campaign'})
         return run_sh_path
 
+    @staticmethod
+    def reference_year(forecast):
+        """
+        Returns the year that replaces the "yyyy" placeholder of the management dates of a forecast.
+        """
+        if 'reference_year' in forecast.configuration:
+            ref_year = int(forecast.configuration.reference_year)
+        else:
+            # Get the reference year from the campaign start date (if such date is actually defined).
+            ref_year = forecast.campaign_start_date
+
+            planting_after_new_year = [d.month < forecast.campaign_first_month for d in forecast.planting_dates()]
+
+            if any(planting_after_new_year) and any([not i for i in planting_after_new_year]):
+                raise RuntimeError('Forecast "%s" contains planting dates that happen both before and after the'
+                                   ' new year. This is currently not supported since pSIMS needs a unique reference'
+                                   'year configured. Plase consider splitting the conflicting locations in two '
+                                   'forecasts.' % forecast.name)
+
+            if all(planting_after_new_year):
+                ref_year = forecast.campaign_end_date
+
+            if ref_year is None:
+                    raise RuntimeError("Missing reference year in forecast.configuration and we can't get it from "
+                                       "the campaign start date since the forecast_date is None.")
+            else:
+                ref_year = ref_year.year
+        return ref_year
+
+    @staticmethod
+    def num_years(forecast):
+        num_years = 1
+        if 'num_years' in forecast.configuration:
+            num_years = int(forecast.configuration.num_years)
+            assert num_years > 0, 'Number of years must be greater than zero (found %d).' % num_years
+        return num_years
+
     @staticmethod
     def create_grids(forecast, output_dir):
         gridlist_file_path = os.path.join(output_dir, 'gridList.txt')
@@ -246,21 +267,36 @@ class CampaignWriter:
         wst_id = output_file.createVariable(varname='wst_id', datatype='u2', dimensions=('scen',), fill_value=-99)
         wst_id[:] = range(0, n_scenarios)
 
+        # Variables are collected in arrays filled with the NetCDF fill value and written with a single call each.
+        var_options = CampaignWriter.netcdf_variable_options(forecast)
+        var_arrays = OrderedDict()
+        # Values of string variables are mapped to indexes, var -> {value: index}.
+        var_mappings = {}
+
+        def get_array(var_name, datatype, dimensions):
+            if var_name not in netcdf_variables:
+                options = dict(var_options)
+                if 'chunksizes' in options:
+                    # Chunk sizes are configured by dimension name, unlisted dimensions aren't split.
+                    dim_lengths = [len(output_file.dimensions[dim]) for dim in dimensions]
+                    options['chunksizes'] = [min(options['chunksizes'].get(dim, length), length)
+                                             for dim, length in zip(dimensions, dim_lengths)]
+                netcdf_variables[var_name] = output_file.createVariable(varname=var_name, datatype=datatype,
+                                                                        dimensions=dimensions, fill_value=-99,
+                                                                        **options)
+                netcdf_var = netcdf_variables[var_name]
+                var_arrays[var_name] = np.full(netcdf_var.shape, netcdf_var._FillValue, dtype=netcdf_var.dtype)
+            return var_arrays[var_name]
+
         for loc_simulations in simulation_list.values():
             for sim in loc_simulations:
 
                 for var, content in sim['initial_conditions'].iteritems():
-                    if var not in netcdf_variables:
-                        datatype = 'f4'
-                        if var == 'icbl':
-                            datatype = 'u2'
-                        netcdf_var = output_file.createVariable(varname=var, datatype=datatype,
-                                                                dimensions=('lat', 'lon', 'soil_layer'),
-                                                                fill_value=-99)
-                        netcdf_variables[var] = netcdf_var
-                    else:
-                        netcdf_var = netcdf_variables[var]
-                    netcdf_var[sim.lat_idx, sim.lon_idx, 0:len(content)] = content
+                    datatype = 'f4'
+                    if var == 'icbl':
+                        datatype = 'u2'
+                    var_array = get_array(var, datatype, ('lat', 'lon', 'soil_layer'))
+                    var_array[sim.lat_idx, sim.lon_idx, 0:len(content)] = content
 
                 for var, content in sim['management'].iteritems():
                     if var == 'mgmt_name':
@@ -270,32 +306,37 @@ class CampaignWriter:
                     if isinstance(content, str):
                         datatype = 'u2'
 
-                    if var not in netcdf_variables:
-                        netcdf_var = output_file.createVariable(varname=var, datatype=datatype,
-                                                                dimensions=('lat', 'lon'),
-                                                                fill_value=-99)
-                        netcdf_variables[var] = netcdf_var
-                    else:
-                        netcdf_var = netcdf_variables[var]
+                    var_array = get_array(var, datatype, ('lat', 'lon'))
 
                     if isinstance(content, str):
-                        netcdf_var.units = 'Mapping'
-                        if 'long_name' not in netcdf_var.ncattrs():
-                            netcdf_var.long_name = content
+                        var_mapping = var_mappings.setdefault(var, {})
+                        if content not in var_mapping:
                             # pSIMS indexes for mapping start at 1.
-                            content = 1
-                        else:
-                            var_mapping = netcdf_var.long_name.split(',')
-                            if content not in var_mapping:
-                                var_mapping.append(content)
-                                content = len(var_mapping)
-                                # Workaround for Python NetCDF lib bug (delete var attr first, then write it again).
-                                del netcdf_var.long_name
-                                netcdf_var.long_name = ','.join(var_mapping)
-                            else:
-                                # Find the position of 'content' inside the 'long_name' attribute.
-                                content = var_mapping.index(content) + 1  # (+1 since pSIMS Mapping indexes start at 1)
-
-                    netcdf_var[sim.lat_idx, sim.lon_idx] = content
+                            var_mapping[content] = len(var_mapping) + 1
+                        content = var_mapping[content]
+
+                    var_array[sim.lat_idx, sim.lon_idx] = content
+
+        for var, var_array in var_arrays.iteritems():
+            netcdf_var = netcdf_variables[var]
+            netcdf_var[:] = var_array
+
+            if var in var_mappings:
+                netcdf_var.units = 'Mapping'
+                netcdf_var.long_name = ','.join(sorted(var_mappings[var], key=var_mappings[var].get))
 
         output_file.close()
+
+    @staticmethod
+    def netcdf_variable_options(forecast):
+        """
+        Returns the compression and chunking options of the campaign NetCDF variables, read from the campaign_netcdf
+        dictionary of the forecast configuration.
+        """
+        netcdf_config = forecast.configuration.get('campaign_netcdf', None) or {}
+        options = {}
+
+        for option in ['zlib', 'complevel', 'shuffle', 'contiguous', 'chunksizes']:
+            if option in netcdf_config:
+                options[option] = netcdf_config[option]
+        return options
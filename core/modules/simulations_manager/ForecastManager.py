@@ -1,22 +1,29 @@
 # -*- coding: utf-8 -*-
 import os
-import re
 import shutil
-import threading
 import logging
 import copy
+import time
 from datetime import datetime, timedelta
+from pymongo.errors import BulkWriteError
 
-from core.lib.io.file import create_folder_with_permissions, listdir_fullpath
-from core.lib.utils.extended_collections import DotDict
+from core.lib.io.file import create_folder_with_permissions
+from core.lib.utils.extended_collections import DotDict, group_by
 from core.lib.utils.log import log_format_exception
+from core.lib.utils.profiler import StageProfiler
+from core.modules.config import resources
 from core.modules.config.loaders import ForecastLoader
 from core.modules.simulations_manager.CampaignWriter import CampaignWriter
 from core.modules.simulations_manager.weather.DatabaseWeatherSeries import DatabaseWeatherSeries
 from core.modules.simulations_manager.RunpSIMS import RunpSIMS
+from core.modules.simulations_manager.RunDSSAT import RunDSSAT
+from core.modules.simulations_manager.ResultsValidator import ResultsValidator
+from core.modules.simulations_manager.ResultsWriter import ResultsWriter
+from core.modules.simulations_manager.InputFingerprint import InputFingerprint
 from core.lib.jobs.monitor import NullMonitor, JOB_STATUS_WAITING, JOB_STATUS_RUNNING, ProgressMonitor
 from core.modules.config.priority import RUN_FORECAST, RUN_REFERENCE_FORECAST
 from core.modules.simulations_manager.weather.HistoricalSeriesMaker import HistoricalSeriesMaker
+from core.modules.simulations_manager.weather.SeriesExecutor import SeriesExecutor
 
 __author__ = 'Federico Schmidt'
 
@@ -24,7 +31,13 @@ __author__ = 'Federico Schmidt'
 class ForecastManager:
     def __init__(self, scheduler, system_config, weather_updater):
         self.system_config = system_config
-        self.psims_runner = RunpSIMS()
+        self.psims_runner = RunpSIMS(slots_path=os.path.join(system_config.temp_folder, 'psims_slots'),
+                                     max_slots=system_config.get('psims_slots', 1))
+        # Engines that can run the simulations of a forecast, selected with its simulation_engine configuration.
+        self.simulation_engines = {
+            'psims': self.psims_runner,
+            'dssat': RunDSSAT(system_config)
+        }
         self.scheduler = scheduler
         self.weather_updater = weather_updater
         self.scheduled_reference_simulations_ids = set()
@@ -70,6 +83,101 @@ class ForecastManager:
                                                 kwargs={'priority': priority}, run_date=run_date)
         forecast['job_id'] = job_handle.id
 
+    @staticmethod
+    def insert_simulations(collection, simulations, inserted_ids, batch_size=1000):
+        """
+        Inserts simulations with ordered bulk writes of up to batch_size documents and sets the _id of each one.
+        :param inserted_ids: A list where the id of every inserted simulation is appended. Ids are appended even if a
+        batch fails, so the caller can rollback a partial insertion.
+        """
+        if batch_size < 1:
+            raise RuntimeError('Invalid insert batch size (%s).' % batch_size)
+
+        for batch_start in range(0, len(simulations), batch_size):
+            batch = simulations[batch_start:batch_start + batch_size]
+            # Simulations get their last_modified date once their forecast finishes (see mark_finished).
+            documents = [sim.persistent_view() for sim in batch]
+
+            try:
+                batch_ids = collection.insert_many(documents, ordered=True).inserted_ids
+            except BulkWriteError as ex:
+                # Ordered inserts stop at the first error, every document before it was inserted.
+                inserted_ids.extend([d['_id'] for d in documents[:ex.details['nInserted']]])
+                raise
+
+            for sim, sim_id in zip(batch, batch_ids):
+                sim['_id'] = sim_id
+            inserted_ids.extend(batch_ids)
+
+    def save_run(self, run):
+        """
+        Stores the timings of a forecast run in the forecast_runs collection. Failing to store them doesn't fail the
+        forecast.
+        """
+        try:
+            run['last_modified'] = datetime.utcnow()
+            self.system_config.database['yield_db'].forecast_runs.insert_one(run)
+        except Exception:
+            logging.getLogger().error('Failed to store the timings of forecast "%s". Reason: %s' %
+                                      (run['forecast_name'], log_format_exception()))
+
+    @staticmethod
+    def mark_finished(db, simulation_collection, simulations_ids, forecast_id=None, batch_size=1000):
+        """
+        Stamps the simulations of a forecast that passed the results validation (and the forecast itself, which is
+        inserted with a "running" status) with a last_modified date, so the database sync starts copying them.
+        """
+        modified_date = datetime.utcnow()
+        for batch_start in range(0, len(simulations_ids), batch_size):
+            batch_ids = simulations_ids[batch_start:batch_start + batch_size]
+            db[simulation_collection].update_many({'_id': {'$in': batch_ids}},
+                                                  {'$set': {'last_modified': modified_date}})
+        if forecast_id:
+            db.forecasts.update_one({'_id': forecast_id},
+                                    {'$set': {'status': 'finished', 'last_modified': modified_date}})
+
+    @staticmethod
+    def simulation_collection(forecast):
+        """
+        The simulations collection can be defined by the user in the YAML file. If it's not defined, base the decision
+        of which one to use on the type of weather series the forecast will use.
+        """
+        if 'simulation_collection' in forecast.configuration:
+            return forecast.configuration['simulation_collection']
+        if forecast.configuration.weather_series == 'historic':
+            return 'reference_simulations'
+        if forecast.configuration.weather_series == 'netcdf':
+            return 'netcdf_simulations'
+        return 'simulations'
+
+    @staticmethod
+    def reuse_results(collection, simulations, batch_size=1000):
+        """
+        Copies the results of finished simulations with the same input fingerprint (see InputFingerprint) to a list of
+        inserted simulations. Previous results are looked up with $in queries of up to batch_size fingerprints.
+        :returns The simulations whose results were copied.
+        """
+        pending = group_by([sim for sim in simulations if sim.get('input_fingerprint')],
+                           lambda sim: sim.input_fingerprint)
+        fingerprints = pending.keys()
+        results_writer = ResultsWriter(collection, batch_size=batch_size)
+        reused_simulations = []
+
+        for chunk_start in range(0, len(fingerprints), batch_size):
+            previous_simulations = collection.find({
+                'input_fingerprint': {'$in': fingerprints[chunk_start:chunk_start + batch_size]},
+                'cycle_results': {'$exists': True}
+            }, projection=['input_fingerprint', 'cycle_results', 'daily_results'])
+
+            for previous in previous_simulations:
+                for sim in pending.pop(previous['input_fingerprint'], []):
+                    results_writer.add_documents(sim['_id'], cycle_results=previous['cycle_results'],
+                                                 daily_results=previous.get('daily_results'))
+                    reused_simulations.append(sim)
+
+        results_writer.flush()
+        return reused_simulations
+
     def reschedule_forecast(self, forecast, now=False):
         job_name = "Rescheduled: %s (%s)" % (forecast.name, forecast.forecast_date)
         if now:
@@ -88,22 +196,37 @@ class ForecastManager:
         db = None
         forecast_id = None
         simulations_ids = None
+        wth_series_maker = None
         exception_raised = False
+        rescheduled = False
+        # Timings of each stage of the run, stored in the forecast_runs collection.
+        profiler = StageProfiler()
 
         if not progress_monitor:
-            progress_monitor = NullMonitor
+            progress_monitor = NullMonitor()
 
         progress_monitor.end_value = 5
         progress_monitor.job_started()
         progress_monitor.update_progress(job_status=JOB_STATUS_WAITING)
 
-        with self.system_config.jobs_lock.blocking_job(priority=priority):
+        # Forecasts only lock their own configuration, the soils and (while their weather series are created) their
+        # weather stations, so forecasts and updates of other stations can run at the same time. The database sync
+        # doesn't copy the documents of running forecasts, they're only stamped with a last_modified date once their
+        # results are validated (see mark_finished).
+        forecast_file = yield_forecast.get('file_name')
+        lock_wait_start = time.time()
+        with self.system_config.resource_locks.resources(
+                shared=[resources.CONFIGURATION, resources.forecast_file(forecast_file), resources.SOILS],
+                exclusive=[resources.forecast(forecast_file, yield_forecast.name)],
+                priority=priority, job_id=progress_monitor.job_id):
             # Lock acquired.
+            profiler.add_stage('lock_wait', lock_wait_start, time.time() - lock_wait_start)
             progress_monitor.update_progress(job_status=JOB_STATUS_RUNNING)
 
             forecast = copy.deepcopy(yield_forecast)
             try:
                 run_start_time = datetime.now()
+                profiler.start('setup')
 
                 # Get MongoDB connection.
                 db = self.system_config.database['yield_db']
@@ -121,20 +244,14 @@ class ForecastManager:
                 # Create an instance of the weather series maker.
                 wth_series_maker = forecast.configuration.weather_maker_class(self.system_config,
                                                                               forecast.configuration.max_parallelism)
-                # The simulations collection can be defined by the user in the YAML file.
-                if 'simulation_collection' not in forecast.configuration:
-                    # If it's not defined, base the decision of which one to use on the type of weather series
-                    # the forecast will use.
-                    forecast.configuration['simulation_collection'] = 'simulations'
-                    if forecast.configuration.weather_series == 'historic':
-                        forecast.configuration['simulation_collection'] = 'reference_simulations'
-                    if forecast.configuration.weather_series == 'netcdf':
-                        forecast.configuration['simulation_collection'] = 'netcdf_simulations'
+                forecast.configuration['simulation_collection'] = ForecastManager.simulation_collection(forecast)
 
                 if forecast.configuration['simulation_collection'] not in db.collection_names():
                     raise RuntimeError('The specified collection (%s) does not exist in the results database.' %
                                        forecast.configuration['simulation_collection'])
 
+                profiler.end()
+                profiler.start('rundir_creation')
                 folder_name = "%s" % (datetime.now().isoformat())
                 folder_name = folder_name.replace('"', '').replace('\'', '').replace(' ', '_')
                 forecast.folder_name = folder_name.encode('unicode-escape')
@@ -159,10 +276,15 @@ class ForecastManager:
                                                              folder_name).encode('unicode-escape')
                 create_folder_with_permissions(forecast.paths.wth_csv_read)
 
-                active_threads = dict()
+                profiler.end()
+
+                # Locations for which weather series will be created, one for each weather station.
+                station_locations = dict()
 
                 forecast.weather_stations = {}
                 forecast.rainfall = {}
+                # Max date with weather data of each station, part of the weather cache keys.
+                forecast.weather_max_dates = {}
 
                 stations_not_updated = set()
                 if forecast.forecast_date is None:
@@ -170,10 +292,13 @@ class ForecastManager:
                 else:
                     run_date = datetime.strptime(forecast.forecast_date, '%Y-%m-%d').date()
 
+                profiler.start('location_upserts', count=len(forecast['locations']))
                 for loc_key, location in forecast['locations'].iteritems():
                     omm_id = location['weather_station']
 
                     # Upsert location.
+                    location_view = location.persistent_view()
+                    location_view['last_modified'] = datetime.utcnow()
                     db.locations.update_one({'_id': location.id}, {
                         # '$set': {
                         #     "name": location.name,
@@ -181,7 +306,7 @@ class ForecastManager:
                         #     "coord_y": location.coord_y,
                         #     "weather_station": location.weather_station
                         # }
-                        '$set': location.persistent_view()
+                        '$set': location_view
                     }, upsert=True)
 
                     # If this forecast is creating weather files from the weather database, check that the station
@@ -200,39 +325,45 @@ class ForecastManager:
                             stations_not_updated.add(omm_id)
                             continue
 
-                    if omm_id not in active_threads:
+                        forecast.weather_max_dates[omm_id] = self.weather_updater.wth_max_date[omm_id]
+
+                    if omm_id not in station_locations:
                         # Weather station data updated, forecast can be ran.
-                        active_threads[omm_id] = threading.Thread(target=wth_series_maker.create_series,
-                                                                  name='create_series for omm_id = %s' % omm_id,
-                                                                  args=(location, forecast))
+                        station_locations[omm_id] = location
                     else:
                         # Weather station already has an associated thread that will create the weather series.
                         continue
 
+                profiler.end()
+
                 if len(stations_not_updated) > 0:
                     # Forecast can't continue, must be rescheduled.
                     logging.warning("Couldn't run forecast \"%s\" because the following weather stations don't have "
                                     "updated data: %s." % (forecast_full_name, list(stations_not_updated)))
                     self.reschedule_forecast(forecast)
+                    rescheduled = True
                     return 0
 
                 progress_monitor.update_progress(new_value=1)
 
-                weather_series_monitor = ProgressMonitor(end_value=len(active_threads))
+                weather_series_monitor = ProgressMonitor(end_value=len(station_locations))
                 progress_monitor.add_subjob(weather_series_monitor,
                                             job_name='Create weather series (%s)' %
                                                      forecast.configuration.weather_maker_class.__name__)
-                joined_threads_count = 0
 
-                # Start all weather maker threads.
-                for t in active_threads.values():
-                    t.start()
+                # Create the weather grid.
+                series_executor = SeriesExecutor.get_executor(self.system_config, forecast)
+                with profiler.stage('weather_series', count=len(station_locations)):
+                    stations_lock_start = time.time()
+                    with self.system_config.resource_locks.resources(
+                            shared=resources.weather_stations(station_locations.keys()), priority=priority,
+                            job_id=progress_monitor.job_id):
+                        profiler.add_stage('lock_wait', stations_lock_start, time.time() - stations_lock_start)
+                        series_executor.run(wth_series_maker, station_locations,
+                                            progress_monitor=weather_series_monitor)
 
-                # Wait for the weather grid to be populated.
-                for t in active_threads.values():
-                    t.join()
-                    joined_threads_count += 1
-                    weather_series_monitor.update_progress(joined_threads_count)
+                    for omm_id, (start_time, duration) in sorted(series_executor.stations_times.items()):
+                        profiler.add_stage('station %s' % omm_id, start_time, duration, omm_id=omm_id)
 
                 weather_series_monitor.job_ended()
                 progress_monitor.update_progress(new_value=2)
@@ -243,17 +374,22 @@ class ForecastManager:
                     # The rest of the weather series makers use in-memory series creation.
                     shutil.rmtree(forecast.paths.wth_csv_read)
 
+                profiler.start('forecast_insert')
                 forecast_persistent_view = forecast.persistent_view()
                 is_reference_forecast = True
                 if forecast_persistent_view:
                     is_reference_forecast = False
+                    forecast_persistent_view['status'] = 'running'
                     forecast_id = db.forecasts.insert_one(forecast_persistent_view).inserted_id
 
                     if not forecast_id:
                         raise RuntimeError('Failed to insert forecast with id: %s' % forecast_persistent_view['_id'])
 
+                profiler.end()
+
                 simulations_ids = []
                 reference_ids = []
+                simulations = []
 
                 # Flatten simulations and update location info (with id's and computed weather stations).
                 for loc_key, loc_simulations in forecast.simulations.iteritems():
@@ -267,10 +403,31 @@ class ForecastManager:
                             sim.forecast_date = forecast.forecast_date
                             reference_ids.append(sim.reference_id)
 
-                        sim_id = db[forecast.configuration['simulation_collection']].insert_one(sim.persistent_view()).inserted_id
-                        sim['_id'] = sim_id
-                        simulations_ids.append(sim_id)
-
+                        simulations.append(sim)
+
+                # Results of previous simulations with the same inputs are reused (unless disabled in the forecast).
+                reuse_results = forecast.configuration.get('reuse_results', True)
+                if reuse_results:
+                    fingerprint_start_time = datetime.now()
+                    profiler.start('input_fingerprints', count=len(simulations))
+                    input_fingerprint = InputFingerprint(forecast)
+                    for sim in simulations:
+                        sim.input_fingerprint = input_fingerprint.fingerprint(sim)
+                    profiler.end()
+                    logging.getLogger().debug('Computed input fingerprints of forecast "%s" (time=%s).' %
+                                              (forecast_full_name, datetime.now() - fingerprint_start_time))
+
+                persistence_start_time = datetime.now()
+                profiler.start('simulations_insert', count=len(simulations))
+                ForecastManager.insert_simulations(db[forecast.configuration['simulation_collection']], simulations,
+                                                   inserted_ids=simulations_ids,
+                                                   batch_size=forecast.configuration.get('insert_batch_size', 1000))
+                profiler.end()
+                logging.getLogger().info('Inserted %d simulations of forecast "%s" (time=%s).' %
+                                         (len(simulations_ids), forecast_full_name,
+                                          datetime.now() - persistence_start_time))
+
+                profiler.start('reference_simulations')
                 if not is_reference_forecast:
                     # Find which simulations have a reference simulation associated.
                     found_reference_simulations = db.reference_simulations.find({
@@ -308,12 +465,41 @@ class ForecastManager:
                 else:
                     # Remove this reference forecasts id's.
                     self.scheduled_reference_simulations_ids -= set(reference_ids)
+                profiler.end()
 
                 progress_monitor.update_progress(new_value=3)
 
-                forecast.paths.run_script_path = CampaignWriter.write_campaign(forecast,
-                                                                               output_dir=forecast.paths.rundir)
-                forecast.simulation_count = len(simulations_ids)
+                pending_simulations_count = len(simulations_ids)
+                if reuse_results:
+                    profiler.start('results_reuse')
+                    reused_simulations = ForecastManager.reuse_results(
+                        db[forecast.configuration['simulation_collection']], simulations,
+                        batch_size=forecast.configuration.get('insert_batch_size', 1000))
+
+                    if len(reused_simulations) > 0:
+                        # Only the simulations without previous results are ran.
+                        reused_ids = set([sim['_id'] for sim in reused_simulations])
+                        for loc_key in forecast.simulations.keys():
+                            forecast.simulations[loc_key] = [sim for sim in forecast.simulations[loc_key]
+                                                             if sim['_id'] not in reused_ids]
+                            if len(forecast.simulations[loc_key]) == 0:
+                                del forecast.simulations[loc_key]
+                        pending_simulations_count -= len(reused_simulations)
+
+                    logging.getLogger().info('Reused the results of %d/%d simulations of forecast "%s".' %
+                                             (len(reused_simulations), len(simulations_ids), forecast_full_name))
+                    profiler.end()['count'] = len(reused_simulations)
+
+                simulation_engine = forecast.configuration.get('simulation_engine', 'psims')
+                if simulation_engine not in self.simulation_engines:
+                    raise RuntimeError('Unsupported simulation engine "%s" in forecast "%s".' %
+                                       (simulation_engine, forecast.name))
+
+                if simulation_engine == 'psims' and pending_simulations_count > 0:
+                    with profiler.stage('campaign_writing'):
+                        forecast.paths.run_script_path = CampaignWriter.write_campaign(
+                            forecast, output_dir=forecast.paths.rundir)
+                forecast.simulation_count = pending_simulations_count
 
                 progress_monitor.update_progress(new_value=4)
 
@@ -327,45 +513,38 @@ class ForecastManager:
                     )
 
                 # Ejecutar simulaciones.
-                weather_series_monitor = ProgressMonitor()
-                progress_monitor.add_subjob(weather_series_monitor, job_name='Run pSIMS')
-                psims_exit_code = self.psims_runner.run(forecast, progress_monitor=weather_series_monitor, verbose=True)
+                if pending_simulations_count > 0:
+                    weather_series_monitor = ProgressMonitor()
+                    progress_monitor.add_subjob(weather_series_monitor, job_name='Run %s' %
+                                                ('pSIMS' if simulation_engine == 'psims' else 'DSSAT'))
+                    with profiler.stage('simulation_engine', engine=simulation_engine, count=pending_simulations_count):
+                        psims_exit_code = self.simulation_engines[simulation_engine].run(
+                            forecast, progress_monitor=weather_series_monitor, verbose=True)
+                else:
+                    # Every simulation reused previous results.
+                    psims_exit_code = 0
 
                 # Check results
                 if psims_exit_code == 0:
-                    inserted_simulations = db[forecast.configuration['simulation_collection']].find(
-                        {
-                            '_id': {'$in': simulations_ids},
-                            # Find simulations that have results field (either cycle or daily).
-                            # This property is created by the pSIMS Mongo hook so if a simulation doesn't have this
-                            # field it means that the execution inside pSIMS failed.
-                            '$or': [{'daily_results': {'$exists': True}}, {'cycle_results': {'$exists': True}}]
-                        },
-                        projection=['daily_results', 'cycle_results', 'name'])
-
-                    if len(simulations_ids) != inserted_simulations.count():
-                        raise RuntimeError('Mismatch between simulations id\'s length and finished simulations '
-                                           'count (%s != %s)' % (len(simulations_ids), inserted_simulations.count()))
-
-                    if 'HWAM' in forecast.results.cycle:
-                        # Check that there are no -99 values in the crop yield.
-                        for sim in inserted_simulations:
-                            if 'cycle_results' not in sim:
-                                continue
-                            for scen_idx, scenario in enumerate(sim['cycle_results']['HWAM']['scenarios']):
-
-                                if not (isinstance(scenario['value'], int) or isinstance(scenario['value'], float)):
-                                    # Nested years inside the scenario.
-                                    for year_index, v in enumerate(scenario['value']):
-                                        if v['value'] < 0:
-                                            raise RuntimeError('Found a negative value for HWAM inside a simulation '
-                                                               '(%s, id = %s, scenario index = %d, year index = %d).' %
-                                                               (sim['name'], sim['_id'], scen_idx, year_index))
-
-                                elif scenario['value'] < 0:
-                                    raise RuntimeError('Found a negative value for HWAM inside a simulation (%s, '
-                                                       'id = %s, scenario index = %d).' % (sim['name'], sim['_id'],
-                                                                                           scen_idx))
+                    validation_start_time = datetime.now()
+                    with profiler.stage('results_validation'):
+                        validation_report = ResultsValidator.validate(
+                            db[forecast.configuration['simulation_collection']], simulations_ids,
+                            check_yields='HWAM' in forecast.results.cycle)
+
+                    logging.getLogger().info('Validated results of forecast "%s": %d/%d simulations finished, %d '
+                                             'negative yields (time=%s).' %
+                                             (forecast_full_name, validation_report['finished'],
+                                              validation_report['expected'],
+                                              len(validation_report['negative_yields']),
+                                              datetime.now() - validation_start_time))
+
+                    if len(validation_report['errors']) > 0:
+                        raise RuntimeError(' '.join(validation_report['errors']))
+
+                    with profiler.stage('mark_finished'):
+                        ForecastManager.mark_finished(db, forecast.configuration['simulation_collection'],
+                                                      simulations_ids, forecast_id)
 
                 logging.getLogger().info('Finished running forecast "%s" (time=%s).\n' %
                                          (forecast.name, datetime.now() - run_start_time))
@@ -375,6 +554,14 @@ class ForecastManager:
 
                 exception_raised = True
             finally:
+                # Close the stage that failed (if any).
+                profiler.end_all()
+                profiler.start('cleanup')
+
+                if wth_series_maker:
+                    # Free any file or connection the weather series maker kept open for this forecast.
+                    wth_series_maker.release_resources()
+
                 if exception_raised or psims_exit_code != 0:
                     logging.info('Rolling back DB data for forecast "%s".' % forecast_full_name)
                     if db:
@@ -384,23 +571,31 @@ class ForecastManager:
                             )
                         if forecast_id:
                             db.forecasts.delete_one({"_id": forecast_id})
-                    return -1
-
-                if not psims_exit_code or psims_exit_code == 0:
+                    ret_val = -1
+                else:
                     # Clean the rundir.
                     if os.path.exists(forecast.paths.rundir):
                         shutil.rmtree(forecast.paths.rundir)
 
-                if psims_exit_code == 0:
-                    # Clean pSIMS run folder.
-                    rundir_regex = re.compile('.+/run(\d){3}$')
-                    files_filter = lambda file_name: rundir_regex.match(file_name) is not None
-
-                    psims_run_dirs = sorted(listdir_fullpath(forecast.paths.psims, filter=files_filter),
-                                            reverse=True)
-
-                    if len(psims_run_dirs) > 0:
-                        # Remove the last runNNN directory (the one this execution created).
-                        shutil.rmtree(psims_run_dirs[0])
-
-                return psims_exit_code
+                    # Clean the runNNN folders this pSIMS execution created.
+                    for psims_run_dir in forecast.paths.get('psims_run_dirs', []):
+                        shutil.rmtree(psims_run_dir)
+                    ret_val = psims_exit_code
+                profiler.end()
+
+                run_status = 'finished'
+                if rescheduled:
+                    run_status = 'rescheduled'
+                elif ret_val != 0:
+                    run_status = 'error'
+
+                self.save_run({
+                    'forecast_id': forecast_id if run_status == 'finished' else None,
+                    'forecast_name': yield_forecast.name,
+                    'forecast_file': forecast_file,
+                    'forecast_date': yield_forecast.forecast_date,
+                    'job_id': progress_monitor.job_id,
+                    'status': run_status,
+                    'profile': profiler.view()
+                })
+                return ret_val
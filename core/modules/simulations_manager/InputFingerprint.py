@@ -0,0 +1,130 @@
+import os
+import json
+import fnmatch
+from xxhash import xxh64
+from core.modules.simulations_manager.CampaignWriter import CampaignWriter
+from core.modules.simulations_manager.soil.SoilDAO import soil_repository
+
+__author__ = 'Federico Schmidt'
+
+
+class InputFingerprint(object):
+    """
+    Computes a hash of everything that determines the results of the simulations of a forecast: the simulation inputs
+    (soil, management and initial conditions), the content of its weather series and soil file, the crop template, the
+    DSSAT executable, the DSSAT genotype files (*.CUL, *.ECO and *.SPE), the pSIMS tapps and the forecast settings that
+    change what is simulated or stored (reference year, number of years, result variables and simulation engine).
+
+    Simulations with the same fingerprint have the same results, so the results of a previous execution can be reused.
+    File hashes are computed once per instance, create one instance for each forecast execution.
+    """
+    read_size = 1024 * 1024
+    # DSSAT data files that change the results of a simulation (cultivar, ecotype and species coefficients).
+    dssat_data_patterns = ('*.CUL', '*.ECO', '*.SPE')
+
+    def __init__(self, forecast):
+        self.forecast = forecast
+        # File path -> content hash.
+        self.file_hashes = {}
+        # (Folder path, file name patterns) -> content hash.
+        self.folder_hashes = {}
+        self.forecast_hash = None
+
+    def fingerprint(self, simulation):
+        if self.forecast_hash is None:
+            self.forecast_hash = self.__forecast_hash__()
+
+        weather_path = os.path.join(self.forecast.paths.rundir, simulation.weather_station['weather_path'])
+        weather_hashes = [self.file_hash(os.path.join(weather_path, 'WTH%05d.WTH' % scen_idx))
+                          for scen_idx in range(simulation.weather_station['num_scenarios'])]
+
+        soil_path = soil_repository.soils.get(simulation.soil.id)
+        if soil_path is None:
+            raise RuntimeError('Soil %s not found.' % simulation.soil.id)
+
+        management = dict([(k, v) for k, v in simulation.management.iteritems() if k != 'mgmt_name'])
+
+        return xxh64(json.dumps([
+            self.forecast_hash,
+            simulation.soil.id,
+            self.file_hash(soil_path),
+            management,
+            dict(simulation.initial_conditions),
+            weather_hashes
+        ], sort_keys=True)).hexdigest()
+
+    def file_hash(self, path):
+        path = os.path.abspath(path)
+
+        if path not in self.file_hashes:
+            file_hash = xxh64()
+            with open(path, mode='rb') as f:
+                for chunk in iter(lambda: f.read(self.read_size), ''):
+                    file_hash.update(chunk)
+            self.file_hashes[path] = file_hash.hexdigest()
+        return self.file_hashes[path]
+
+    def folder_hash(self, path, patterns=None):
+        """
+        Hashes the names and content of the files of a folder (and its subfolders).
+        :param patterns: File name patterns (eg. '*.CUL', matched ignoring case) of the files to hash, all files are
+                         hashed if None.
+        :returns The hash of the folder or None if it doesn't exist.
+        """
+        path = os.path.abspath(path)
+        key = (path, patterns)
+
+        if key not in self.folder_hashes:
+            if not os.path.isdir(path):
+                self.folder_hashes[key] = None
+                return None
+
+            files = []
+            for dir_path, dir_names, file_names in os.walk(path, followlinks=True):
+                dir_names.sort()
+                for file_name in sorted(file_names):
+                    if patterns and not any([fnmatch.fnmatch(file_name.upper(), p.upper()) for p in patterns]):
+                        continue
+                    file_path = os.path.join(dir_path, file_name)
+                    if os.path.isfile(file_path):
+                        files.append([os.path.relpath(file_path, path), self.file_hash(file_path)])
+            self.folder_hashes[key] = xxh64(json.dumps(files)).hexdigest()
+        return self.folder_hashes[key]
+
+    def __forecast_hash__(self):
+        forecast = self.forecast
+        configuration = forecast.configuration
+
+        executable = configuration.get('dssat_executable', 'DSCSM046')
+        executable_hash = None
+        for folder in InputFingerprint.executable_folders(forecast):
+            executable_path = os.path.join(folder, executable)
+            if os.path.isfile(executable_path):
+                executable_hash = self.file_hash(executable_path)
+                break
+
+        dssat_data_path = InputFingerprint.executable_folders(forecast)[0]
+
+        return xxh64(json.dumps([
+            forecast.crop_type,
+            self.file_hash(os.path.join('.', 'data', 'templates', forecast.crop_template)),
+            configuration.get('simulation_engine', 'psims'),
+            executable,
+            executable_hash,
+            self.folder_hash(dssat_data_path, self.dssat_data_patterns),
+            self.folder_hash(os.path.join(forecast.paths.psims, 'tapps')),
+            CampaignWriter.reference_year(forecast),
+            CampaignWriter.num_years(forecast),
+            sorted(set(forecast.results.cycle)),
+            sorted(set(forecast.results.get('daily', [])))
+        ], sort_keys=True)).hexdigest()
+
+    @staticmethod
+    def executable_folders(forecast):
+        """
+        Folders where the DSSAT executable is looked up: the DSSAT data files folder (see RunDSSAT) and the pSIMS DSSAT
+        tapp folder.
+        """
+        psims_path = forecast.paths.psims
+        return [forecast.configuration.get('dssat_path', os.path.join(psims_path, 'data', 'dssat_files')),
+                os.path.join(psims_path, 'tapps', 'pdssat')]
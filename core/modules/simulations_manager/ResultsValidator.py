@@ -0,0 +1,99 @@
+import numbers
+
+__author__ = 'Federico Schmidt'
+
+
+class ResultsValidator:
+    """
+    Checks the results that pSIMS wrote in the results database for a forecast. The checks are pushed to MongoDB as
+    aggregations, so only a count and the (hopefully few) invalid simulations are sent back.
+    """
+    # Max number of simulations with invalid yields included in a report.
+    max_reported_simulations = 20
+
+    # A simulation finished if the pSIMS Mongo hook created one of these fields.
+    finished_filter = {'$or': [{'daily_results': {'$exists': True}}, {'cycle_results': {'$exists': True}}]}
+
+    def __init__(self):
+        pass
+
+    @staticmethod
+    def validate(collection, simulations_ids, check_yields=True):
+        """
+        Validates the results of a group of simulations.
+        :param collection: The collection where the simulations are stored.
+        :param simulations_ids: The id's of the simulations to validate.
+        :param check_yields: Whether to check that there are no negative crop yields (HWAM).
+        :returns A report dictionary with the expected and finished simulations count, the id's of the simulations that
+        didn't finish, the negative yields found and a list of errors (empty if the results are valid).
+        """
+        report = {
+            'expected': len(simulations_ids),
+            'finished': 0,
+            'unfinished_ids': [],
+            'negative_yields': [],
+            'errors': []
+        }
+
+        ids_filter = {'_id': {'$in': simulations_ids}}
+
+        count = list(collection.aggregate([
+            {'$match': dict(ids_filter, **ResultsValidator.finished_filter)},
+            {'$group': {'_id': None, 'count': {'$sum': 1}}}
+        ]))
+        report['finished'] = count[0]['count'] if len(count) > 0 else 0
+
+        if report['finished'] != report['expected']:
+            # Find which simulations failed, this only happens when something went wrong.
+            finished_ids = collection.find(dict(ids_filter, **ResultsValidator.finished_filter), projection=['_id'])
+            finished_ids = set([s['_id'] for s in finished_ids])
+            report['unfinished_ids'] = [sim_id for sim_id in simulations_ids if sim_id not in finished_ids]
+            report['errors'].append('Mismatch between simulations id\'s length and finished simulations count '
+                                    '(%s != %s).' % (report['expected'], report['finished']))
+
+        if check_yields:
+            invalid_simulations = collection.aggregate([
+                {'$match': dict(ids_filter, **{'$or': [
+                    {'cycle_results.HWAM.scenarios.value': {'$lt': 0}},
+                    # Nested years inside the scenario.
+                    {'cycle_results.HWAM.scenarios.value.value': {'$lt': 0}}
+                ]})},
+                {'$limit': ResultsValidator.max_reported_simulations},
+                {'$project': {'name': 1, 'cycle_results.HWAM': 1}}
+            ])
+
+            for sim in invalid_simulations:
+                report['negative_yields'].extend(ResultsValidator.negative_values(sim))
+
+            for negative_yield in report['negative_yields']:
+                report['errors'].append('Found a negative value for HWAM inside a simulation (%(name)s, id = %(_id)s, '
+                                        'scenario index = %(scenario_index)d, year index = %(year_index)s).' %
+                                        negative_yield)
+        return report
+
+    @staticmethod
+    def negative_values(simulation, variable='HWAM'):
+        """
+        Finds the negative values of a cycle variable in a simulation document.
+        :returns A list of dictionaries with the simulation id and name, the value and its scenario and year indexes
+        (the year index is None for scenarios without nested years).
+        """
+        negative_values = []
+
+        for scen_idx, scenario in enumerate(simulation['cycle_results'][variable]['scenarios']):
+            if isinstance(scenario['value'], numbers.Number):
+                values = [(None, scenario['value'])]
+            else:
+                # Nested years inside the scenario.
+                values = [(year_idx, v['value']) for year_idx, v in enumerate(scenario['value'])]
+
+            for year_idx, value in values:
+                if value < 0:
+                    negative_values.append({
+                        '_id': simulation['_id'],
+                        'name': simulation.get('name'),
+                        'scenario_index': scen_idx,
+                        'year_index': year_idx,
+                        'value': value
+                    })
+        return negative_values
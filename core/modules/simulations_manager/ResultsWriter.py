@@ -0,0 +1,84 @@
+from pymongo import UpdateOne
+
+__author__ = 'Federico Schmidt'
+
+
+class ResultsWriter(object):
+    """
+    Writes the results of simulations to the simulations collection, with the document structure the pSIMS Mongo hooks
+    use (see cycle_document and daily_document). Results are buffered and written with unordered bulk writes of
+    batch_size simulations.
+    """
+
+    def __init__(self, collection, batch_size=100):
+        if batch_size < 1:
+            raise RuntimeError('Invalid results batch size (%s).' % batch_size)
+
+        self.collection = collection
+        self.batch_size = batch_size
+        self.pending = []
+        self.written_count = 0
+
+    def add(self, simulation_id, cycle_results=None, daily_results=None):
+        """
+        :param cycle_results: A dictionary with the values of each variable for each scenario index.
+        :param daily_results: A dictionary with the dates and values of each variable for each scenario index.
+        """
+        if cycle_results is not None:
+            cycle_results = ResultsWriter.cycle_document(cycle_results)
+        if daily_results is not None:
+            daily_results = ResultsWriter.daily_document(daily_results)
+        self.add_documents(simulation_id, cycle_results=cycle_results, daily_results=daily_results)
+
+    def add_documents(self, simulation_id, cycle_results=None, daily_results=None):
+        """
+        Adds results already in the document structure (eg. copied from another simulation). The last_modified date
+        isn't updated, it's set when the forecast of the simulation finishes (see ForecastManager.mark_finished).
+        """
+        update = {}
+        if cycle_results is not None:
+            update['cycle_results'] = cycle_results
+        if daily_results is not None:
+            update['daily_results'] = daily_results
+        if len(update) == 0:
+            return
+
+        self.pending.append(UpdateOne({'_id': simulation_id}, {'$set': update}))
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if len(self.pending) == 0:
+            return
+        self.collection.bulk_write(self.pending, ordered=False)
+        self.written_count += len(self.pending)
+        self.pending = []
+
+    @staticmethod
+    def cycle_document(results):
+        """
+        Each variable has a list with the value of each scenario (a list of values, one per year, if more than one year
+        was simulated): {VAR: {'scenarios': [{'value': v}, ...]}}.
+        """
+        document = {}
+        for scen_idx in sorted(results.keys()):
+            for var, value in results[scen_idx].iteritems():
+                if isinstance(value, list):
+                    value = [{'value': v} for v in value]
+                document.setdefault(var, {'scenarios': []})['scenarios'].append({'value': value})
+        return document
+
+    @staticmethod
+    def daily_document(results):
+        """
+        Each variable has a list with the dates (YYDDD) and values of each scenario:
+        {VAR: {'scenarios': [{'dates': [...], 'values': [...]}, ...]}}.
+        """
+        document = {}
+        for scen_idx in sorted(results.keys()):
+            for var, series in results[scen_idx].iteritems():
+                document.setdefault(var, {'scenarios': []})['scenarios'].append({
+                    'dates': series['dates'],
+                    'values': series['values']
+                })
+        return document
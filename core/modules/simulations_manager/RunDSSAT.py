@@ -0,0 +1,226 @@
+import os
+import sys
+import json
+import logging
+import threading
+import subprocess
+import multiprocessing
+from datetime import datetime
+from core.lib.dssat.DSSATExpWriter import DSSATExpWriter
+from core.lib.dssat.DSSATOutReader import DSSATOutReader
+from core.lib.io.file import create_folder_with_permissions
+from core.lib.jobs.monitor import NullMonitor, JOB_STATUS_ERROR
+from core.lib.utils.log import log_format_exception
+from core.modules.simulations_manager.CampaignWriter import CampaignWriter
+from core.modules.simulations_manager.ResultsWriter import ResultsWriter
+from core.modules.simulations_manager.soil.SoilDAO import SoilDAO
+from core.modules.statistics.metrics import completed_simulations, engine_runs
+
+__author__ = 'Federico Schmidt'
+
+
+class RunDSSAT:
+    """
+    Runs the simulations of a forecast calling DSSAT directly, without pSIMS.
+
+    The experiment and soil files are written from the simulations, the crop template and the soil files (see
+    DSSATExpWriter), so the campaign NetCDF and the pSIMS translators aren't needed. Experiments are ran in a pool of
+    max_parallelism worker processes, each one with its own scratch folder linked to the DSSAT data files. Workers parse
+    the Summary.OUT and daily output files (see DSSATOutReader) and the results are written to the simulations
+    collection with bulk writes of results_batch_size simulations (see ResultsWriter).
+
+    It has the same interface than RunpSIMS, the engine of a forecast is selected with the simulation_engine key of its
+    configuration.
+
+    The worker pool is created for each run by the thread running the forecast, so in the system process workers are
+    forked while other threads are alive and inherit the locks they hold, as well as the open database connections.
+    Workers only write files and call DSSAT, but a lock held at fork time (eg. by a logging handler) is never released
+    in them, so this engine is opt-in and a warning is logged when it forks while other threads are running (see
+    ProcessSeriesExecutor).
+    """
+    experiment_file_name = 'X1234567.EXP'
+    soil_file_name = 'SOIL.SOL'
+
+    def __init__(self, system_config):
+        self.system_config = system_config
+
+    def run(self, forecast, progress_monitor=None, verbose=True):
+        if not progress_monitor:
+            progress_monitor = NullMonitor()
+
+        logging.getLogger().info('Running DSSAT for forecast "%s" (%s).' % (forecast.name, forecast.forecast_date))
+
+        progress_monitor.end_value = forecast.simulation_count
+        progress_monitor.job_started()
+
+        start_time = datetime.now()
+        tasks = self.tasks(forecast)
+        results_writer = ResultsWriter(
+            self.system_config.database['yield_db'][forecast.configuration['simulation_collection']],
+            batch_size=forecast.configuration.get('results_batch_size', 100))
+
+        dssat_path = os.path.abspath(forecast.configuration.get('dssat_path',
+                                                                os.path.join(forecast.paths.psims, 'data',
+                                                                             'dssat_files')))
+        scratch_path = os.path.join(forecast.paths.rundir, 'dssat')
+        create_folder_with_permissions(scratch_path)
+
+        # Simulation id -> (pending experiments count, cycle results and daily results of each scenario).
+        pending = {}
+        for task in tasks:
+            pending_count, cycle_results, daily_results = pending.get(task['simulation_id'], (0, {}, {}))
+            pending[task['simulation_id']] = (pending_count + 1, cycle_results, daily_results)
+
+        ret_val = 0
+        completed = 0
+        if threading.active_count() > 1:
+            logging.getLogger().warning('Forking DSSAT workers for forecast "%s" while %d other threads are running, '
+                                        'workers may deadlock on locks held by those threads.' %
+                                        (forecast.name, threading.active_count() - 1))
+        pool = multiprocessing.Pool(processes=forecast.configuration.get('max_parallelism', 1),
+                                    initializer=_init_worker,
+                                    initargs=(scratch_path, dssat_path,
+                                              forecast.configuration.get('dssat_executable', 'DSCSM046')))
+        try:
+            experiments_results = pool.imap_unordered(_run_experiment, tasks)
+            for simulation_id, scenario_cycle_results, scenario_daily_results in experiments_results:
+                pending_count, cycle_results, daily_results = pending[simulation_id]
+                cycle_results.update(scenario_cycle_results)
+                if scenario_daily_results is not None:
+                    daily_results.update(scenario_daily_results)
+
+                if pending_count > 1:
+                    pending[simulation_id] = (pending_count - 1, cycle_results, daily_results)
+                    continue
+
+                del pending[simulation_id]
+                results_writer.add(simulation_id, cycle_results=cycle_results,
+                                   daily_results=daily_results if len(daily_results) > 0 else None)
+                completed += 1
+                completed_simulations.inc(labels={'engine': 'dssat'})
+                progress_monitor.update_progress(new_value=completed)
+
+                if verbose:
+                    sys.stdout.write("\rCompleted: %02d/%02d. " % (completed, forecast.simulation_count))
+                    sys.stdout.flush()
+            pool.close()
+            results_writer.flush()
+        except Exception:
+            logging.getLogger().error('Failed to run DSSAT for forecast "%s". Reason: %s' %
+                                      (forecast.name, log_format_exception()))
+            ret_val = 1
+        finally:
+            pool.terminate()
+            pool.join()
+        engine_runs.observe((datetime.now() - start_time).total_seconds(),
+                            labels={'engine': 'dssat', 'status': 'error' if ret_val != 0 else 'finished'})
+
+        logging.getLogger().info('Finished running DSSAT for forecast "%s" (%s). Retval = %s. Time: %s.' %
+                                 (forecast.name, forecast.forecast_date, ret_val, datetime.now() - start_time))
+
+        if ret_val != 0:
+            progress_monitor.job_ended(end_status=JOB_STATUS_ERROR)
+        else:
+            progress_monitor.job_ended()
+
+        return ret_val
+
+    def tasks(self, forecast):
+        """
+        Builds the experiments of every simulation of a forecast, with a treatment for each weather scenario.
+        Simulations with more than DSSATExpWriter.max_treatments scenarios are split in several experiments.
+        :returns A list of tasks for _run_experiment.
+        """
+        with open(os.path.join('.', 'data', 'templates', forecast.crop_template)) as template_file:
+            template = json.load(template_file)
+
+        ref_year = CampaignWriter.reference_year(forecast)
+        num_years = CampaignWriter.num_years(forecast)
+        cycle_variables = sorted(set(forecast.results.cycle))
+        daily_variables = sorted(set(forecast.results.get('daily', [])))
+
+        tasks = []
+        soils = {}
+        for loc_simulations in forecast.simulations.values():
+            for sim in loc_simulations:
+                soil_id = sim.soil.id
+                if soil_id not in soils:
+                    soil = SoilDAO.get_soil(soil_id)
+                    if not soil:
+                        raise RuntimeError('Soil %s not found.' % soil_id)
+                    soils[soil_id] = soil['soils'][0]
+                soil = soils[soil_id]
+
+                if len(soil['soilLayer']) != sim.soil.n_horizons:
+                    raise RuntimeError('Mismatch between count of soil horizons in forecast specification file (%s)'
+                                       ' and soil file (%s) for soil "%s".' %
+                                       (sim.soil.n_horizons, len(soil['soilLayer']), soil_id))
+
+                experiment = DSSATExpWriter.experiment(template, sim, soil, ref_year)
+                weather_path = os.path.join(forecast.paths.rundir, sim.weather_station['weather_path'])
+                scenario_indexes = range(sim.weather_station['num_scenarios'])
+
+                for first_scenario in range(0, len(scenario_indexes), DSSATExpWriter.max_treatments):
+                    tasks.append({
+                        'simulation_id': sim['_id'],
+                        'experiment': experiment,
+                        'soil': soil,
+                        'weather_path': weather_path,
+                        'scenario_indexes': scenario_indexes[first_scenario:
+                                                             first_scenario + DSSATExpWriter.max_treatments],
+                        'cycle_variables': cycle_variables,
+                        'daily_variables': daily_variables,
+                        'num_years': num_years
+                    })
+        return tasks
+
+
+# State of a worker process, set by _init_worker.
+_worker_state = {}
+
+
+def _init_worker(scratch_path, dssat_path, dssat_executable):
+    # Each worker runs its experiments in its own folder, linked to the DSSAT data files.
+    worker_path = os.path.join(scratch_path, str(os.getpid()))
+    create_folder_with_permissions(worker_path)
+
+    for entry in os.listdir(dssat_path):
+        os.symlink(os.path.join(dssat_path, entry), os.path.join(worker_path, entry))
+
+    if os.path.exists(os.path.join(worker_path, dssat_executable)):
+        dssat_executable = os.path.join(worker_path, dssat_executable)
+
+    _worker_state['path'] = worker_path
+    _worker_state['executable'] = dssat_executable
+
+
+def _run_experiment(task):
+    worker_path = _worker_state['path']
+    scenario_indexes = task['scenario_indexes']
+
+    # Remove the weather files and outputs of the previous experiment.
+    for entry in os.listdir(worker_path):
+        if entry.endswith('.WTH') or entry.endswith('.OUT'):
+            os.unlink(os.path.join(worker_path, entry))
+
+    for scen_idx in scenario_indexes:
+        wth_file_name = 'WTH%05d.WTH' % scen_idx
+        os.symlink(os.path.join(task['weather_path'], wth_file_name), os.path.join(worker_path, wth_file_name))
+
+    DSSATExpWriter.write_exp(task['experiment'], scenario_indexes,
+                             os.path.join(worker_path, RunDSSAT.experiment_file_name), num_years=task['num_years'])
+    DSSATExpWriter.write_sol(task['soil'], os.path.join(worker_path, RunDSSAT.soil_file_name))
+
+    p = subprocess.Popen([_worker_state['executable'], 'A', RunDSSAT.experiment_file_name], cwd=worker_path,
+                         stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    output = p.communicate()[0]
+
+    summary_path = os.path.join(worker_path, DSSATOutReader.summary_file_name)
+    if p.returncode != 0 or not os.path.exists(summary_path):
+        raise RuntimeError('DSSAT failed for simulation %s (exit code: %s). Output:\n%s' %
+                           (task['simulation_id'], p.returncode, output))
+
+    cycle_results, daily_results = DSSATOutReader.read_results(worker_path, task['cycle_variables'],
+                                                               task['daily_variables'], scenario_indexes,
+                                                               num_years=task['num_years'])
+    return task['simulation_id'], cycle_results, daily_results
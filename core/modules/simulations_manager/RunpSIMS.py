@@ -1,4 +1,3 @@
-import time
 import re
 from datetime import datetime
 import shlex
@@ -8,23 +7,34 @@ import sys
 import os
 import signal
 import logging
+import tempfile
+import threading
+from collections import deque
 from core.lib.jobs.monitor import NullMonitor, JOB_STATUS_ERROR
+from core.modules.simulations_manager.psims.PSIMSPool import PSIMSPool
+from core.modules.statistics.metrics import completed_simulations, engine_runs
 
 __author__ = 'Federico Schmidt'
 
 
 class RunpSIMS:
 
-    def __init__(self, max_events=10000):
-        self.max_events = max_events
-        self.selecting = re.compile('Selecting site:(\d+)')
-        self.active = re.compile('Active:(\d+)')
-        self.finished = re.compile('Finished successfully:(\d+)')
-        self.submitted = re.compile('Submitted:(\d+)')
-        self.submitting = re.compile('Submitting:(\d+)')
-        self.stage_out = re.compile('Stage out:(\d+)')
-        self.stage_in = re.compile('Stage in:(\d+)')
-        self.failed = re.compile('Failed:(\d+)')
+    # States of the tasks reported in pSIMS progress lines.
+    progress_regex = re.compile('(Selecting site|Active|Finished successfully|Submitted|Submitting|Stage out|Stage in'
+                                '|Failed):(\d+)')
+
+    def __init__(self, output_buffer_lines=1000, slots_path=None, max_slots=1):
+        """
+        :param output_buffer_lines: Number of output lines kept to dump if a task fails.
+        :param slots_path: Folder where the working directories of pSIMS executions are created (see PSIMSPool).
+        :param max_slots: Max number of pSIMS executions that can run at the same time (for each pSIMS installation).
+        """
+        self.output_buffer_lines = output_buffer_lines
+        self.slots_path = slots_path
+        self.max_slots = max_slots
+        # pSIMS installation path -> PSIMSPool.
+        self.pools = {}
+        self.pools_lock = threading.Lock()
 
     def run(self, forecast, progress_monitor=None, verbose=True):
         if not progress_monitor:
@@ -35,10 +45,23 @@ class RunpSIMS:
         progress_monitor.end_value = forecast.simulation_count
         progress_monitor.job_started()
 
+        pool = self.get_pool(forecast.paths.psims)
+
         start_time = datetime.now()
-        ret_val = self.__run__(forecast.paths.run_script_path, forecast.name, forecast.simulation_count,
-                               progress_monitor, verbose)
+        with pool.slot() as slot_path:
+            logging.getLogger().debug('Running pSIMS at "%s" (waited %s for a free slot).' %
+                                      (slot_path, datetime.now() - start_time))
+            previous_run_dirs = PSIMSPool.run_dirs(slot_path)
+
+            ret_val = self.__run__(forecast.paths.run_script_path, slot_path, forecast.name,
+                                   forecast.simulation_count, progress_monitor, verbose)
+
+            # Keep the runNNN folders this execution created, they can be removed once the results are checked.
+            forecast.paths.psims_run_dirs = [os.path.join(slot_path, d)
+                                             for d in sorted(PSIMSPool.run_dirs(slot_path) - previous_run_dirs)]
         end_time = datetime.now()
+        engine_runs.observe((end_time - start_time).total_seconds(),
+                            labels={'engine': 'psims', 'status': 'error' if ret_val != 0 else 'finished'})
 
         logging.getLogger().info('Finished running pSIMS for forecast "%s" (%s). Retval = %s. Time: %s.' %
                                  (forecast.name, forecast.forecast_date, ret_val, end_time - start_time))
@@ -50,88 +73,96 @@ class RunpSIMS:
 
         return ret_val
 
-    def __run__(self, sh_script, forecast_name, sim_count, progress_monitor, verbose):
-        command = shlex.split('sh "%s"' % sh_script)
+    def get_pool(self, psims_path):
+        psims_path = os.path.abspath(psims_path)
 
-        p = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, preexec_fn=os.setsid)
+        with self.pools_lock:
+            if psims_path not in self.pools:
+                slots_path = self.slots_path
+                if not slots_path:
+                    slots_path = os.path.join(tempfile.gettempdir(), 'psims_slots')
+                self.pools[psims_path] = PSIMSPool(psims_path, slots_path, max_slots=self.max_slots)
+            return self.pools[psims_path]
 
-        stdout_lines = []
+    def __run__(self, sh_script, working_dir, forecast_name, sim_count, progress_monitor, verbose):
+        command = shlex.split('sh "%s" "%s"' % (sh_script, working_dir))
 
-        epoll = select.epoll()
-        epoll.register(p.stdout.fileno(), select.EPOLLOUT | select.EPOLLIN)
+        p = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, preexec_fn=os.setsid)
 
-        i = 0
+        # Only the last lines of output are kept, to be dumped if a task fails.
+        recent_output = deque(maxlen=self.output_buffer_lines)
+        # Completed tasks already added to the completed simulations counter.
+        counted = 0
+
+        for line in RunpSIMS.output_lines(p):
+            recent_output.append(line)
+
+            if not line.startswith('Progress'):
+                continue
+
+            counts = RunpSIMS.progress_counts(line)
+            running = counts.get('Active', 0)
+            completed = counts.get('Finished successfully', 0)
+            total = sum([count for state, count in counts.iteritems() if state != 'Failed'])
+
+            if total == 0:
+                continue
+
+            if 'Failed' in counts:
+                logging.getLogger().error("A task has failed, dumping pSIMS output.")
+                err_file_name = "ERR [%s] - %s.txt" % (datetime.now().isoformat(), forecast_name)
+                with open(err_file_name, mode='w') as err_file:
+                    err_file.write(''.join(recent_output))
+                # Kill processes.
+                os.killpg(os.getpgid(p.pid), signal.SIGKILL)
+            else:
+                progress_monitor.update_progress(new_value=completed)
+
+            if completed > counted:
+                completed_simulations.inc(completed - counted, labels={'engine': 'psims'})
+                counted = completed
+
+            if verbose:
+                sys.stdout.write("\rRunning: %d. Completed: %02d/%02d. " % (running, completed, total))
+                sys.stdout.flush()
+
+        return p.wait()
+
+    @staticmethod
+    def progress_counts(line):
+        """
+        Parses a pSIMS progress line (eg. "Progress: ... Active:2 Finished successfully:10").
+        :returns A dictionary with the count of tasks of each state found in the line.
+        """
+        return dict([(state, int(count)) for state, count in RunpSIMS.progress_regex.findall(line)])
+
+    @staticmethod
+    def output_lines(process, chunk_size=65536):
+        """
+        Reads the output of a process in chunks, without blocking more than a second, until the process closes it.
+        :returns A generator of output lines (with their line break).
+        """
+        fd = process.stdout.fileno()
+        epoll = select.epoll()
+        epoll.register(fd, select.EPOLLIN | select.EPOLLHUP)
 
+        pending = ''
         try:
-            while i < self.max_events:
-                i += 1
-                events = epoll.poll(timeout=1)
-                for fileno, event in events:
-
-                    if event & select.EPOLLIN:
-                        if fileno == p.stdout.fileno():
-                            read = p.stdout.readline()
-                            stdout_lines.append(read)
-                            # if verbose:
-                            #     sys.stdout.write('> ' + read)
-                            if read.startswith('Progress'):
-                                selecting = self.selecting.search(read)
-                                active = self.active.search(read)
-                                finished = self.finished.search(read)
-                                submitted = self.submitted.search(read)
-                                submitting = self.submitting.search(read)
-                                stage_out = self.stage_out.search(read)
-                                stage_in = self.stage_in.search(read)
-                                failed = self.failed.search(read)
-                                running = 0
-                                completed = 0
-                                total = 0
-
-                                if active:
-                                    running = int(active.groups()[0])
-                                    total += running
-                                if selecting:
-                                    total += int(selecting.groups()[0])
-                                if finished:
-                                    completed = int(finished.groups()[0])
-                                    total += completed
-                                if submitted:
-                                    total += int(submitted.groups()[0])
-                                if submitting:
-                                    total += int(submitting.groups()[0])
-                                if stage_out:
-                                    total += int(stage_out.groups()[0])
-                                if stage_in:
-                                    total += int(stage_in.groups()[0])
-
-                                if total == 0:
-                                    continue
-
-                                if failed:
-                                    logging.getLogger().error("A task has failed, dumping pSIMS output.")
-                                    err_file_name = "ERR [%s] - %s.txt" % (datetime.now().isoformat(), forecast_name)
-                                    with open(err_file_name, mode='w') as err_file:
-                                        err_file.write(''.join(stdout_lines))
-                                    # Kill processes.
-                                    os.killpg(os.getpgid(p.pid), signal.SIGKILL)
-                                else:
-                                    progress_monitor.update_progress(new_value=completed)
-
-                                if verbose:
-                                    sys.stdout.write("\rRunning: %d. Completed: %02d/%02d. "
-                                                     % (running, completed, total))
-                                    sys.stdout.flush()
-
-                    elif event & select.EPOLLHUP:
-                        if fileno == p.stdout.fileno():
-                            raise RuntimeError("Program ended.")
-
-        except RuntimeError, err:
-            print(err.message)
+            while True:
+                if len(epoll.poll(timeout=1)) == 0:
+                    continue
+
+                chunk = os.read(fd, chunk_size)
+                if not chunk:
+                    # End of file, the process closed its output.
+                    break
+
+                lines = (pending + chunk).split('\n')
+                pending = lines.pop()
+                for line in lines:
+                    yield line + '\n'
+            if pending:
+                yield pending
         finally:
-            epoll.unregister(p.stdout.fileno())
-
-        while p.poll() is None:
-            time.sleep(1)
-
-        return p.poll()
+            epoll.unregister(fd)
+            epoll.close()
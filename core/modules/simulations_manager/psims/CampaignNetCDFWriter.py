@@ -33,21 +33,21 @@ class CampaignNetCDFWriter:
                 soil_id = sim.soil.id
 
                 if soil_id not in soils:
-                    soil = SoilDAO.get_soil(soil_id)
-                    soils[soil_id] = soil
+                    soil_layers = SoilDAO.get_layers(soil_id, 'sllb')
+                    soils[soil_id] = soil_layers
 
-                    if not soil:
+                    if soil_layers is None:
                         raise RuntimeError('Soil %s not found.' % soil_id)
                 else:
-                    soil = soils[soil_id]
+                    soil_layers = soils[soil_id]
 
-                len_layers = len(soil['soilLayer'])
+                len_layers = len(soil_layers)
 
                 if len_layers != sim.soil.n_horizons:
                     raise RuntimeError('Mismatch between count of soil horizons in forecast specification file (%s)'
                                        ' and soil file (%s) for soil "%s".' %
                                        (len_layers, sim.soil.n_horizons, sim.soil.id))
-                sim['initial_conditions']['icbl'] = [int(layer['sllb']) for layer in soil['soilLayer']]
+                sim['initial_conditions']['icbl'] = [int(sllb) for sllb in soil_layers]
                 sim['management']['soil_id'] = soil_id
 
                 soil_layers_count.append(len_layers)
@@ -0,0 +1,89 @@
+import os
+import re
+import hashlib
+import logging
+import threading
+from contextlib import contextmanager
+
+__author__ = 'Federico Schmidt'
+
+
+class PSIMSPool(object):
+    """
+    Keeps a fixed number of pSIMS working directories ("slots") so several forecasts can run pSIMS at the same time.
+
+    A slot is a folder with a symlink to every file and folder of the pSIMS installation. pSIMS is ran from inside the
+    slot, so the runNNN folders it creates don't collide with other executions, and it reads the campaign directly
+    from the forecast rundir (see data/templates/run_psims.sh), so nothing has to be copied.
+    """
+    # Folders created by pSIMS executions, they're never linked into a slot.
+    run_dir_regex = re.compile('^run\d{3}$')
+
+    def __init__(self, psims_path, slots_path, max_slots=1):
+        if max_slots < 1:
+            raise RuntimeError('Invalid number of pSIMS slots (%s).' % max_slots)
+
+        self.psims_path = os.path.abspath(psims_path)
+        # Each pSIMS installation gets its own slots.
+        self.slots_path = os.path.join(os.path.abspath(slots_path), hashlib.md5(self.psims_path).hexdigest()[0:8])
+        self.max_slots = max_slots
+        self.free_slots = range(max_slots)
+        self.slots_available = threading.Condition()
+
+    def slot_path(self, slot_idx):
+        return os.path.join(self.slots_path, 'slot%02d' % slot_idx)
+
+    @contextmanager
+    def slot(self):
+        """
+        Waits until a slot is free and reserves it.
+        :returns The working directory of the slot, already linked to the pSIMS installation.
+        """
+        with self.slots_available:
+            while len(self.free_slots) == 0:
+                self.slots_available.wait()
+            slot_idx = self.free_slots.pop(0)
+
+        try:
+            yield self.prepare_slot(slot_idx)
+        finally:
+            with self.slots_available:
+                self.free_slots.append(slot_idx)
+                self.slots_available.notify()
+
+    def warm_up(self):
+        """
+        Creates the working directories of every slot.
+        """
+        for slot_idx in range(self.max_slots):
+            self.prepare_slot(slot_idx)
+
+    def prepare_slot(self, slot_idx):
+        """
+        Creates the working directory of a slot or updates its links if the pSIMS installation changed.
+        """
+        slot_path = self.slot_path(slot_idx)
+        if not os.path.exists(slot_path):
+            os.makedirs(slot_path)
+
+        installation_entries = set([f for f in os.listdir(self.psims_path) if not self.run_dir_regex.match(f)])
+
+        for entry in os.listdir(slot_path):
+            entry_path = os.path.join(slot_path, entry)
+            if os.path.islink(entry_path) and entry not in installation_entries:
+                # The file was removed from the installation.
+                os.unlink(entry_path)
+
+        for entry in installation_entries:
+            link_path = os.path.join(slot_path, entry)
+            if not os.path.islink(link_path):
+                if os.path.exists(link_path):
+                    logging.getLogger().warn('Can\'t link "%s" into pSIMS slot "%s", a file with the same name '
+                                             'exists.' % (entry, slot_path))
+                    continue
+                os.symlink(os.path.join(self.psims_path, entry), link_path)
+        return slot_path
+
+    @staticmethod
+    def run_dirs(slot_path):
+        return set([f for f in os.listdir(slot_path) if PSIMSPool.run_dir_regex.match(f)])
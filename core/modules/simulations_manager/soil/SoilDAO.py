@@ -1,35 +1,11 @@
-import logging
 import os
-import json
-from core.lib.io.file import listdir_fullpath, filename_without_ext
+from core.modules.simulations_manager.soil.SoilRepository import SoilRepository
 
 __author__ = 'Federico Schmidt'
 
 soils_path = os.path.join('.', 'data', 'soils')
-soils_dict = None
-
-
-def load_soils():
-    def is_soil_file(x):
-        return os.path.splitext(x)[1].lower() == '.json'
-
-    soil_files = listdir_fullpath(soils_path, recursive=True, onlyFiles=True, filter=is_soil_file)
-
-    for f in soil_files:
-        key = filename_without_ext(f)
-
-        if key in soils_dict:
-            logging.warn('Duplicated soil name "%s". Found at two different paths: "%s" and "%s".' % (key,
-                                                                                                      soils_dict[key],
-                                                                                                      f))
-            continue
-        soils_dict[key] = f
-
-    print('Found %d soils.' % len(soils_dict))
-
-if not soils_dict:
-    soils_dict = {}
-    load_soils()
+# The soils folder is scanned on first use (see SoilRepository.warm_up).
+soil_repository = SoilRepository(soils_path)
 
 
 class SoilDAO:
@@ -39,15 +15,20 @@ class SoilDAO:
 
     @staticmethod
     def get_soil(soil_id):
-        if not soils_dict:
+        if not soil_repository.soils:
+            raise RuntimeError('Soils dictionary not configured.')
+
+        return soil_repository.get_soil(soil_id)
+
+    @staticmethod
+    def get_layers(soil_id, field=None):
+        """
+        Returns the layers of a soil from the repository index: a matrix with a column for each layer field or, if a
+        field is given, the values of that field.
+        """
+        if not soil_repository.soils:
             raise RuntimeError('Soils dictionary not configured.')
 
-        if soil_id in soils_dict:
-            try:
-                return json.load(open(soils_dict[soil_id]), encoding='latin-1')
-            except Exception, ex:
-                print('@ soil file: "%s.json"' % soil_id)
-                raise ex
-        else:
-            logging.warn('Soil "%s" not found in soils directory (%s).' % (soil_id, soils_path))
-            return None
+        if field:
+            return soil_repository.layer_field(soil_id, field)
+        return soil_repository.layers(soil_id)
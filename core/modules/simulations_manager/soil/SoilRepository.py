@@ -0,0 +1,216 @@
+import os
+import json
+import logging
+import threading
+import numpy as np
+from collections import OrderedDict
+from core.lib.io.file import scan_tree, filename_without_ext
+
+__author__ = 'Federico Schmidt'
+
+
+class SoilRepository(object):
+    """
+    Catalogue of the soil files of a folder.
+
+    The folder is scanned the first time a soil is requested (or by warm_up). If a manifest_path is set, the catalogue
+    is saved there and reused by the next process as long as the modification times of the folders didn't change.
+
+    Parsed soils are kept in a LRU cache keyed by the path and modification time of their file, so every soil is parsed
+    once per process and edited files are parsed again. The layers of every soil are also kept in a compact index
+    (see layers), built once with build_index.
+    """
+    # Layer properties stored in the layers index.
+    layer_fields = ('sllb', 'slll', 'sldul', 'slsat', 'slbdm')
+
+    def __init__(self, soils_path, cache_size=512, manifest_path=None):
+        self.soils_path = soils_path
+        self.cache_size = cache_size
+        self.manifest_path = manifest_path
+        # Soil id -> soil file path, None until the soils folder is scanned.
+        self.catalogue = None
+        # (path, mtime) -> parsed soil, in least recently used order.
+        self.cache = OrderedDict()
+        # Soil id -> (mtime, layers matrix).
+        self.layers_index = {}
+        self.lock = threading.RLock()
+
+    @property
+    def soils(self):
+        if self.catalogue is None:
+            self.load()
+        return self.catalogue
+
+    def load(self):
+        """
+        Loads the catalogue from the manifest file if it's still valid, or scans the soils folder otherwise.
+        """
+        with self.lock:
+            if self.catalogue is not None:
+                return
+
+            soils = self.__read_manifest__()
+            if soils is not None:
+                self.catalogue = soils
+                logging.getLogger().info('Found %d soils (from manifest).' % len(soils))
+                return
+
+            self.reload()
+
+    def reload(self):
+        """
+        Scans the soils folder again, invalidating the cached soils and the layers index.
+        """
+        def is_soil_file(x):
+            return os.path.splitext(x)[1].lower() == '.json'
+
+        soil_files, dirs = scan_tree(self.soils_path, filter=is_soil_file)
+
+        soils = {}
+        manifest_soils = {}
+        for f, mtime in sorted(soil_files):
+            key = filename_without_ext(f)
+
+            if key in soils:
+                logging.warn('Duplicated soil name "%s". Found at two different paths: "%s" and "%s".' %
+                             (key, soils[key], f))
+                continue
+            soils[key] = f
+            manifest_soils[key] = [f, mtime]
+
+        with self.lock:
+            self.catalogue = soils
+            self.cache.clear()
+            self.layers_index.clear()
+
+        self.__write_manifest__({'soils_path': os.path.abspath(self.soils_path), 'dirs': dirs, 'soils': manifest_soils})
+        logging.getLogger().info('Found %d soils.' % len(soils))
+
+    def warm_up(self, background=True):
+        """
+        Loads the catalogue and builds the layers index.
+        :param background: Whether to do it in a daemon thread.
+        :returns The thread, if background is True.
+        """
+        if not background:
+            self.build_index()
+            return None
+
+        warm_up_thread = threading.Thread(target=self.build_index, name='Soils warm up')
+        warm_up_thread.daemon = True
+        warm_up_thread.start()
+        return warm_up_thread
+
+    def __read_manifest__(self):
+        if not self.manifest_path or not os.path.exists(self.manifest_path):
+            return None
+
+        try:
+            with open(self.manifest_path) as manifest_file:
+                manifest = json.load(manifest_file)
+
+            if manifest['soils_path'] != os.path.abspath(self.soils_path):
+                return None
+
+            # Adding, removing or renaming a file or folder changes the modification time of its parent folder.
+            for folder, mtime in manifest['dirs'].iteritems():
+                if not os.path.isdir(folder) or os.path.getmtime(folder) != mtime:
+                    return None
+
+            return dict([(soil_id, str(entry[0])) for soil_id, entry in manifest['soils'].iteritems()])
+        except Exception:
+            logging.getLogger().warn('Ignoring invalid soils manifest "%s".' % self.manifest_path)
+            return None
+
+    def __write_manifest__(self, manifest):
+        if not self.manifest_path:
+            return
+
+        try:
+            tmp_path = self.manifest_path + '.tmp'
+            with open(tmp_path, mode='w') as manifest_file:
+                json.dump(manifest, manifest_file)
+            os.rename(tmp_path, self.manifest_path)
+        except Exception:
+            logging.getLogger().warn('Failed to write soils manifest "%s".' % self.manifest_path)
+
+    def get_soil(self, soil_id):
+        """
+        Returns the parsed soil file of a soil. The returned object is shared with other callers and must not be
+        modified.
+        :returns The soil dictionary or None if the soil doesn't exist.
+        """
+        if soil_id not in self.soils:
+            logging.warn('Soil "%s" not found in soils directory (%s).' % (soil_id, self.soils_path))
+            return None
+
+        path = self.soils[soil_id]
+        key = (path, os.path.getmtime(path))
+
+        with self.lock:
+            if key in self.cache:
+                # Move the soil to the end of the LRU order.
+                soil = self.cache.pop(key)
+                self.cache[key] = soil
+                return soil
+
+        soil = SoilRepository.parse(path)
+
+        with self.lock:
+            self.cache[key] = soil
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return soil
+
+    def layers(self, soil_id):
+        """
+        Returns the layers of a soil as a float matrix with a row for each layer and a column for each one of the
+        layer_fields (use layer_field to get a single column).
+        :returns A NumPy array or None if the soil doesn't exist.
+        """
+        if soil_id not in self.soils:
+            return None
+
+        mtime = os.path.getmtime(self.soils[soil_id])
+        entry = self.layers_index.get(soil_id)
+
+        if not entry or entry[0] != mtime:
+            soil = self.get_soil(soil_id)
+            entry = (mtime, SoilRepository.layers_matrix(soil['soils'][0]['soilLayer']))
+            self.layers_index[soil_id] = entry
+        return entry[1]
+
+    def layer_field(self, soil_id, field):
+        layers = self.layers(soil_id)
+        if layers is None:
+            return None
+        return layers[:, SoilRepository.layer_fields.index(field)]
+
+    def build_index(self):
+        """
+        Builds the layers index of every soil of the catalogue. Soils are parsed without going through the LRU cache, so
+        building the index doesn't evict soils in use.
+        """
+        for soil_id, path in self.soils.items():
+            try:
+                mtime = os.path.getmtime(path)
+                if soil_id in self.layers_index and self.layers_index[soil_id][0] == mtime:
+                    continue
+                soil_layers = SoilRepository.parse(path)['soils'][0]['soilLayer']
+                self.layers_index[soil_id] = (mtime, SoilRepository.layers_matrix(soil_layers))
+            except Exception:
+                logging.getLogger().warn('Failed to index soil file "%s".' % path)
+
+    @staticmethod
+    def parse(path):
+        with open(path) as soil_file:
+            try:
+                return json.load(soil_file, encoding='latin-1')
+            except Exception, ex:
+                print('@ soil file: "%s"' % path)
+                raise ex
+
+    @staticmethod
+    def layers_matrix(soil_layers):
+        return np.array([[float(layer[f]) for f in SoilRepository.layer_fields] for layer in soil_layers],
+                        dtype=np.float64).reshape(len(soil_layers), len(SoilRepository.layer_fields))
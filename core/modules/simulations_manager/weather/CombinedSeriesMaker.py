@@ -6,6 +6,7 @@ from core.lib.utils.database import DatabaseUtils
 from core.lib.utils.extended_collections import DotDict
 from core.modules.simulations_manager.weather.DatabaseWeatherSeries import DatabaseWeatherSeries
 import itertools
+import operator
 
 __author__ = 'Federico Schmidt'
 
@@ -25,15 +26,13 @@ class CombinedSeriesMaker(DatabaseWeatherSeries):
         end_date = (forecast.campaign_end_date + timedelta(days=90)).strftime('%Y-%m-%d')
         omm_id = location['weather_station']
 
-        wth_db_connection = self.system_config.database['weather_db']
-        cursor = wth_db_connection.cursor()
+        with self.system_config.database['weather_db'].connection() as wth_db_connection:
+            cursor = wth_db_connection.cursor()
 
-        cursor.execute('SELECT pr_campañas_completas(%s, %s)', (omm_id, self.campaign_first_month))
-        full_campaigns = cursor.fetchall()
-
-        for campaign in full_campaigns:
-            campaign_year = campaign[0]
-            cursor.execute("SELECT * FROM pr_crear_serie(%s, %s, %s, %s, %s)",
-                           (omm_id, start_date, forecast_date, end_date, campaign_year))
+            # Create the series of every full campaign in a single round trip, rows are sorted by campaign and date.
+            cursor.execute("SELECT * FROM pr_crear_series(%s, %s, %s, %s, %s)",
+                           (omm_id, start_date, forecast_date, end_date, self.campaign_first_month))
             colnames = [tuple([desc[0] for desc in cursor.description])]
-            yield (campaign_year, itertools.chain(colnames, cursor))
+
+            for campaign_year, campaign_rows in itertools.groupby(cursor, key=operator.itemgetter(0)):
+                yield (campaign_year, itertools.chain(colnames, campaign_rows))
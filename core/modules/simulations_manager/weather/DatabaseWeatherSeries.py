@@ -19,6 +19,7 @@ class DatabaseWeatherSeries(WeatherSeriesMaker):
         self.max_paralellism = max_parallelism
         self.weather_writer = weather_writer
         self.concurrency_lock = threading.BoundedSemaphore(self.max_paralellism)
+        self.weather_cache = system_config.get('weather_cache', None)
 
     def create_series(self, location, forecast, extract_rainfall=True):
         with self.concurrency_lock:
@@ -38,17 +39,33 @@ class DatabaseWeatherSeries(WeatherSeriesMaker):
             if not os.path.exists(grid_column_folder):
                 create_folder_with_permissions(grid_column_folder)
 
-            rainfall_dict = dict()
-            scen_names = []
-            scen_index = 0
-            for scen_year, scen_weather in self.create_from_db(location, forecast):
-                variables_dict = self.weather_writer.write_wth_file(scen_index, scen_weather, grid_column_folder,
-                                                                    location)
-                if extract_rainfall:
-                    self.weather_writer.extract_rainfall(rainfall_dict, variables_dict, forecast.forecast_date,
-                                                         scen_year)
-                scen_names.append(scen_year)
-                scen_index += 1
+            # Keep a single pooled connection checked out while this station series are created.
+            with self.system_config.database['weather_db'].connection():
+                cache_key = self.cache_key(location, forecast, extract_rainfall)
+                cached_series = None
+                if cache_key:
+                    cached_series = self.weather_cache.get(omm_id, cache_key, grid_column_folder)
+
+                if cached_series:
+                    rainfall_dict = cached_series['rainfall']
+                    scen_names = cached_series['scen_names']
+                else:
+                    rainfall_dict = dict()
+                    scen_names = []
+                    scen_index = 0
+                    for scen_year, scen_weather in self.create_from_db(location, forecast):
+                        variables_dict = self.weather_writer.write_wth_file(scen_index, scen_weather,
+                                                                            grid_column_folder, location)
+                        if extract_rainfall:
+                            self.weather_writer.extract_rainfall(rainfall_dict, variables_dict,
+                                                                 forecast.forecast_date, scen_year)
+                        scen_names.append(scen_year)
+                        scen_index += 1
+
+                    if cache_key:
+                        file_names = ['WTH%s.WTH' % str(i).zfill(5) for i in range(0, len(scen_names))]
+                        self.weather_cache.put(omm_id, cache_key, grid_column_folder, file_names, scen_names,
+                                               rainfall_dict)
 
             if extract_rainfall:
                 forecast.rainfall[str(omm_id)] = rainfall_dict
@@ -61,9 +78,32 @@ class DatabaseWeatherSeries(WeatherSeriesMaker):
     def create_from_db(self, location, forecast):
         return iter([])
 
+    def cache_key(self, location, forecast, extract_rainfall):
+        """
+        Returns the key of a location series in the weather cache or None if it can't be cached.
+
+        Series are identified by the series maker, the weather station, the forecast date, the first month of the
+        campaign (of the forecast and of the database series) and the max date with weather data of the station, which
+        changes every time new data is ingested. The max date is the one checked by the ForecastManager before
+        creating the series (see WeatherUpdater.wth_max_date), stored in the weather_max_dates key of the forecast.
+        The location coordinates are also part of the key since they're written in the files header.
+        """
+        if not self.weather_cache:
+            return None
+
+        omm_id = location['weather_station']
+        max_date = forecast.get('weather_max_dates', {}).get(omm_id)
+
+        if max_date is None:
+            return None
+
+        return self.weather_cache.key(self.__class__.__name__, omm_id, forecast.forecast_date,
+                                      forecast.campaign_first_month, self.campaign_first_month, max_date,
+                                      location['coord_x'], location['coord_y'], extract_rainfall)
+
     @staticmethod
     def validate_location(location_yaml, forecast, system_config):
-        weather_db_connection = system_config.database['weather_db']
+        weather_db_pool = system_config.database['weather_db']
         name = location_yaml['name']
 
         if 'weather_station' not in location_yaml or len(str(location_yaml['weather_station'])) == 0:
@@ -85,10 +125,11 @@ class DatabaseWeatherSeries(WeatherSeriesMaker):
             LIMIT 1
             """
 
-            cursor = weather_db_connection.cursor()
-            cursor.execute(nearest_station_query, (coord_x, coord_y))
+            with weather_db_pool.connection() as weather_db_connection:
+                cursor = weather_db_connection.cursor()
+                cursor.execute(nearest_station_query, (coord_x, coord_y))
 
-            result = cursor.fetchone()
+                result = cursor.fetchone()
             logging.debug('Found station "%s" at %s kilometers from (%s, %s) for location "%s".' % (
                 result[2], result[0], coord_y, coord_x, name
             ))
@@ -103,10 +144,11 @@ class DatabaseWeatherSeries(WeatherSeriesMaker):
             SELECT e.nombre, e.lat_dec, e.lon_dec FROM estacion e WHERE e.omm_id = %s
             """
 
-            cursor = weather_db_connection.cursor()
-            cursor.execute(find_station, (location_yaml['weather_station'], ))
+            with weather_db_pool.connection() as weather_db_connection:
+                cursor = weather_db_connection.cursor()
+                cursor.execute(find_station, (location_yaml['weather_station'], ))
 
-            result = cursor.fetchone()
+                result = cursor.fetchone()
             if not result:
                 raise RuntimeError('No weather station found with id = %s for location "%s".' %
                                    (location_yaml['weather_station'], name))
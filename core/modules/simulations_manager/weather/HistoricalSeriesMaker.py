@@ -33,15 +33,15 @@ class HistoricalSeriesMaker(DatabaseWeatherSeries):
     def create_from_db(self, location, forecast):
         omm_id = location['weather_station']
 
-        wth_db_connection = self.system_config.database['weather_db']
-        cursor = wth_db_connection.cursor()
-
-        cursor.execute('SELECT pr_campañas_completas(%s, %s)', (omm_id, self.campaign_first_month))
-        full_campaigns = cursor.fetchall()
-
-        for campaign in full_campaigns:
-            campaign_year = campaign[0]
-            cursor.execute("SELECT * FROM pr_serie_agraria(%s, %s, %s)",
-                           (omm_id, campaign_year, self.campaign_first_month))
-            colnames = [tuple([desc[0] for desc in cursor.description])]
-            yield (campaign_year, itertools.chain(colnames, cursor))
+        with self.system_config.database['weather_db'].connection() as wth_db_connection:
+            cursor = wth_db_connection.cursor()
+
+            cursor.execute('SELECT pr_campañas_completas(%s, %s)', (omm_id, self.campaign_first_month))
+            full_campaigns = cursor.fetchall()
+
+            for campaign in full_campaigns:
+                campaign_year = campaign[0]
+                cursor.execute("SELECT * FROM pr_serie_agraria(%s, %s, %s)",
+                               (omm_id, campaign_year, self.campaign_first_month))
+                colnames = [tuple([desc[0] for desc in cursor.description])]
+                yield (campaign_year, itertools.chain(colnames, cursor))
@@ -1,19 +1,16 @@
-import itertools
 from core.lib.dssat.DSSATWthWriter import DSSATWthWriter
 
 __author__ = 'Federico Schmidt'
 
 import threading
 import os.path
-# Do not remove this import, prevents a bug in strptime when using it in parallel.
-import _strptime
-from datetime import datetime, timedelta
-from netCDF4 import Dataset
+from core.modules.simulations_manager.weather.NetCDFSourceCache import NetCDFSourceCache
 from core.modules.simulations_manager.weather.WeatherSeriesMaker import WeatherSeriesMaker
 from core.lib.io.file import create_folder_with_permissions
 import numpy as np
 
 class NetCDFSeriesMaker(WeatherSeriesMaker):
+    climate_variables = ['tx', 'tn', 'prcp', 'srad']
 
     def __init__(self, system_config, max_parallelism, weather_writer=None):
         super(NetCDFSeriesMaker, self).__init__(system_config, max_parallelism)
@@ -22,6 +19,9 @@ class NetCDFSeriesMaker(WeatherSeriesMaker):
         self.max_paralellism = max_parallelism
         self.weather_writer = weather_writer
         self.concurrency_lock = threading.BoundedSemaphore(self.max_paralellism)
+        self.source_lock = threading.Lock()
+        self.source = None
+        self.series = None
 
     def create_series(self, location, forecast, extract_rainfall=True):
         with self.concurrency_lock:
@@ -41,7 +41,8 @@ class NetCDFSeriesMaker(WeatherSeriesMaker):
             if not os.path.exists(grid_column_folder):
                 create_folder_with_permissions(grid_column_folder)
 
-            nc = Dataset(forecast.configuration.netcdf_source, mode='r')
+            source = self.get_source(forecast)
+            nc = source.dataset
 
             varnames = {
                 'x': forecast.configuration.netcdf_variables.get('coord_x', 'x'),
@@ -57,43 +58,36 @@ class NetCDFSeriesMaker(WeatherSeriesMaker):
             if 'scenario' in forecast.configuration.netcdf_variables:
                 varnames['scen'] = forecast.configuration.netcdf_variables['scenario']
 
-            x_proj = nc.variables[varnames['x']][:].tolist()
-            y_proj = nc.variables[varnames['y']][:].tolist()
-
-            ref_date = datetime.strptime(nc.variables[varnames['time']].units, 'Days since %Y-%m-%d')
-
-            fecha = [ref_date + timedelta(days=d.item()) for d in nc.variables[varnames['time']]]
+            fecha = self.weather_writer.to_datetime64(source.dates(varnames['time']))
 
             scenarios = [0]
             # Creating a scenario dimension in the NetCDF is optional.
             if varnames['scen'] and len(varnames['scen']) > 0:
-                scenarios = nc.variables[varnames['scen']][:].tolist()
+                with source.read_lock:
+                    scenarios = nc.variables[varnames['scen']][:].tolist()
             else:
                 # If it's an empty variable name, coerce it to None.
                 varnames['scen'] = None
 
-            x_idx = x_proj.index(float(location['netcdf_x']))
-            y_idx = y_proj.index(float(location['netcdf_y']))
+            x_idx = source.find_index(varnames['x'], location['netcdf_x'])
+            y_idx = source.find_index(varnames['y'], location['netcdf_y'])
 
             rainfall_dict = dict()
             scen_names = []
 
+            cell_series = self.get_cell_series(forecast, source, varnames, (x_idx, y_idx))
+
             for scen_index, scenario in enumerate(scenarios):
                 clim = {}
 
-                for climate_variable in ['tx', 'tn', 'prcp', 'srad']:
-                    access_t = self.get_access_tuple(nc.variables[varnames[climate_variable]].dimensions,
-                                                     varnames, x_idx, y_idx, scen_index)
-                    clim[climate_variable] = nc.variables[varnames[climate_variable]][access_t]
-
-                clim['srad'] = np.maximum(clim['srad'], 1).tolist()
+                for climate_variable in self.climate_variables:
+                    clim[climate_variable] = cell_series[climate_variable][scen_index]
 
-                rows = zip(fecha, clim['tx'], clim['tn'], clim['prcp'], clim['srad'])
-                colnames = [tuple(['fecha', 'tmax', 'tmin', 'prcp', 'rad'])]
-                scen_weather = itertools.chain(colnames, rows)
+                scen_weather = self.weather_writer.create_series(fecha=fecha, rad=np.maximum(clim['srad'], 1),
+                                                                 tmax=clim['tx'], tmin=clim['tn'], prcp=clim['prcp'])
 
-                variables_dict = self.weather_writer.write_wth_file(scen_index, scen_weather, grid_column_folder,
-                                                                    location)
+                variables_dict = self.weather_writer.write_wth_array(scen_index, scen_weather, grid_column_folder,
+                                                                     location)
                 if extract_rainfall:
                     self.weather_writer.extract_rainfall(rainfall_dict, variables_dict, forecast.forecast_date,
                                                          scen_index)
@@ -106,6 +100,52 @@ class NetCDFSeriesMaker(WeatherSeriesMaker):
             forecast.weather_stations[zone_id]['num_scenarios'] = len(scen_names)
             forecast.weather_stations[zone_id]['scen_names'] = scen_names
 
+    def get_source(self, forecast):
+        """
+        Returns the shared NetCDF source for this forecast, opening it the first time it's requested.
+        """
+        with self.source_lock:
+            if self.source is None:
+                self.source = NetCDFSourceCache.acquire(forecast.configuration.netcdf_source)
+            return self.source
+
+    def get_cell_series(self, forecast, source, varnames, cell):
+        """
+        Returns the climate series of a grid cell as a dictionary of (scenarios, time) arrays.
+
+        The first call reads the series of every location in the forecast at once, so each variable in the source file
+        is traversed once per forecast instead of once per location and scenario.
+        """
+        with self.source_lock:
+            if self.series is None:
+                self.series = dict([(v, dict()) for v in self.climate_variables])
+                cells = {cell}
+
+                for location in forecast.get('locations', {}).values():
+                    try:
+                        cells.add((source.find_index(varnames['x'], location['netcdf_x']),
+                                   source.find_index(varnames['y'], location['netcdf_y'])))
+                    except (RuntimeError, KeyError):
+                        # Invalid locations will fail in their own thread.
+                        continue
+            elif cell not in self.series['tx']:
+                cells = {cell}
+            else:
+                cells = set()
+
+            for climate_variable in self.climate_variables:
+                self.series[climate_variable].update(source.read_series(varnames[climate_variable], varnames['x'],
+                                                                        varnames['y'], cells, varnames['scen']))
+
+            return dict([(v, self.series[v][cell]) for v in self.climate_variables])
+
+    def release_resources(self):
+        with self.source_lock:
+            self.series = None
+            if self.source is not None:
+                NetCDFSourceCache.release(self.source)
+                self.source = None
+
     @staticmethod
     def get_access_tuple(var_dimensions, varnames, x_idx, y_idx, scen_number):
         time_var_idx = var_dimensions.index(varnames['time'])
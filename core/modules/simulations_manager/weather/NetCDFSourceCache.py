@@ -0,0 +1,226 @@
+import os
+import threading
+import logging
+# Do not remove this import, prevents a bug in strptime when using it in parallel.
+import _strptime
+from datetime import datetime, timedelta
+from netCDF4 import Dataset
+import numpy as np
+
+__author__ = 'Federico Schmidt'
+
+
+class NetCDFSource(object):
+    """
+    An open, read-only NetCDF weather source shared by every thread that creates series from the same file.
+
+    Coordinate lookups and the dates vector are computed once and cached, reads to the underlying dataset are
+    serialized through the read_lock since the NetCDF/HDF5 library isn't thread safe.
+    """
+    # Variables smaller than this amount of bytes are read in full with a single call.
+    full_read_max_bytes = 64 * 1024 * 1024
+
+    def __init__(self, path, mtime):
+        self.path = path
+        self.mtime = mtime
+        self.dataset = Dataset(path, mode='r')
+        self.read_lock = threading.RLock()
+        self.ref_count = 0
+        self._coord_indexes = {}
+        self._dates = {}
+
+    def coord_index(self, var_name):
+        """
+        Returns a dictionary that maps each coordinate value of a dimension variable to its index.
+        :param var_name: The coordinate variable name (eg. x or y).
+        :rtype : dict
+        """
+        with self.read_lock:
+            if var_name not in self._coord_indexes:
+                values = self.dataset.variables[var_name][:].tolist()
+                index = dict()
+                for idx, value in enumerate(values):
+                    # Keep the first occurrence, mimics list.index() behaviour.
+                    if value not in index:
+                        index[value] = idx
+                self._coord_indexes[var_name] = index
+            return self._coord_indexes[var_name]
+
+    def find_index(self, var_name, value):
+        index = self.coord_index(var_name)
+        try:
+            return index[float(value)]
+        except KeyError:
+            raise RuntimeError('Coordinate %s not found in variable "%s" of NetCDF file "%s".' %
+                               (value, var_name, self.path))
+
+    def dates(self, time_var_name):
+        """
+        Returns the time variable of the file converted to a tuple of datetime objects.
+        :param time_var_name: The name of the time variable.
+        :rtype : tuple
+        """
+        with self.read_lock:
+            if time_var_name not in self._dates:
+                time_var = self.dataset.variables[time_var_name]
+                ref_date = datetime.strptime(time_var.units, 'Days since %Y-%m-%d')
+                self._dates[time_var_name] = tuple([ref_date + timedelta(days=d) for d in time_var[:].tolist()])
+            return self._dates[time_var_name]
+
+    def read_series(self, var_name, x_var_name, y_var_name, cells, scen_var_name=None):
+        """
+        Reads the series of a variable for a group of grid cells, touching each block of the file only once.
+
+        Small variables are read in full with one call. Bigger ones are read by chunk-aligned blocks along the x and y
+        dimensions (or by the bounding box of the requested cells if the variable isn't chunked), so compressed chunks
+        are decompressed once instead of once per cell and scenario.
+
+        :param var_name: The variable to read (eg. tx).
+        :param x_var_name: Name of the x dimension.
+        :param y_var_name: Name of the y dimension.
+        :param cells: An iterable of (x_idx, y_idx) tuples.
+        :param scen_var_name: Name of the scenario dimension, None if the variable doesn't have one.
+        :returns A dictionary that maps each (x_idx, y_idx) tuple to an array with shape (scenarios, time).
+        """
+        cells = set(cells)
+        series = dict()
+
+        if len(cells) == 0:
+            return series
+
+        with self.read_lock:
+            variable = self.dataset.variables[var_name]
+            dimensions = list(variable.dimensions)
+            x_axis = dimensions.index(x_var_name)
+            y_axis = dimensions.index(y_var_name)
+
+            # Axes left once the x and y dimensions are removed, we want the scenarios first and time last.
+            cell_dimensions = [d for d in dimensions if d not in (x_var_name, y_var_name)]
+            cell_axes_order = None
+            if scen_var_name is not None:
+                scen_axis = cell_dimensions.index(scen_var_name)
+                cell_axes_order = [scen_axis] + [a for a in range(0, len(cell_dimensions)) if a != scen_axis]
+
+            var_bytes = variable.dtype.itemsize * int(np.prod(variable.shape))
+            chunking = variable.chunking()
+
+            if var_bytes <= self.full_read_max_bytes:
+                blocks = {None: cells}
+            elif chunking == 'contiguous':
+                # There are no chunks to align to, read the bounding box of the requested cells.
+                blocks = {'bbox': cells}
+            else:
+                blocks = dict()
+                for x_idx, y_idx in cells:
+                    block_key = (x_idx // chunking[x_axis], y_idx // chunking[y_axis])
+                    blocks.setdefault(block_key, set()).add((x_idx, y_idx))
+
+            for block_key, block_cells in blocks.iteritems():
+                slices = [slice(None)] * len(dimensions)
+                x_start, y_start = 0, 0
+
+                if block_key == 'bbox':
+                    x_start = min([c[0] for c in block_cells])
+                    y_start = min([c[1] for c in block_cells])
+                    slices[x_axis] = slice(x_start, max([c[0] for c in block_cells]) + 1)
+                    slices[y_axis] = slice(y_start, max([c[1] for c in block_cells]) + 1)
+                elif block_key is not None:
+                    x_start = block_key[0] * chunking[x_axis]
+                    y_start = block_key[1] * chunking[y_axis]
+                    slices[x_axis] = slice(x_start, x_start + chunking[x_axis])
+                    slices[y_axis] = slice(y_start, y_start + chunking[y_axis])
+
+                block = variable[tuple(slices)]
+
+                for x_idx, y_idx in block_cells:
+                    cell_access = [slice(None)] * len(dimensions)
+                    cell_access[x_axis] = x_idx - x_start
+                    cell_access[y_axis] = y_idx - y_start
+                    cell_series = block[tuple(cell_access)]
+
+                    if cell_axes_order is not None:
+                        cell_series = cell_series.transpose(cell_axes_order)
+                    else:
+                        # Add a scenario axis so every cell has the same shape.
+                        cell_series = cell_series.reshape((1,) + cell_series.shape)
+
+                    series[(x_idx, y_idx)] = cell_series
+
+        return series
+
+    def close(self):
+        with self.read_lock:
+            if self.dataset is not None:
+                self.dataset.close()
+                self.dataset = None
+
+
+class NetCDFSourceCache(object):
+    """
+    Process-wide cache of open NetCDF weather sources, keyed by file path and modification time.
+
+    Each consumer must call release once for every acquire, the file is closed once nobody is using it. A source whose
+    file was modified after it was opened is evicted and reopened on the next acquire.
+    """
+    _lock = threading.Lock()
+    _sources = {}
+
+    def __init__(self):
+        pass
+
+    @staticmethod
+    def acquire(path):
+        path = os.path.abspath(path)
+        mtime = os.path.getmtime(path)
+
+        with NetCDFSourceCache._lock:
+            source = NetCDFSourceCache._sources.get(path)
+
+            if source is not None and source.mtime != mtime:
+                # The file changed since we opened it, stop serving the stale version. It'll be closed when the
+                # last consumer releases it.
+                del NetCDFSourceCache._sources[path]
+                if source.ref_count == 0:
+                    source.close()
+                source = None
+
+            if source is None:
+                logging.getLogger().debug('Opening NetCDF weather source "%s".' % path)
+                source = NetCDFSource(path, mtime)
+                NetCDFSourceCache._sources[path] = source
+
+            source.ref_count += 1
+            return source
+
+    @staticmethod
+    def release(source):
+        with NetCDFSourceCache._lock:
+            source.ref_count -= 1
+
+            if source.ref_count > 0:
+                return
+
+            if NetCDFSourceCache._sources.get(source.path) is source:
+                del NetCDFSourceCache._sources[source.path]
+            source.close()
+
+    @staticmethod
+    def clear():
+        """
+        Closes every open source, regardless of it being used or not.
+        """
+        with NetCDFSourceCache._lock:
+            for source in NetCDFSourceCache._sources.values():
+                source.close()
+            NetCDFSourceCache._sources.clear()
+
+    @staticmethod
+    def detach():
+        """
+        Forgets every open source without closing it, used by forked processes that can't share the parent's files.
+        :returns The detached sources.
+        """
+        with NetCDFSourceCache._lock:
+            sources = NetCDFSourceCache._sources
+            NetCDFSourceCache._sources = {}
+            return sources
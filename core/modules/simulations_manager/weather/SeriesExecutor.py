@@ -0,0 +1,217 @@
+import os
+import abc
+import time
+import logging
+import threading
+import multiprocessing
+from core.lib.jobs.monitor import NullMonitor
+from core.lib.metrics import registry
+from core.lib.utils.database import DatabaseUtils
+from core.lib.utils.log import log_format_exception
+from core.modules.simulations_manager.weather.NetCDFSourceCache import NetCDFSourceCache
+from core.modules.simulations_manager.weather.WeatherSeriesCache import WeatherSeriesCache
+from core.modules.statistics.metrics import rundir_bytes
+
+__author__ = 'Federico Schmidt'
+
+series_duration = registry.histogram('prinde_weather_series_seconds',
+                                     'Time taken to create the weather series of a station, by series maker.',
+                                     ['maker'], buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 300))
+weather_files = registry.counter('prinde_weather_files_total',
+                                 'Weather files created in forecasts run directories (written or linked from the '
+                                 'weather cache), by series maker.', ['maker'])
+
+
+class SeriesExecutor(object):
+    """
+    Runs a weather series maker for every weather station of a forecast.
+
+    The executor is selected with the "weather_executor" key of a forecast configuration: "thread" (the default) runs
+    every station in a thread of this process and "process" runs them in a pool of worker processes, allowing
+    CPU bound series makers to use more than one core.
+    """
+    __metaclass__ = abc.ABCMeta
+
+    def __init__(self, system_config, forecast):
+        self.system_config = system_config
+        self.forecast = forecast
+        # Weather station id -> (start time, seconds taken to create its series).
+        self.stations_times = {}
+
+    @abc.abstractmethod
+    def run(self, series_maker, locations, progress_monitor=None):
+        """
+        Creates the weather series of a forecast.
+        :param series_maker: The weather series maker instance of the forecast.
+        :param locations: A dictionary with a location for each weather station (the key).
+        :param progress_monitor: A monitor to report the number of stations processed.
+        Raises a RuntimeError (with the original error) if the series of any station couldn't be created.
+        """
+        pass
+
+    def station_finished(self, series_maker, omm_id, station_times):
+        """
+        Records the time taken to create the series of a station and the files it created, in this process (series
+        makers may run in worker processes).
+        :param station_times: A tuple with the start time and the seconds taken to create the series.
+        """
+        self.stations_times[omm_id] = station_times
+
+        maker_name = type(series_maker).__name__
+        series_duration.observe(station_times[1], labels={'maker': maker_name})
+
+        station = self.forecast.weather_stations.get(omm_id, {})
+        if 'weather_path' not in station or 'num_scenarios' not in station:
+            return
+
+        written_bytes = 0
+        for scen_idx in range(station['num_scenarios']):
+            wth_file = os.path.join(station['weather_path'], 'WTH%05d.WTH' % scen_idx)
+            if os.path.exists(wth_file):
+                written_bytes += os.path.getsize(wth_file)
+
+        weather_files.inc(station['num_scenarios'], labels={'maker': maker_name})
+        rundir_bytes.inc(written_bytes, labels={'kind': 'weather'})
+
+    @staticmethod
+    def get_executor(system_config, forecast):
+        executor_name = forecast.configuration.get('weather_executor', 'thread')
+
+        if executor_name not in SeriesExecutor.executors:
+            raise RuntimeError('Unsupported weather executor "%s" in forecast "%s".' % (executor_name, forecast.name))
+
+        return SeriesExecutor.executors[executor_name](system_config, forecast)
+
+
+class ThreadSeriesExecutor(SeriesExecutor):
+
+    def run(self, series_maker, locations, progress_monitor=None):
+        if not progress_monitor:
+            progress_monitor = NullMonitor()
+
+        # Errors raised by the threads, as (weather station id, formatted exception) tuples.
+        self.errors = []
+        active_threads = []
+        for omm_id, location in locations.iteritems():
+            active_threads.append(threading.Thread(target=self.create_series,
+                                                   name='create_series for omm_id = %s' % omm_id,
+                                                   args=(series_maker, omm_id, location)))
+
+        # Start all weather maker threads.
+        for t in active_threads:
+            t.start()
+
+        # Wait for the weather grid to be populated.
+        for joined_threads_count, t in enumerate(active_threads, start=1):
+            t.join()
+            progress_monitor.update_progress(joined_threads_count)
+
+        if len(self.errors) > 0:
+            omm_id, error = self.errors[0]
+            raise RuntimeError('Failed to create weather series for station %s. Reason: %s' % (omm_id, error))
+
+    def create_series(self, series_maker, omm_id, location):
+        start_time = time.time()
+        try:
+            series_maker.create_series(location, self.forecast)
+        except Exception:
+            self.errors.append((omm_id, log_format_exception()))
+            return
+        self.station_finished(series_maker, omm_id, (start_time, time.time() - start_time))
+
+
+class ProcessSeriesExecutor(SeriesExecutor):
+    """
+    Creates the weather series in a pool of forked worker processes. Each worker creates its own series maker and
+    database connections, the results (station info, scenario names and rainfall) are sent back and merged into the
+    forecast by this process. Errors of the workers are raised by run, with their traceback.
+
+    The pool is created by the thread running the forecast, so in the system process workers are forked while other
+    threads (the scheduler, the web server, other forecasts) are alive. A worker inherits every lock in the state it
+    had at fork time: a lock held by another thread (eg. a logging handler lock) is never released in the worker,
+    which deadlocks if it tries to acquire it. Workers also inherit the parent's database connections and NetCDF
+    files, _init_worker keeps them open (closing them would close them in the parent too) and creates new ones; the
+    MongoDB client is inherited as well and must not be used by the series makers.
+    This executor is therefore unsafe under the web server, it's only used if a forecast opts in and a warning is
+    logged each time it forks while other threads are running.
+    """
+
+    def run(self, series_maker, locations, progress_monitor=None):
+        if not progress_monitor:
+            progress_monitor = NullMonitor()
+
+        if threading.active_count() > 1:
+            logging.getLogger().warning('Forking weather series workers for forecast "%s" while %d other threads are '
+                                        'running, workers may deadlock on locks held by those threads. Use the '
+                                        '"thread" weather executor if this happens.' %
+                                        (self.forecast.name, threading.active_count() - 1))
+
+        pool = multiprocessing.Pool(processes=self.forecast.configuration.max_parallelism,
+                                    initializer=_init_worker, initargs=(self.system_config, self.forecast))
+        try:
+            for processed_count, result in enumerate(pool.imap_unordered(_create_series, locations.values()),
+                                                     start=1):
+                self.merge_result(series_maker, result, locations)
+                progress_monitor.update_progress(processed_count)
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def merge_result(self, series_maker, result, locations):
+        omm_id, station_info, rainfall, reference_year, station_times = result
+
+        # Keep the same objects the thread executor leaves in the forecast: the station info is the location.
+        location = locations[omm_id]
+        location.update(station_info)
+        self.forecast.weather_stations[omm_id] = location
+
+        if rainfall is not None:
+            self.forecast.rainfall[str(omm_id)] = rainfall
+        if reference_year is not None:
+            self.forecast.configuration.reference_year = reference_year
+
+        self.station_finished(series_maker, omm_id, station_times)
+
+
+SeriesExecutor.executors = {
+    'thread': ThreadSeriesExecutor,
+    'process': ProcessSeriesExecutor
+}
+
+# State of a worker process, set by _init_worker.
+_worker_state = {}
+
+
+def _init_worker(system_config, forecast):
+    # Resources inherited from the parent process can't be shared with it (nor closed, that would close them in the
+    # parent too), keep a reference to them so they're never collected and create new ones.
+    _worker_state['inherited'] = (system_config.get('database', {}).get('weather_db'), NetCDFSourceCache.detach())
+
+    if 'weather_db' in system_config.get('database_config', {}):
+        system_config.database['weather_db'] = DatabaseUtils.postgresql_pool(
+            system_config.database_config['weather_db'], system_config.config_path)
+
+    if system_config.get('weather_cache', None):
+        system_config['weather_cache'] = WeatherSeriesCache(system_config.weather_cache.cache_path,
+                                                            system_config.weather_cache.max_entries)
+
+    _worker_state['forecast'] = forecast
+    _worker_state['series_maker'] = forecast.configuration.weather_maker_class(system_config,
+                                                                               forecast.configuration.max_parallelism)
+
+
+def _create_series(location):
+    forecast = _worker_state['forecast']
+    omm_id = location['weather_station']
+    start_time = time.time()
+
+    try:
+        _worker_state['series_maker'].create_series(location, forecast)
+    except Exception:
+        # The original exception may not be picklable, send its traceback to the parent process.
+        raise RuntimeError('Failed to create weather series for station %s. Reason: %s' %
+                           (omm_id, log_format_exception()))
+
+    return omm_id, forecast.weather_stations[omm_id], forecast.rainfall.get(str(omm_id)), \
+        forecast.configuration.get('reference_year', None), (start_time, time.time() - start_time)
@@ -0,0 +1,155 @@
+import os
+import json
+import uuid
+import shutil
+import logging
+import threading
+from xxhash import xxh64
+
+__author__ = 'Federico Schmidt'
+
+
+class WeatherSeriesCache(object):
+    """
+    On-disk cache of finished weather series, shared between forecasts.
+
+    Each entry is a folder with the scenario files of a weather station plus a metadata file with the scenario names
+    and the extracted rainfall. Entries are grouped by weather station (<cache_path>/<omm_id>/<key>) so all the series
+    of a station can be invalidated at once when new data is ingested for it.
+
+    Entries are written to a temporal folder and renamed when complete, readers never see half written entries. On a
+    hit the files are hardlinked into the destination folder (copied if the filesystem doesn't support hardlinks), so
+    invalidating an entry doesn't affect the rundirs that are using it.
+
+    Only the max_entries newest entries of each station are kept, older ones are dropped when a new one is stored.
+    """
+    metadata_file_name = 'series.json'
+
+    def __init__(self, cache_path, max_entries=20):
+        """
+        :param max_entries: Max number of cached series of each weather station.
+        """
+        if max_entries < 1:
+            raise RuntimeError('Invalid number of cached weather series per station (%s).' % max_entries)
+
+        self.cache_path = os.path.abspath(cache_path)
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+
+        if not os.path.exists(self.cache_path):
+            os.makedirs(self.cache_path)
+
+    @staticmethod
+    def key(*args):
+        """
+        Creates a cache key from the values that identify a weather series (eg. series maker, station, forecast date).
+        """
+        return xxh64(','.join(['%s' % a for a in args])).hexdigest()
+
+    def entry_path(self, omm_id, key):
+        return os.path.join(self.cache_path, str(omm_id), key)
+
+    def get(self, omm_id, key, output_folder):
+        """
+        Links the cached scenario files into output_folder.
+        :returns The cached metadata (a dict with the scen_names and rainfall keys) or None if there's no entry.
+        """
+        entry_path = self.entry_path(omm_id, key)
+        metadata_path = os.path.join(entry_path, self.metadata_file_name)
+
+        linked_files = []
+        try:
+            with open(metadata_path) as f:
+                metadata = json.load(f)
+
+            for file_name in metadata['files']:
+                dst = os.path.join(output_folder, file_name)
+                if os.path.exists(dst):
+                    raise RuntimeError('Attempted to write a weather file that was already created (%s).\n'
+                                       'Increase the weather grid resolution to avoid collisions.' % dst)
+                WeatherSeriesCache.link(os.path.join(entry_path, file_name), dst)
+                linked_files.append(dst)
+        except (IOError, OSError, ValueError, KeyError):
+            # Missing or invalidated entry, remove anything we linked so the caller can create the series.
+            for dst in linked_files:
+                os.remove(dst)
+            return None
+
+        return metadata
+
+    def put(self, omm_id, key, source_folder, file_names, scen_names, rainfall):
+        """
+        Stores the scenario files (found in source_folder) of a weather station.
+        """
+        station_path = os.path.join(self.cache_path, str(omm_id))
+        entry_path = self.entry_path(omm_id, key)
+
+        if os.path.exists(entry_path):
+            return
+
+        tmp_path = os.path.join(self.cache_path, '.%s.%s.tmp' % (key, uuid.uuid4().hex))
+        try:
+            os.makedirs(tmp_path)
+            for file_name in file_names:
+                WeatherSeriesCache.link(os.path.join(source_folder, file_name), os.path.join(tmp_path, file_name))
+
+            with open(os.path.join(tmp_path, self.metadata_file_name), 'w') as f:
+                json.dump({'files': file_names, 'scen_names': scen_names, 'rainfall': rainfall}, f)
+
+            with self.lock:
+                if not os.path.exists(station_path):
+                    os.makedirs(station_path)
+                os.rename(tmp_path, entry_path)
+                # The entry age is the time it was stored.
+                os.utime(entry_path, None)
+                removed_paths = self.__prune__(omm_id, station_path)
+
+            for removed_path in removed_paths:
+                shutil.rmtree(removed_path, ignore_errors=True)
+        except (IOError, OSError), ex:
+            # Another thread stored the same entry or the cache folder isn't writable, the series was already
+            # created so there's nothing else to do.
+            logging.getLogger().debug('Weather series not cached (station: %s). Reason: %s.' % (omm_id, ex))
+        finally:
+            if os.path.exists(tmp_path):
+                shutil.rmtree(tmp_path, ignore_errors=True)
+
+    def __prune__(self, omm_id, station_path):
+        """
+        Moves away the oldest entries of a station, beyond max_entries. Must be called holding the lock.
+        :returns The paths the entries were moved to, to be deleted by the caller after releasing the lock.
+        """
+        entries = [os.path.join(station_path, e) for e in os.listdir(station_path)]
+        entries.sort(key=lambda e: os.path.getmtime(e), reverse=True)
+
+        removed_paths = []
+        for entry_path in entries[self.max_entries:]:
+            removed_path = os.path.join(self.cache_path, '.%s.%s.removed' % (omm_id, uuid.uuid4().hex))
+            os.rename(entry_path, removed_path)
+            removed_paths.append(removed_path)
+        return removed_paths
+
+    def invalidate(self, omm_ids):
+        """
+        Drops every cached series of the given weather stations.
+        """
+        for omm_id in omm_ids:
+            station_path = os.path.join(self.cache_path, str(omm_id))
+
+            with self.lock:
+                if not os.path.exists(station_path):
+                    continue
+                # Move the folder away before deleting it so no reader finds a partially deleted entry.
+                removed_path = os.path.join(self.cache_path, '.%s.%s.removed' % (omm_id, uuid.uuid4().hex))
+                os.rename(station_path, removed_path)
+
+            shutil.rmtree(removed_path, ignore_errors=True)
+
+        logging.getLogger().debug('Invalidated cached weather series for station(s): %s.' % list(omm_ids))
+
+    @staticmethod
+    def link(src, dst):
+        try:
+            os.link(src, dst)
+        except OSError:
+            shutil.copy2(src, dst)
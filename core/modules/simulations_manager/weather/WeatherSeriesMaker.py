@@ -14,6 +14,13 @@ class WeatherSeriesMaker:
     def create_series(self, location, forecast, extract_rainfall=False):
         pass
 
+    def release_resources(self):
+        """
+        Called once the forecast that created this series maker doesn't need it anymore. Series makers that keep
+        open files or connections should free them here.
+        """
+        pass
+
     @staticmethod
     def validate_location(location_yaml, forecast, system_config):
         """
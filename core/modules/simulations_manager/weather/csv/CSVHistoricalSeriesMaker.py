@@ -20,10 +20,10 @@ class CSVHistoricalSeriesMaker(CSVDatabaseWeatherSeries):
 
         forecast_date = forecast.forecast_date
 
-        wth_db_connection = self.system_config.database['weather_db']
-        cursor = wth_db_connection.cursor()
+        with self.system_config.database['weather_db'].connection() as wth_db_connection:
+            cursor = wth_db_connection.cursor()
 
-        # start_time = time.time()
-        cursor.execute("SELECT pr_historic_series(%s, %s)", (omm_id, wth_output))
+            # start_time = time.time()
+            cursor.execute("SELECT pr_historic_series(%s, %s)", (omm_id, wth_output))
         # logging.getLogger().debug("Export historic series for station: %s. Forecast Date: %s. Time: %s." %
         #                           (omm_id, forecast_date, (time.time() - start_time)))
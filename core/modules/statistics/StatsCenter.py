@@ -3,9 +3,13 @@ from datetime import datetime
 import logging
 from apscheduler.events import *
 from core.lib.jobs.monitor import ProgressObserver, JOB_ENDED, JOB_STATUS_FINISHED, SUBJOB_ENDED
+from core.lib.metrics import registry
 
 __author__ = 'federico'
 
+running_jobs = registry.gauge('prinde_running_jobs', 'Jobs (and subjobs) that are running or waiting.')
+lock_queue_depth = registry.gauge('prinde_lock_queue_depth', 'Requests waiting for a lock.', ['lock'])
+
 
 def job_evt_decorator(self):
     """
@@ -48,6 +52,9 @@ class StatsCenter(ProgressObserver):
         self.running_tasks = {}
         self.finished_tasks = {}
         self.event_listeners = []
+        # Name -> lock whose metrics are reported (see PrioritizedRWLock.metrics_view).
+        self.locks = {}
+        running_jobs.set_function(lambda: len(self.running_tasks))
 
         if self.scheduler.running:
             self.init_jobs()
@@ -128,6 +135,13 @@ class StatsCenter(ProgressObserver):
             'end_time': now.strftime('%Y-%m-%d %H:%M:%S')
         }
 
+    def add_lock(self, name, lock):
+        self.locks[name] = lock
+        lock_queue_depth.set_function(lock.queue_depth, labels={'lock': name})
+
+    def locks_metrics(self, max_records=100):
+        return dict([(name, lock.metrics_view(max_records=max_records)) for name, lock in self.locks.iteritems()])
+
     def progress_changed(self, event):
         job_id = event.job['id']
         parent_id = event.job['parent']
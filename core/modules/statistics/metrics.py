@@ -0,0 +1,14 @@
+from core.lib.metrics import registry
+
+__author__ = 'Federico Schmidt'
+
+# Metrics fed by more than one module (see core.lib.metrics), served at /metrics.
+
+completed_simulations = registry.counter('prinde_simulations_completed_total', 'Simulations ran by each engine.',
+                                         ['engine'])
+
+engine_runs = registry.histogram('prinde_simulation_engine_run_seconds', 'Duration of the runs of each engine.',
+                                 ['engine', 'status'], buckets=(10, 30, 60, 300, 600, 1800, 3600, 7200, 14400))
+
+rundir_bytes = registry.counter('prinde_rundir_bytes_written_total',
+                                'Bytes of the files created in forecasts run directories.', ['kind'])
@@ -1,7 +1,4 @@
 #!/usr/bin/env bash
 
-cd "%s" # pSIMS path.
-rm -rf "./campaigns/run/*"
-rm -rf "./campaigns/run"
-cp -rf "%s" "./campaigns/run" # Rundir path.
-./psims -s local -p "./campaigns/run/params" -c "./campaigns/run" -g "./campaigns/run/gridList.txt"
\ No newline at end of file
+cd "$1" # pSIMS working directory (a slot of the pSIMS pool).
+./psims -s local -p "%s/params" -c "%s" -g "%s/gridList.txt" # Rundir path.
\ No newline at end of file
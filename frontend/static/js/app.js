@@ -13,6 +13,7 @@ var prindeApp = angular.module('prinde', [
     'jobsModule',
     'sysConfigModule',
     'forecastsModule',
+    'forecastRunsModule',
     'weatherModule',
     'modalsControllers'
 ]);
@@ -62,6 +63,10 @@ prindeApp.config(['$routeProvider', '$locationProvider', function ($routeProvide
             templateUrl: 'static/partials/forecasts.html',
             controller: 'forecastsController'
         }).
+        when('/forecast_runs', {
+            templateUrl: 'static/partials/forecast_runs.html',
+            controller: 'forecastRunsController'
+        }).
         when('/weather', {
             templateUrl: 'static/partials/weather.html',
             controller: 'weatherController'
@@ -0,0 +1,47 @@
+var forecastRuns = angular.module('forecastRunsModule', []);
+
+forecastRuns.controller('forecastRunsController', function ($scope, $http, $location) {
+    $scope.file_name = $location.search().file;
+    $scope.forecast_name = $location.search().name;
+    $scope.runs = [];
+
+    var status_css = {
+        finished: 'label-success',
+        error: 'label-danger',
+        rescheduled: 'label-warning'
+    };
+
+    // Flattens the stages tree into one row of bars per depth level, each bar positioned relative to the run's total
+    // time (a flame graph).
+    var flameRows = function (stages, total_time, depth, rows) {
+        if (stages.length === 0)
+            return rows;
+        if (rows.length <= depth)
+            rows.push([]);
+
+        angular.forEach(stages, function (stage) {
+            var duration = (stage.duration === null) ? 0 : stage.duration;
+            rows[depth].push({
+                name: stage.name,
+                duration: duration,
+                count: stage.count,
+                style: {
+                    left: (100 * stage.start / total_time) + '%',
+                    width: Math.max(100 * duration / total_time, 0.2) + '%'
+                }
+            });
+            flameRows(stage.stages, total_time, depth + 1, rows);
+        });
+        return rows;
+    };
+
+    $http.get('/api/forecasts/runs', {
+        params: { file: $scope.file_name, name: $scope.forecast_name }
+    }).success(function (runs) {
+        angular.forEach(runs, function (run) {
+            run.status_css = status_css[run.status] || 'label-default';
+            run.rows = flameRows(run.profile.stages, Math.max(run.profile.total_time, 0.001), 0, []);
+        });
+        $scope.runs = runs;
+    });
+});
@@ -22,6 +22,11 @@ forecasts.controller('forecastsController', function ($scope, $http, $modal, $lo
 
     $scope.getForecasts();
 
+    $scope.runsUrl = function (forecast) {
+        return '/forecast_runs?file=' + encodeURIComponent(forecast.file_name) +
+            '&name=' + encodeURIComponent(forecast.name);
+    };
+
     $scope.showConfirmModal = function (forecast_file) {
 
         var modalInstance = $modal.open({
@@ -1,9 +1,11 @@
 import os
+import json
 from apscheduler.triggers.interval import IntervalTrigger
 from flask import Flask, request, Response, jsonify
 from flask.ext.socketio import SocketIO
 from datetime import datetime
 from core.lib.jobs.monitor import ProgressObserver, SUBJOB_UPDATED, JOB_ENDED
+from core.lib.metrics import registry
 from core.modules.statistics.StatsCenter import StatEventListener
 
 __author__ = 'Federico Schmidt'
@@ -28,9 +30,12 @@ class WebServer(StatEventListener, ProgressObserver):
         self.app.add_url_rule('/api/config/reload', 'reload_config', self.reload_config, methods=['GET'])
         self.app.add_url_rule('/api/forecasts', 'forecasts', self.get_forecasts, methods=['GET'])
         self.app.add_url_rule('/api/forecasts/reload/<file_name>', 'forecasts_reload', self.reload_forecast, methods=['GET'])
+        self.app.add_url_rule('/api/forecasts/runs', 'forecast_runs', self.get_forecast_runs, methods=['GET'])
         self.app.add_url_rule('/api/weather_data', 'weather_data', self.get_weather_data, methods=['GET'])
         self.app.add_url_rule('/api/job/run_now/<job_id>', 'run_job', self.run_job_now, methods=['GET'])
         self.app.add_url_rule('/api/job/cancel/<job_id>', 'cancel_job', self.cancel_job, methods=['GET'])
+        self.app.add_url_rule('/api/stats/locks', 'locks_stats', self.get_locks_stats, methods=['GET'])
+        self.app.add_url_rule('/metrics', 'metrics', self.get_metrics, methods=['GET'])
         self.app.add_url_rule('/<path:path>', 'index', self.index)
 
         # Configure socket-io end points.
@@ -130,6 +135,31 @@ class WebServer(StatEventListener, ProgressObserver):
                         status=200,
                         mimetype="text/plain")
 
+    def get_forecast_runs(self):
+        """
+        Returns the last runs of a forecast (newest first) with the timings of each stage, the forecast is identified by
+        the "file" (as returned by get_forecasts) and "name" query parameters. The "limit" query parameter sets the max
+        amount of runs returned (default: 10).
+        """
+        file_name = request.args.get('file')
+        forecast_name = request.args.get('name')
+        if not file_name or not forecast_name:
+            return Response(status=400)
+
+        try:
+            limit = int(request.args.get('limit', 10))
+        except ValueError:
+            return Response(status=400)
+
+        runs = self.system_config.database['yield_db'].forecast_runs.find({
+            'forecast_file': os.path.join(self.system_config.forecasts_path, file_name),
+            'forecast_name': forecast_name
+        }).sort('profile.start_date', -1).limit(limit)
+
+        return Response(response=json.dumps(list(runs), default=str),
+                        status=200,
+                        mimetype="application/json")
+
     def get_weather_data(self):
         """
         Retrieve weather max dates for each station.
@@ -197,6 +227,29 @@ class WebServer(StatEventListener, ProgressObserver):
                         status=200,
                         mimetype="text/plain")
 
+    def get_locks_stats(self):
+        """
+        Returns the metrics of the system locks: wait and hold time histograms by priority, the last acquisitions
+        (with the job that requested them) and the acquisitions that are still held.
+        Accepts a "records" query parameter with the max amount of acquisitions to return for each lock (default: 100).
+        """
+        try:
+            max_records = int(request.args.get('records', 100))
+        except ValueError:
+            return Response(status=400)
+
+        return Response(response=json.dumps(self.stats.locks_metrics(max_records=max_records)),
+                        status=200,
+                        mimetype="application/json")
+
+    def get_metrics(self):
+        """
+        Returns the system metrics (see core.lib.metrics) in the Prometheus text format.
+        """
+        return Response(response=registry.text_format(),
+                        status=200,
+                        content_type=registry.content_type)
+
     def flush_logs(self, content):
         """
         Emits to every client connected to the webserver the new log contents.
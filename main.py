@@ -26,6 +26,7 @@ from core.lib.logging.stream import WebStream
 from core.modules.statistics.StatsCenter import StatsCenter
 from frontend.web import WebServer
 from core.modules.data_updater.SoilsUpdater import SoilsUpdater
+from core.modules.simulations_manager.soil.SoilDAO import soil_repository
 
 __author__ = 'Federico Schmidt'
 
@@ -82,6 +83,8 @@ class Main:
             'misfire_grace_time': 23*60*60  # 23 hours of grace time
         })
         self.stats = StatsCenter(self.scheduler)
+        self.stats.add_lock('jobs', self.system_config.jobs_lock)
+        self.stats.add_lock('resources', self.system_config.resource_locks)
         self.web_server = WebServer(self.stats, self.scheduler, self.system_config)
 
         # Register progress listeners.
@@ -101,6 +104,9 @@ class Main:
         self.system_threads.append(web_server_thread)
         self.system_config.logger.info("Web server started.")
 
+        # Scan the soils folder and parse the soils in the background.
+        soil_repository.warm_up(background=True)
+
         # Start the scheduler.
         self.scheduler.start()
 
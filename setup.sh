@@ -27,3 +27,5 @@ sudo pip install pymongo
 sudo pip install apscheduler
 sudo pip install Flask
 sudo pip install Flask-SocketIO==0.6.0
+# Optional, speeds up directory scans.
+sudo pip install scandir
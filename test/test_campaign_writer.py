@@ -0,0 +1,56 @@
+import os
+import shutil
+import tempfile
+import numpy as np
+from collections import OrderedDict
+from netCDF4 import Dataset
+from core.lib.utils.extended_collections import DotDict
+from core.modules.simulations_manager.CampaignWriter import CampaignWriter
+
+__author__ = 'Federico Schmidt'
+
+import unittest
+
+
+class TestCampaignWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_folder)
+
+    def test_write_campaign_netcdf(self):
+        simulations = OrderedDict()
+        for loc_idx, cultivars in enumerate([['IB0001', 'IB0002'], ['IB0002']]):
+            simulations[loc_idx] = [DotDict({
+                'lat_idx': loc_idx,
+                'lon_idx': sim_idx,
+                'initial_conditions': {'icbl': [20, 50, 100][0:sim_idx + 2]},
+                'management': {'mgmt_name': 'default', 'cul_id': cul_id, 'plant_density': 30.}
+            }) for sim_idx, cul_id in enumerate(cultivars)]
+
+        forecast = DotDict({'simulations': simulations, 'configuration': {
+            'grid_resolution': 30, 'campaign_netcdf': {'zlib': True, 'chunksizes': {'lat': 1}}
+        }})
+        output_file_path = os.path.join(self.tmp_folder, 'campaign.nc4')
+        CampaignWriter.write_campagin_netcdf(forecast, output_file_path, {'max_simulation_count': 2,
+                                                                          'max_soil_layer_count': 3,
+                                                                          'n_scenarios': 2})
+
+        campaign = Dataset(output_file_path)
+        try:
+            self.assertNotIn('mgmt_name', campaign.variables)
+
+            cul_id = campaign.variables['cul_id']
+            self.assertEqual(cul_id.units, 'Mapping')
+            self.assertEqual(cul_id.long_name, 'IB0001,IB0002')
+            self.assertEqual(cul_id[:].tolist(), [[1, 2], [2, None]])
+
+            icbl = campaign.variables['icbl']
+            self.assertEqual(icbl[:].tolist(), [[[20, 50, None], [20, 50, 100]], [[20, 50, None], [None] * 3]])
+            self.assertEqual(icbl.chunking(), [1, 2, 3])
+            self.assertTrue(icbl.filters()['zlib'])
+            self.assertTrue(np.ma.is_masked(campaign.variables['plant_density'][1, 1]))
+        finally:
+            campaign.close()
@@ -0,0 +1,85 @@
+import shutil
+import tempfile
+from datetime import date, datetime
+import psycopg2.extensions
+from core.lib.utils.database import PostgreSQLConnectionPool
+from core.lib.utils.extended_collections import DotDict
+from core.modules.simulations_manager.weather.CombinedSeriesMaker import CombinedSeriesMaker
+from core.modules.simulations_manager.weather.WeatherSeriesCache import WeatherSeriesCache
+
+__author__ = 'Federico Schmidt'
+
+import unittest
+
+
+class FakeCursor(object):
+    def __init__(self, rows):
+        self.rows = rows
+        self.queries = []
+        self.description = [('campaign',), ('fecha',), ('fecha_original',), ('tmax',), ('tmin',), ('prcp',), ('rad',)]
+
+    def execute(self, query, params=None):
+        self.queries.append(query)
+
+    def __iter__(self):
+        return iter(self.rows)
+
+
+class FakeConnection(object):
+    def __init__(self, cursor):
+        self.closed = 0
+        self._cursor = cursor
+
+    def cursor(self):
+        return self._cursor
+
+    def get_transaction_status(self):
+        return psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+
+class TestCombinedSeries(unittest.TestCase):
+
+    def test_create_from_db(self):
+        rows = [(c, date(2015, 1, d), date(c, 1, d), 30., 15., 0., 20.) for c in (1980, 1981, 1983) for d in (1, 2, 3)]
+        cursor = FakeCursor(rows)
+        system_config = DotDict({'campaign_first_month': 5, 'database': {
+            'weather_db': PostgreSQLConnectionPool(lambda: FakeConnection(cursor), min_size=0, max_size=1)
+        }})
+
+        forecast = DotDict({'forecast_date': '2015-01-02', 'campaign_start_date': datetime(2014, 5, 1),
+                            'campaign_end_date': datetime(2015, 4, 30)})
+
+        series_maker = CombinedSeriesMaker(system_config, max_parallelism=1)
+        series = [(year, list(rows)) for year, rows in series_maker.create_from_db({'weather_station': 1}, forecast)]
+
+        # Every campaign must be created with a single query.
+        self.assertEqual(len(cursor.queries), 1)
+        self.assertEqual([s[0] for s in series], [1980, 1981, 1983])
+        for year, scen_rows in series:
+            self.assertEqual(scen_rows[0][1:], ('fecha', 'fecha_original', 'tmax', 'tmin', 'prcp', 'rad'))
+            self.assertEqual([r[2].year for r in scen_rows[1:]], [year] * 3)
+
+    def test_cache_key(self):
+        cache_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_path)
+
+        cursor = FakeCursor([])
+        system_config = DotDict({'campaign_first_month': 5, 'weather_cache': WeatherSeriesCache(cache_path)})
+        system_config['database'] = {
+            'weather_db': PostgreSQLConnectionPool(lambda: FakeConnection(cursor), min_size=0, max_size=1)
+        }
+        location = {'weather_station': 87544, 'coord_x': -60.5, 'coord_y': -33.9}
+        forecast = DotDict({'forecast_date': '2015-01-02', 'campaign_first_month': 5,
+                            'weather_max_dates': {87544: date(2015, 1, 1)}})
+
+        series_maker = CombinedSeriesMaker(system_config, max_parallelism=1)
+        key = series_maker.cache_key(location, forecast, True)
+
+        # The max date of the station is taken from the forecast, without querying the database.
+        self.assertEqual(cursor.queries, [])
+        forecast.weather_max_dates[87544] = date(2015, 1, 2)
+        self.assertNotEqual(series_maker.cache_key(location, forecast, True), key)
+
+        # Series of stations without a known max date aren't cached.
+        del forecast.weather_max_dates[87544]
+        self.assertIsNone(series_maker.cache_key(location, forecast, True))
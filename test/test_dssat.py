@@ -0,0 +1,308 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+from core.lib.dssat.DSSATExpWriter import DSSATExpWriter
+from core.lib.dssat.DSSATOutReader import DSSATOutReader
+from core.lib.utils.extended_collections import DotDict
+from core.modules.simulations_manager import RunDSSAT as run_dssat_module
+from core.modules.simulations_manager.RunDSSAT import RunDSSAT
+from core.modules.simulations_manager.ResultsWriter import ResultsWriter
+
+__author__ = 'Federico Schmidt'
+
+SUMMARY = """*SUMMARY : X1234567 SB
+
+!IDENTIFIERS......................... TREATMENT................ EXPERIMENT AND FIELD....... DATES...........
+@   RUNNO   TRNO R# O# C# CR MODEL... TNAM..................... FNAM.... WSTA.... SOIL_ID...    SDAT    PDAT    MDAT    HWAM
+        1      1  1  0  1 SB CRGRO046 Scenario 3                Field    WTH00003 SOIL01     2015305 2015314 2016075    2876
+        2      2  1  0  1 SB CRGRO046 Scenario 4                Field    WTH00004 SOIL01     2015305 2015314 2016080     -99
+"""
+
+PLANT_GRO = """*DSSAT Cropping System Model Ver. 4.6.0.030
+
+*RUN   1        : Scenario 3                  CRGRO046 SOIL01
+ TREATMENT  1   : Scenario 3                  CRGRO046
+
+@YEAR DOY   DAS   DAP   LAID   CWAD
+ 2015 364    59    50   0.00      0
+ 2015 365    60    51   1.25    102
+ 2016   1    61    52   1.50    140
+
+*RUN   2        : Scenario 4                  CRGRO046 SOIL01
+ TREATMENT  2   : Scenario 4                  CRGRO046
+
+@YEAR DOY   DAS   DAP   LAID   CWAD
+ 2015 365    60    51   0.75     90
+"""
+
+SOIL = {'soil_id': 'SOIL01', 'sl_source': 'INTA', 'sltx': 'SiL', 'soil_lat': -37.72, 'soil_long': -59.78,
+        'soilLayer': [{'sllb': '20', 'slll': 0.1, 'sldul': 0.3, 'slsat': 0.4, 'slbdm': 1.3},
+                      {'sllb': '50', 'slll': 0.2, 'sldul': 0.4, 'slsat': 0.45, 'slbdm': 1.35}]}
+
+
+class FakeSimulationsCollection(object):
+    def __init__(self):
+        self.updates = {}
+        self.bulk_writes = 0
+
+    def bulk_write(self, requests, ordered=True):
+        self.bulk_writes += 1
+        for request in requests:
+            self.updates[request._filter['_id']] = request._doc['$set']
+
+
+class FakeSoilDAO(object):
+    @staticmethod
+    def get_soil(soil_id):
+        return {'soils': [SOIL]}
+
+
+class TestDSSATFiles(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_folder = tempfile.mkdtemp()
+        with open(os.path.join('data', 'templates', 'SB.json')) as template_file:
+            self.template = json.load(template_file)
+        self.simulation = {
+            'management': {'mgmt_name': 'Early', 'cul_id': 'UA4L03', 'date_1': 'yyyy1110', 'date_4': 'yyyy1111',
+                           'plpop': 30},
+            'initial_conditions': {'ich20_frac': [1.0, 0.5], 'icnh4': [0.5, 0.3], 'icno3': [12.0, 6.0]}
+        }
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_folder)
+
+    def test_experiment(self):
+        experiment = DSSATExpWriter.experiment(self.template, self.simulation, SOIL, 2015)
+        events = experiment['management']['events']
+
+        self.assertEqual(experiment['soil_id'], 'SOIL01')
+        self.assertEqual(events[0]['date'], '20151110')
+        self.assertEqual(events[0]['cul_id'], 'UA4L03')
+        self.assertEqual(events[0]['plpop'], 30)
+        # date_4 is the date of the fourth event with a date (the irrigation).
+        self.assertEqual(events[3]['date'], '20151111')
+        self.assertEqual(events[4]['date'], '20151231')
+        # The template isn't modified.
+        self.assertEqual(self.template['management']['events'][0]['date'], '19790101')
+
+        layers = experiment['initial_conditions']['soilLayer']
+        self.assertEqual([l['icbl'] for l in layers], ['20', '50'])
+        self.assertAlmostEqual(layers[0]['ich2o'], 0.3)
+        self.assertAlmostEqual(layers[1]['ich2o'], 0.3)
+        self.assertEqual(layers[1]['icno3'], 6.0)
+
+        self.simulation['management']['date_9'] = 'yyyy0101'
+        self.assertRaises(RuntimeError, DSSATExpWriter.experiment, self.template, self.simulation, SOIL, 2015)
+
+    def test_write_exp(self):
+        experiment = DSSATExpWriter.experiment(self.template, self.simulation, SOIL, 2015)
+        exp_path = os.path.join(self.tmp_folder, 'X1234567.EXP')
+        DSSATExpWriter.write_exp(experiment, [3, 4], exp_path)
+
+        with open(exp_path) as exp_file:
+            lines = exp_file.read().split('\n')
+
+        treatments = [l for l in lines if l.startswith(' 1 1 0 0') or l.startswith(' 2 1 0 0')]
+        self.assertEqual(treatments[0], ' 1 1 0 0 Scenario 3                 1  1  0  1  1  1  1  0  0  0  1  1  1')
+        self.assertEqual(treatments[1][0:2], ' 2')
+
+        # Each treatment uses its own field, with the weather file of its scenario.
+        fields = [l for l in lines if l.startswith(' 2 Field')]
+        self.assertEqual(fields[0][12:20], 'WTH00004')
+        self.assertIn('SOIL01', fields[0])
+
+        planting = lines[lines.index('*PLANTING DETAILS') + 2]
+        self.assertEqual(planting[0:8], ' 1 15314')
+        self.assertIn(' 1    20 0.300 0.500    12', lines)
+
+        # Fertilizers are applied by days after planting in the SB template.
+        fertilizers = lines[lines.index('*FERTILIZERS (INORGANIC)') + 2:]
+        self.assertEqual(fertilizers[0][0:14], ' 1     1 FE005')
+        experiment['management']['events'][1]['date'] = '20151120'
+        DSSATExpWriter.write_exp(experiment, [3, 4], exp_path)
+        with open(exp_path) as exp_file:
+            self.assertIn(' 1    10 FE005', exp_file.read())
+
+        self.assertRaises(RuntimeError, DSSATExpWriter.write_exp, experiment, range(100), exp_path)
+
+    def test_write_sol(self):
+        sol_path = os.path.join(self.tmp_folder, 'SOIL.SOL')
+        DSSATExpWriter.write_sol(SOIL, sol_path)
+
+        with open(sol_path) as sol_file:
+            lines = sol_file.read().split('\n')
+
+        self.assertEqual(lines[2][0:11], '*SOIL01    ')
+        self.assertEqual(lines[-3][0:24], '    20   -99 0.100 0.300')
+        self.assertEqual(lines[-2][0:24], '    50   -99 0.200 0.400')
+
+    def test_fmt(self):
+        self.assertEqual(DSSATExpWriter.fmt(None), '  -99')
+        self.assertEqual(DSSATExpWriter.fmt(12.75), '12.75')
+        self.assertEqual(DSSATExpWriter.fmt(0.2183), '0.218')
+        self.assertEqual(DSSATExpWriter.fmt(-0.2183), '-.218')
+        self.assertEqual(DSSATExpWriter.fmt('GS000'), 'GS000')
+        self.assertEqual(DSSATExpWriter.dssat_date('20160201'), '16032')
+        self.assertEqual(DSSATExpWriter.dssat_date('1'), '1')
+
+
+class TestDSSATOutReader(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_folder = tempfile.mkdtemp()
+        with open(os.path.join(self.tmp_folder, 'Summary.OUT'), mode='w') as summary_file:
+            summary_file.write(SUMMARY)
+        with open(os.path.join(self.tmp_folder, 'PlantGro.OUT'), mode='w') as daily_file:
+            daily_file.write(PLANT_GRO)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_folder)
+
+    def test_read_summary(self):
+        summary = DSSATOutReader.read_summary(os.path.join(self.tmp_folder, 'Summary.OUT'))
+
+        self.assertEqual(summary['TRNO'].tolist(), [1, 2])
+        self.assertEqual(summary['TNAM'].tolist(), ['Scenario 3', 'Scenario 4'])
+        self.assertEqual(summary['WSTA'].tolist(), ['WTH00003', 'WTH00004'])
+        self.assertEqual(summary['MDAT'].tolist(), [2016075, 2016080])
+        self.assertEqual(summary['HWAM'].tolist(), [2876, -99])
+
+        # Only the requested columns are parsed.
+        summary = DSSATOutReader.read_summary(os.path.join(self.tmp_folder, 'Summary.OUT'), variables=['HWAM'])
+        self.assertEqual(sorted(summary.keys()), ['HWAM', 'RUNNO', 'TRNO'])
+
+    def test_read_daily(self):
+        tables = DSSATOutReader.read_daily(os.path.join(self.tmp_folder, 'PlantGro.OUT'), variables=['LAID'])
+
+        self.assertEqual([run_number for run_number, table in tables], [1, 2])
+        self.assertEqual(tables[0][1]['DATE'].tolist(), [15364, 15365, 16001])
+        self.assertEqual(tables[0][1]['LAID'].tolist(), [0, 1.25, 1.5])
+        self.assertNotIn('CWAD', tables[0][1])
+
+    def test_cycle_results(self):
+        summary = DSSATOutReader.read_summary(os.path.join(self.tmp_folder, 'Summary.OUT'))
+
+        results = DSSATOutReader.cycle_results(summary, ['HWAM'], [3, 4])
+        self.assertEqual(results, {3: {'HWAM': 2876}, 4: {'HWAM': -99}})
+
+        # Both runs belong to the same scenario when two years are simulated.
+        summary['TRNO'][:] = 1
+        results = DSSATOutReader.cycle_results(summary, ['HWAM'], [3], num_years=2)
+        self.assertEqual(results, {3: {'HWAM': [2876, -99]}})
+
+        self.assertRaises(RuntimeError, DSSATOutReader.cycle_results, summary, ['CWAM'], [3], 2)
+        self.assertRaises(RuntimeError, DSSATOutReader.cycle_results, summary, ['HWAM'], [3])
+
+    def test_read_results(self):
+        cycle_results, daily_results = DSSATOutReader.read_results(self.tmp_folder, ['HWAM'], ['LAID', 'CWAD'],
+                                                                   [3, 4])
+
+        self.assertEqual(cycle_results[4], {'HWAM': -99})
+        # Days with zero values are omitted.
+        self.assertEqual(daily_results[3]['LAID'], {'dates': [15365, 16001], 'values': [1.25, 1.5]})
+        self.assertEqual(daily_results[4]['CWAD'], {'dates': [15365], 'values': [90]})
+
+        self.assertRaises(RuntimeError, DSSATOutReader.read_results, self.tmp_folder, ['HWAM'], ['SWTD'], [3, 4])
+
+
+class TestResultsWriter(unittest.TestCase):
+
+    def test_write(self):
+        collection = FakeSimulationsCollection()
+        writer = ResultsWriter(collection, batch_size=2)
+
+        writer.add('sim_1', cycle_results={0: {'HWAM': 100}, 1: {'HWAM': 200}})
+        writer.add('sim_2', cycle_results={0: {'HWAM': [100, 150]}},
+                   daily_results={0: {'LAID': {'dates': [15365], 'values': [1.25]}}})
+        writer.add('sim_3', cycle_results={0: {'HWAM': 300}})
+        self.assertEqual(collection.bulk_writes, 1)
+
+        writer.flush()
+        self.assertEqual(collection.bulk_writes, 2)
+        self.assertEqual(writer.written_count, 3)
+
+        self.assertEqual(collection.updates['sim_1']['cycle_results'], {
+            'HWAM': {'scenarios': [{'value': 100}, {'value': 200}]}
+        })
+        self.assertEqual(collection.updates['sim_2']['cycle_results'], {
+            'HWAM': {'scenarios': [{'value': [{'value': 100}, {'value': 150}]}]}
+        })
+        self.assertEqual(collection.updates['sim_2']['daily_results'], {
+            'LAID': {'scenarios': [{'dates': [15365], 'values': [1.25]}]}
+        })
+        self.assertNotIn('daily_results', collection.updates['sim_1'])
+
+
+class TestRunDSSAT(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_folder = tempfile.mkdtemp()
+        self.dssat_path = os.path.join(self.tmp_folder, 'dssat')
+        self.rundir = os.path.join(self.tmp_folder, 'rundir')
+        os.makedirs(self.dssat_path)
+        os.makedirs(os.path.join(self.rundir, 'wth', '87649'))
+
+        for scen_idx in [0, 1]:
+            open(os.path.join(self.rundir, 'wth', '87649', 'WTH%05d.WTH' % scen_idx), mode='w').close()
+
+        # A fake DSSAT that writes the outputs of both treatments if it finds the input files.
+        outputs_path = os.path.join(self.tmp_folder, 'outputs')
+        os.makedirs(outputs_path)
+        with open(os.path.join(outputs_path, 'Summary.OUT'), mode='w') as summary_file:
+            summary_file.write(SUMMARY)
+        with open(os.path.join(outputs_path, 'PlantGro.OUT'), mode='w') as daily_file:
+            daily_file.write(PLANT_GRO)
+        executable_path = os.path.join(self.dssat_path, 'DSCSM046')
+        with open(executable_path, mode='w') as executable:
+            executable.write('#!/bin/sh\n'
+                             'test "$1" = "A" && test -f "$2" && test -f SOIL.SOL && test -f WTH00001.WTH || exit 1\n'
+                             'cp "%s"/*.OUT .\n' % outputs_path)
+        os.chmod(executable_path, 0755)
+
+        self.original_soil_dao = run_dssat_module.SoilDAO
+        run_dssat_module.SoilDAO = FakeSoilDAO
+
+        self.collection = FakeSimulationsCollection()
+        self.runner = RunDSSAT(DotDict({'database': {'yield_db': {'simulations': self.collection}}}))
+
+    def tearDown(self):
+        run_dssat_module.SoilDAO = self.original_soil_dao
+        shutil.rmtree(self.tmp_folder)
+
+    def forecast(self):
+        simulation = DotDict({
+            '_id': 'sim_1',
+            'soil': {'id': 'SOIL01', 'n_horizons': 2},
+            'weather_station': {'weather_path': 'wth/87649', 'num_scenarios': 2},
+            'management': {'mgmt_name': 'Early', 'date_1': 'yyyy1110'},
+            'initial_conditions': {'ich20_frac': [1.0, 0.5], 'icnh4': [0.5, 0.3], 'icno3': [12.0, 6.0]}
+        })
+        return DotDict({
+            'name': 'Test forecast',
+            'forecast_date': '2015-11-01',
+            'crop_template': 'SB.json',
+            'simulation_count': 1,
+            'simulations': {'loc_1': [simulation]},
+            'results': {'cycle': ['HWAM'], 'daily': ['LAID']},
+            'paths': {'rundir': self.rundir, 'psims': self.tmp_folder},
+            'configuration': {'reference_year': 2015, 'simulation_collection': 'simulations', 'max_parallelism': 1,
+                              'dssat_path': self.dssat_path}
+        })
+
+    def test_run(self):
+        self.assertEqual(self.runner.run(self.forecast(), verbose=False), 0)
+        self.assertEqual(self.collection.updates['sim_1']['cycle_results'], {
+            'HWAM': {'scenarios': [{'value': 2876}, {'value': -99}]}
+        })
+        self.assertEqual(self.collection.updates['sim_1']['daily_results'], {
+            'LAID': {'scenarios': [{'dates': [15365, 16001], 'values': [1.25, 1.5]},
+                                   {'dates': [15365], 'values': [0.75]}]}
+        })
+
+    def test_failed_run(self):
+        os.remove(os.path.join(self.rundir, 'wth', '87649', 'WTH00001.WTH'))
+        self.assertNotEqual(self.runner.run(self.forecast(), verbose=False), 0)
+        self.assertEqual(self.collection.updates, {})
@@ -1,9 +1,53 @@
+import os
+import json
+import shutil
+import tempfile
 import unittest
 from core.lib.utils.extended_collections import DotDict
 
 from core.model.Forecast import Forecast
+from core.modules.simulations_manager import InputFingerprint as input_fingerprint_module
+from core.modules.simulations_manager.ForecastManager import ForecastManager
+from core.modules.simulations_manager.InputFingerprint import InputFingerprint
+from core.modules.simulations_manager.soil.SoilRepository import SoilRepository
+from core.modules.simulations_manager.ResultsValidator import ResultsValidator
+from pymongo.errors import BulkWriteError
 from datetime import datetime
 
+
+class FakeCollection(object):
+    def __init__(self, fail_at=None):
+        self.fail_at = fail_at
+        self.batches = []
+
+    def insert_many(self, documents, ordered=True):
+        self.batches.append(len(documents))
+        n_inserted = sum(self.batches) - len(documents)
+
+        if self.fail_at is not None and n_inserted + len(documents) > self.fail_at:
+            raise BulkWriteError({'nInserted': self.fail_at - n_inserted, 'writeErrors': [{'code': 11000}]})
+        return DotDict({'inserted_ids': [d['_id'] for d in documents]})
+
+
+class FakeResultsCollection(object):
+    def __init__(self, documents):
+        self.documents = documents
+        self.updates = {}
+
+    def find(self, query, projection=None):
+        fingerprints = query['input_fingerprint']['$in']
+        return [d for d in self.documents if d['input_fingerprint'] in fingerprints and 'cycle_results' in d]
+
+    def bulk_write(self, requests, ordered=True):
+        for request in requests:
+            self.updates[request._filter['_id']] = request._doc['$set']
+
+
+class FakeSimulation(DotDict):
+    def persistent_view(self):
+        return {'_id': self.id}
+
+
 class TestForecast(unittest.TestCase):
 
     @staticmethod
@@ -35,3 +79,140 @@ class TestForecast(unittest.TestCase):
 
         f4 = TestForecast.forecast_builder('2015-08-31', campaign_first_month=5)
         self.assertEqual(f4.campaign_name, '2015/2016')
+
+    def test_insert_simulations(self):
+        simulations = [FakeSimulation({'id': i}) for i in range(0, 7)]
+
+        inserted_ids = []
+        collection = FakeCollection()
+        ForecastManager.insert_simulations(collection, simulations, inserted_ids, batch_size=3)
+        self.assertEqual(collection.batches, [3, 3, 1])
+        self.assertEqual(inserted_ids, range(0, 7))
+        self.assertEqual([s['_id'] for s in simulations], range(0, 7))
+
+        # When a batch fails, the ids of the documents inserted before the error must be reported.
+        inserted_ids = []
+        self.assertRaises(BulkWriteError, ForecastManager.insert_simulations, FakeCollection(fail_at=4), simulations,
+                          inserted_ids, 3)
+        self.assertEqual(inserted_ids, range(0, 4))
+
+    def test_results_validator(self):
+        simulations = [
+            {'_id': 1, 'name': 'sim 1', 'cycle_results': {'HWAM': {'scenarios': [{'value': 3000}, {'value': -99}]}}},
+            {'_id': 2, 'name': 'sim 2', 'cycle_results': {'HWAM': {'scenarios': [
+                {'value': [{'value': 1000}, {'value': -99}]}
+            ]}}},
+        ]
+
+        class ResultsCollection(object):
+            def aggregate(self, pipeline):
+                if '$group' in pipeline[-1]:
+                    return iter([{'_id': None, 'count': 2}])
+                return iter(simulations)
+
+            def find(self, query, projection=None):
+                return iter([{'_id': 1}, {'_id': 2}])
+
+        report = ResultsValidator.validate(ResultsCollection(), [1, 2, 3])
+        self.assertEqual(report['finished'], 2)
+        self.assertEqual(report['unfinished_ids'], [3])
+        self.assertEqual([(v['_id'], v['scenario_index'], v['year_index']) for v in report['negative_yields']],
+                         [(1, 1, None), (2, 0, 1)])
+        self.assertEqual(len(report['errors']), 3)
+
+    def test_reuse_results(self):
+        collection = FakeResultsCollection([
+            {'_id': 'old_1', 'input_fingerprint': 'a', 'cycle_results': {'HWAM': {'scenarios': [{'value': 1}]}}},
+            # Unfinished simulations can't be reused.
+            {'_id': 'old_2', 'input_fingerprint': 'b'}
+        ])
+        simulations = [FakeSimulation({'_id': 'new_%d' % i, 'input_fingerprint': f}) for i, f in enumerate('aab')]
+
+        reused = ForecastManager.reuse_results(collection, simulations, batch_size=1)
+        self.assertEqual([sim['_id'] for sim in reused], ['new_0', 'new_1'])
+        self.assertEqual(sorted(collection.updates.keys()), ['new_0', 'new_1'])
+        self.assertEqual(collection.updates['new_1']['cycle_results'], {'HWAM': {'scenarios': [{'value': 1}]}})
+        self.assertNotIn('daily_results', collection.updates['new_1'])
+
+
+class TestInputFingerprint(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_folder = tempfile.mkdtemp()
+        self.soils_path = os.path.join(self.tmp_folder, 'soils')
+        self.weather_path = os.path.join(self.tmp_folder, 'wth')
+        os.makedirs(self.soils_path)
+        os.makedirs(self.weather_path)
+
+        with open(os.path.join(self.soils_path, 'SOIL01.json'), mode='w') as soil_file:
+            json.dump({'soils': [{'soil_id': 'SOIL01', 'soilLayer': []}]}, soil_file)
+        for scen_idx in range(2):
+            self.write_weather(scen_idx, 'scenario %d' % scen_idx)
+
+        self.original_repository = input_fingerprint_module.soil_repository
+        input_fingerprint_module.soil_repository = SoilRepository(self.soils_path)
+
+    def tearDown(self):
+        input_fingerprint_module.soil_repository = self.original_repository
+        shutil.rmtree(self.tmp_folder)
+
+    def write_weather(self, scen_idx, content):
+        with open(os.path.join(self.weather_path, 'WTH%05d.WTH' % scen_idx), mode='w') as wth_file:
+            wth_file.write(content)
+
+    def forecast(self, cycle_variables=('HWAM',)):
+        return DotDict({
+            'crop_type': 'SB',
+            'crop_template': 'SB.json',
+            'results': {'cycle': list(cycle_variables), 'daily': []},
+            'paths': {'rundir': self.tmp_folder, 'psims': self.tmp_folder},
+            'configuration': {'reference_year': 2015}
+        })
+
+    def simulation(self, mgmt_name='Early', date='yyyy1110'):
+        return DotDict({
+            'soil': {'id': 'SOIL01'},
+            'weather_station': {'weather_path': 'wth', 'num_scenarios': 2},
+            'management': {'mgmt_name': mgmt_name, 'date_1': date},
+            'initial_conditions': {'ich20_frac': [1.0, 0.5]}
+        })
+
+    def test_fingerprint(self):
+        fingerprint = InputFingerprint(self.forecast()).fingerprint(self.simulation())
+
+        # Names don't change the results.
+        self.assertEqual(InputFingerprint(self.forecast()).fingerprint(self.simulation(mgmt_name='Other')),
+                         fingerprint)
+
+        self.assertNotEqual(InputFingerprint(self.forecast()).fingerprint(self.simulation(date='yyyy1115')),
+                            fingerprint)
+        self.assertNotEqual(InputFingerprint(self.forecast(cycle_variables=['HWAM', 'MDAT'])).fingerprint(
+            self.simulation()), fingerprint)
+
+        # The content of the weather series is part of the fingerprint.
+        self.write_weather(1, 'updated scenario')
+        self.assertNotEqual(InputFingerprint(self.forecast()).fingerprint(self.simulation()), fingerprint)
+
+    def test_dssat_files_fingerprint(self):
+        dssat_path = os.path.join(self.tmp_folder, 'data', 'dssat_files')
+        os.makedirs(dssat_path)
+        with open(os.path.join(dssat_path, 'SBGRO046.CUL'), mode='w') as cul_file:
+            cul_file.write('cultivar coefficients')
+
+        fingerprint = InputFingerprint(self.forecast()).fingerprint(self.simulation())
+
+        # Other DSSAT files don't change the results.
+        with open(os.path.join(dssat_path, 'DSSATPRO.L46'), mode='w') as other_file:
+            other_file.write('profile')
+        self.assertEqual(InputFingerprint(self.forecast()).fingerprint(self.simulation()), fingerprint)
+
+        with open(os.path.join(dssat_path, 'SBGRO046.CUL'), mode='w') as cul_file:
+            cul_file.write('updated cultivar coefficients')
+        self.assertNotEqual(InputFingerprint(self.forecast()).fingerprint(self.simulation()), fingerprint)
+
+        # The pSIMS tapps are part of the fingerprint too.
+        fingerprint = InputFingerprint(self.forecast()).fingerprint(self.simulation())
+        os.makedirs(os.path.join(self.tmp_folder, 'tapps', 'pdssat'))
+        with open(os.path.join(self.tmp_folder, 'tapps', 'pdssat', 'camp2json.py'), mode='w') as tapp_file:
+            tapp_file.write('print "campaign"')
+        self.assertNotEqual(InputFingerprint(self.forecast()).fingerprint(self.simulation()), fingerprint)
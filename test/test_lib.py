@@ -1,6 +1,18 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
 import unittest
+from datetime import date, timedelta
 
+import numpy as np
+
+from core.lib.dssat.DSSATWthWriter import DSSATWthWriter
 from core.lib.geo.grid import latlon_to_grid
+from core.lib.utils.database import PostgreSQLConnectionPool, MongoRoundTripsListener, db_round_trips
+from core.lib.utils.extended_collections import DotDict
+import psycopg2.extensions
 
 
 class TestGeoLib(unittest.TestCase):
@@ -13,3 +25,160 @@ class TestGeoLib(unittest.TestCase):
         grid_junin = latlon_to_grid(lat_dec=-34.55, lon_dec=-60.92, resolution=30)
         self.assertEqual(grid_junin.row, 250)
         self.assertEqual(grid_junin.column, 239)
+
+
+class TestDSSATWthWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.output_folder = tempfile.mkdtemp()
+        self.location = {'coord_x': -60.92, 'coord_y': -34.55}
+
+    def tearDown(self):
+        shutil.rmtree(self.output_folder)
+
+    def test_write_rows_and_array(self):
+        dates = [date(2015, 12, 30) + timedelta(days=d) for d in range(0, 40)]
+        tmax = [25. + (d % 7) for d in range(0, 40)]
+        tmin = [10. + (d % 5) for d in range(0, 40)]
+        prcp = [float(d % 3) for d in range(0, 40)]
+        rad = [20.] * 40
+
+        rows = [('fecha', 'tmax', 'tmin', 'prcp', 'rad')] + zip([d.isoformat() for d in dates], tmax, tmin, prcp, rad)
+        content = DSSATWthWriter.write_wth_file(0, rows, self.output_folder, self.location)
+
+        series = DSSATWthWriter.create_series(fecha=dates, rad=rad, tmax=tmax, tmin=tmin, prcp=prcp)
+        array_folder = os.path.join(self.output_folder, 'array')
+        os.mkdir(array_folder)
+        DSSATWthWriter.write_wth_array(0, series, array_folder, self.location)
+
+        with open(os.path.join(self.output_folder, 'WTH00000.WTH')) as f:
+            rows_file = f.read()
+        with open(os.path.join(array_folder, 'WTH00000.WTH')) as f:
+            self.assertEqual(rows_file, f.read())
+
+        self.assertEqual(content['fecha'][:3].tolist(), [15364, 15365, 16001])
+        lines = rows_file.splitlines()
+        self.assertEqual(len(lines), 4 + 40)
+        self.assertEqual(lines[4], '15364  20.0  25.0  10.0   0.0')
+        # TAV: mean of daily average temperatures.
+        self.assertEqual(lines[2][30:36], '%6.1f' % (0.5 * (sum(tmax) + sum(tmin)) / 40))
+
+        with self.assertRaises(RuntimeError):
+            DSSATWthWriter.write_wth_array(0, series, array_folder, self.location)
+
+    def test_missing_values(self):
+        rows = [('fecha', 'tmax', 'tmin', 'prcp', 'rad'), ('2015-01-01', 25., None, 0., 20.)]
+        self.assertRaises(RuntimeError, DSSATWthWriter.write_wth_file, 0, rows, self.output_folder, self.location)
+        self.assertFalse(os.path.exists(os.path.join(self.output_folder, 'WTH00000.WTH')))
+
+    def test_missing_variables(self):
+        rows = [('fecha', 'tmax', 'tmin', 'rad'), ('2015-01-01', 25., 10., 20.)]
+        self.assertRaises(RuntimeError, DSSATWthWriter.write_wth_file, 0, rows, self.output_folder, self.location)
+
+        series = np.zeros(1, dtype=[('fecha', 'M8[D]'), ('tmax', 'f8'), ('tmin', 'f8'), ('rad', 'f8')])
+        self.assertRaises(RuntimeError, DSSATWthWriter.write_wth_array, 0, series, self.output_folder, self.location)
+
+        # The original dates are only required if they're written.
+        series = DSSATWthWriter.create_series(fecha=[date(2015, 1, 1)], rad=[20.], tmax=[25.], tmin=[10.], prcp=[0.])
+        self.assertRaises(RuntimeError, DSSATWthWriter.write_wth_array, 0, series, self.output_folder, self.location,
+                          write_original_date=True)
+        self.assertFalse(os.path.exists(os.path.join(self.output_folder, 'WTH00000.WTH')))
+
+    def test_original_date(self):
+        rows = [('fecha', 'tmax', 'tmin', 'prcp', 'rad', 'fecha_original'),
+                ('2015-01-01', 25., 10., 0., 20., date(1990, 3, 9))]
+        content = DSSATWthWriter.write_wth_file(0, rows, self.output_folder, self.location, write_original_date=True)
+        self.assertEqual(content['fecha_original'].tolist(), [19900309])
+        with open(os.path.join(self.output_folder, 'WTH00000.WTH')) as f:
+            self.assertTrue(f.read().splitlines()[-1].endswith('!19900309'))
+
+
+class FakeConnection(object):
+    def __init__(self):
+        self.closed = 0
+        self.rollbacks = 0
+        self.transaction_status = psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+    def get_transaction_status(self):
+        return self.transaction_status
+
+    def rollback(self):
+        self.rollbacks += 1
+        self.transaction_status = psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+    def close(self):
+        self.closed = 1
+
+
+class TestConnectionPool(unittest.TestCase):
+
+    def setUp(self):
+        self.opened = []
+
+        def connect():
+            self.opened.append(FakeConnection())
+            return self.opened[-1]
+        self.pool = PostgreSQLConnectionPool(connect, min_size=1, max_size=2)
+
+    def test_checkout(self):
+        self.assertEqual(len(self.opened), 1)
+
+        with self.pool.connection() as conn:
+            # Nested checkouts of the same thread get the same connection.
+            with self.pool.connection() as nested_conn:
+                self.assertIs(conn, nested_conn)
+            conn.transaction_status = psycopg2.extensions.TRANSACTION_STATUS_INTRANS
+
+        # Open transactions are rolled back when the connection is given back.
+        self.assertEqual(conn.rollbacks, 1)
+
+        # Closed connections are replaced.
+        conn.closed = 2
+        with self.pool.connection() as new_conn:
+            self.assertIsNot(new_conn, conn)
+        self.assertEqual(len(self.opened), 2)
+
+    def test_max_size(self):
+        checked_out = []
+        release = threading.Event()
+
+        def worker():
+            with self.pool.connection() as conn:
+                checked_out.append(conn)
+                release.wait()
+
+        threads = [threading.Thread(target=worker) for i in range(0, 3)]
+        for t in threads:
+            t.start()
+
+        time.sleep(0.2)
+        # Only max_size threads can hold a connection at the same time.
+        self.assertEqual(len(checked_out), 2)
+        self.assertIsNot(checked_out[0], checked_out[1])
+
+        release.set()
+        for t in threads:
+            t.join()
+        self.assertEqual(len(checked_out), 3)
+        self.assertEqual(len(self.opened), 2)
+
+
+class TestRoundTrips(unittest.TestCase):
+
+    def test_mongo_listener(self):
+        listener = MongoRoundTripsListener('test_db')
+        self.assertEqual(self.round_trips('test_db', 'find'), 0)
+
+        listener.started(DotDict({'command_name': 'find', 'database_name': 'prinde'}))
+        listener.started(DotDict({'command_name': 'find', 'database_name': 'prinde'}))
+        listener.started(DotDict({'command_name': 'update', 'database_name': 'prinde'}))
+
+        self.assertEqual(self.round_trips('test_db', 'find'), 2)
+        self.assertEqual(self.round_trips('test_db', 'update'), 1)
+
+    @staticmethod
+    def round_trips(database, operation):
+        for suffix, labels, value in db_round_trips.samples():
+            if dict(labels) == {'database': database, 'operation': operation}:
+                return value
+        return 0
@@ -0,0 +1,84 @@
+import unittest
+from core.lib.jobs.monitor import ProgressMonitor, job_duration
+from core.lib.metrics import MetricsRegistry
+from test.mock import TestJob
+
+__author__ = 'Federico Schmidt'
+
+
+class TestMetricsRegistry(unittest.TestCase):
+
+    def test_text_format(self):
+        registry = MetricsRegistry()
+        counter = registry.counter('test_requests_total', 'Requests sent.', ['database', 'operation'])
+        counter.inc(labels={'database': 'yield_db', 'operation': 'find'})
+        counter.inc(2, labels={'database': 'yield_db', 'operation': 'find'})
+        counter.inc(labels={'database': 'weather_db', 'operation': 'copy "from"'})
+
+        gauge = registry.gauge('test_queue_depth', 'Waiting requests.', ['lock'])
+        gauge.set(3, labels={'lock': 'jobs'})
+        gauge.set_function(lambda: 1, labels={'lock': 'resources'})
+
+        self.assertEqual(registry.text_format(), '\n'.join([
+            '# HELP test_queue_depth Waiting requests.',
+            '# TYPE test_queue_depth gauge',
+            'test_queue_depth{lock="jobs"} 3.0',
+            'test_queue_depth{lock="resources"} 1.0',
+            '# HELP test_requests_total Requests sent.',
+            '# TYPE test_requests_total counter',
+            'test_requests_total{database="weather_db",operation="copy \\"from\\""} 1.0',
+            'test_requests_total{database="yield_db",operation="find"} 3.0'
+        ]) + '\n')
+
+    def test_histogram(self):
+        registry = MetricsRegistry()
+        histogram = registry.histogram('test_duration_seconds', 'Durations.', buckets=[1, 10])
+        for value in [0.5, 1, 5, 20]:
+            histogram.observe(value)
+
+        self.assertEqual(registry.text_format().split('\n')[2:-1], [
+            'test_duration_seconds_bucket{le="1.0"} 2.0',
+            'test_duration_seconds_bucket{le="10.0"} 3.0',
+            'test_duration_seconds_bucket{le="+Inf"} 4.0',
+            'test_duration_seconds_sum 26.5',
+            'test_duration_seconds_count 4.0'
+        ])
+
+    def test_registration(self):
+        registry = MetricsRegistry()
+        counter = registry.counter('test_total', 'Test.', ['kind'])
+
+        # Metrics are looked up by name, so they can be declared by every module that feeds them.
+        self.assertIs(registry.counter('test_total', 'Test.', ['kind']), counter)
+        self.assertRaises(RuntimeError, registry.gauge, 'test_total', 'Test.', ['kind'])
+        self.assertRaises(RuntimeError, registry.counter, 'test_total', 'Test.', ['status'])
+
+        self.assertRaises(RuntimeError, counter.inc, labels={'status': 'error'})
+        self.assertRaises(RuntimeError, counter.inc, -1, labels={'kind': 'job'})
+        self.assertRaises(RuntimeError, registry.histogram, 'test_seconds', 'Test.', ['le'])
+
+    def test_failing_gauge_function(self):
+        registry = MetricsRegistry()
+        gauge = registry.gauge('test_gauge', 'Test.', ['lock'])
+        gauge.set_function(lambda: 1 / 0, labels={'lock': 'jobs'})
+        gauge.set_function(lambda: 2, labels={'lock': 'resources'})
+
+        # Gauges whose value can't be read are skipped.
+        self.assertEqual(registry.text_format().split('\n')[2:-1], ['test_gauge{lock="resources"} 2.0'])
+
+    def test_job_duration(self):
+        finished_count = self.job_count('job', 'finished')
+        error_count = self.job_count('job', 'error')
+
+        TestJob(progress_monitor=ProgressMonitor()).start()
+        TestJob(ret_val=1, progress_monitor=ProgressMonitor()).start()
+
+        self.assertEqual(self.job_count('job', 'finished'), finished_count + 1)
+        self.assertEqual(self.job_count('job', 'error'), error_count + 1)
+
+    @staticmethod
+    def job_count(kind, status):
+        for suffix, labels, value in job_duration.samples():
+            if suffix == '_count' and dict(labels) == {'kind': kind, 'status': status}:
+                return value
+        return 0
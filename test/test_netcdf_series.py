@@ -1,7 +1,13 @@
 import os
+import shutil
+from datetime import datetime
+import numpy as np
+from netCDF4 import Dataset
 from core.lib.utils.extended_collections import DotDict
 from core.model.Location import Location
 from core.modules.simulations_manager.weather.NetCDFSeriesMaker import NetCDFSeriesMaker
+from core.modules.simulations_manager.weather.NetCDFSourceCache import NetCDFSourceCache
+from core.modules.simulations_manager.weather.SeriesExecutor import ThreadSeriesExecutor, ProcessSeriesExecutor
 
 __author__ = 'Federico Schmidt'
 
@@ -46,3 +52,126 @@ class TestNetCDFSeries(unittest.TestCase):
         t2 = self.series_maker.get_access_tuple(self.default_dimensions, self.default_varnames, x_idx=1, y_idx=1, scen_number=0)
 
         self.assertEqual(t1, t2)
+
+    def create_netcdf_source(self, file_name='source.nc'):
+        path = os.path.join('test/data/.tmp', file_name)
+        nc = Dataset(path, mode='w')
+        nc.createDimension('time', 3)
+        nc.createDimension('x', 2)
+        nc.createDimension('y', 2)
+        time_var = nc.createVariable('time', 'f4', ('time',))
+        time_var.units = 'Days since 2015-01-01'
+        time_var[:] = [0, 1, 2]
+        nc.createVariable('x', 'f8', ('x',))[:] = [5127500, 5132500]
+        nc.createVariable('y', 'f8', ('y',))[:] = [5907500, 5912500]
+        for v in ['tx', 'tn', 'prcp', 'srad']:
+            nc.createVariable(v, 'f4', ('time', 'x', 'y'))[:] = np.arange(12).reshape((3, 2, 2))
+        nc.close()
+        return path
+
+    def test_netcdf_source_cache(self):
+        path = self.create_netcdf_source()
+
+        s1 = NetCDFSourceCache.acquire(path)
+        s2 = NetCDFSourceCache.acquire(path)
+        # The same file should be opened only once.
+        self.assertIs(s1, s2)
+        self.assertEqual(s1.find_index('x', self.test_location['netcdf_x']), 0)
+        self.assertEqual(s1.find_index('y', '5912500'), 1)
+        self.assertEqual(s1.dates('time')[2], datetime(2015, 1, 3))
+        self.assertRaises(RuntimeError, s1.find_index, 'x', 1)
+
+        NetCDFSourceCache.release(s1)
+        self.assertIsNotNone(s2.dataset)
+        NetCDFSourceCache.release(s2)
+        # Once every consumer released the source, the file must be closed.
+        self.assertIsNone(s2.dataset)
+        self.assertIsNot(NetCDFSourceCache.acquire(path), s1)
+        NetCDFSourceCache.clear()
+
+    def test_netcdf_source_read_series(self):
+        path = os.path.join('test/data/.tmp', 'chunked_source.nc')
+        nc = Dataset(path, mode='w')
+        for dim, size in [('scen', 2), ('time', 4), ('y', 5), ('x', 6)]:
+            nc.createDimension(dim, size)
+        values = np.random.rand(2, 4, 5, 6).astype(np.float32)
+        nc.createVariable('tx', 'f4', ('scen', 'time', 'y', 'x'), zlib=True, chunksizes=(2, 4, 2, 2))[:] = values
+        nc.close()
+
+        cells = [(0, 0), (1, 0), (5, 4), (3, 2)]
+        source = NetCDFSourceCache.acquire(path)
+        try:
+            full_read = source.read_series('tx', 'x', 'y', cells, scen_var_name='scen')
+            # Force reading by chunks.
+            source.full_read_max_bytes = 0
+            chunked_read = source.read_series('tx', 'x', 'y', cells, scen_var_name='scen')
+
+            for x_idx, y_idx in cells:
+                expected = values[:, :, y_idx, x_idx]
+                self.assertEqual(full_read[(x_idx, y_idx)].shape, (2, 4))
+                self.assertTrue(np.array_equal(full_read[(x_idx, y_idx)], expected))
+                self.assertTrue(np.array_equal(chunked_read[(x_idx, y_idx)], expected))
+        finally:
+            NetCDFSourceCache.release(source)
+
+    def test_series_executors(self):
+        path = self.create_netcdf_source('executor_source.nc')
+        results = []
+
+        for executor_class in [ThreadSeriesExecutor, ProcessSeriesExecutor]:
+            output_folder = os.path.join('test/data/.tmp', executor_class.__name__)
+            shutil.rmtree(output_folder, ignore_errors=True)
+            os.makedirs(output_folder)
+
+            forecast = DotDict({
+                'forecast_date': '2015-01-02', 'weather_stations': {}, 'rainfall': {},
+                'paths': {'weather_grid_path': output_folder},
+                'configuration': {'netcdf_source': path, 'netcdf_variables': self.default_varnames,
+                                  'grid_resolution': 10, 'max_parallelism': 2,
+                                  'weather_maker_class': NetCDFSeriesMaker}
+            })
+
+            locations = dict()
+            for station_id, x, y in [(1, 5127500, 5907500), (2, 5132500, 5912500)]:
+                locations[station_id] = DotDict({'netcdf_x': x, 'netcdf_y': y, 'coord_x': -64 + station_id,
+                                                 'coord_y': -36, 'weather_station': station_id})
+
+            series_maker = NetCDFSeriesMaker(system_config={}, max_parallelism=2)
+            executor_class({}, forecast).run(series_maker, locations)
+            series_maker.release_resources()
+
+            files = dict()
+            for station_id, station in forecast.weather_stations.iteritems():
+                self.assertIs(station, locations[station_id])
+                self.assertEqual(station['num_scenarios'], 1)
+                with open(os.path.join(station['weather_path'], 'WTH00000.WTH')) as f:
+                    files[station_id] = f.read()
+            results.append((files, forecast.rainfall))
+
+        # Both executors must create the same series.
+        self.assertEqual(len(results[0][0]), 2)
+        self.assertEqual(results[0], results[1])
+
+    def test_series_executors_errors(self):
+        path = self.create_netcdf_source('executor_source.nc')
+
+        for executor_class in [ThreadSeriesExecutor, ProcessSeriesExecutor]:
+            forecast = DotDict({
+                'forecast_date': '2015-01-02', 'weather_stations': {}, 'rainfall': {},
+                'paths': {'weather_grid_path': 'test/data/.tmp'},
+                'configuration': {'netcdf_source': path, 'netcdf_variables': self.default_varnames,
+                                  'grid_resolution': 10, 'max_parallelism': 2,
+                                  'weather_maker_class': NetCDFSeriesMaker}
+            })
+            # The coordinates of the station aren't in the source.
+            locations = {3: DotDict({'netcdf_x': 1, 'netcdf_y': 1, 'coord_x': -64, 'coord_y': -36,
+                                     'weather_station': 3})}
+
+            series_maker = NetCDFSeriesMaker(system_config={}, max_parallelism=2)
+            with self.assertRaises(RuntimeError) as context:
+                executor_class({}, forecast).run(series_maker, locations)
+            series_maker.release_resources()
+
+            # The error must have the station and the original reason.
+            self.assertIn('station 3', str(context.exception))
+            self.assertIn('find_index', str(context.exception))
@@ -0,0 +1,34 @@
+import time
+import unittest
+from core.lib.utils.profiler import StageProfiler
+
+__author__ = 'Federico Schmidt'
+
+
+class TestStageProfiler(unittest.TestCase):
+
+    def test_stages(self):
+        profiler = StageProfiler()
+
+        with profiler.stage('weather_series', count=2):
+            profiler.add_stage('station 1', time.time(), 0.5)
+            time.sleep(0.1)
+
+        profiler.start('simulations_insert')
+        profiler.start('batch')
+        time.sleep(0.05)
+        # Stages still open are closed by end_all.
+        profiler.end_all()
+
+        view = profiler.view()
+        self.assertEqual([s['name'] for s in view['stages']], ['weather_series', 'simulations_insert'])
+
+        weather_series, insert = view['stages']
+        self.assertEqual(weather_series['count'], 2)
+        self.assertGreaterEqual(weather_series['duration'], 0.1)
+        self.assertEqual([(s['name'], s['duration']) for s in weather_series['stages']], [('station 1', 0.5)])
+
+        self.assertGreaterEqual(insert['start'], weather_series['start'] + weather_series['duration'])
+        self.assertEqual(insert['stages'][0]['name'], 'batch')
+        self.assertGreaterEqual(insert['duration'], insert['stages'][0]['duration'])
+        self.assertGreaterEqual(view['total_time'], 0.15)
@@ -0,0 +1,140 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+from core.lib.jobs.monitor import NullMonitor
+from core.lib.utils.extended_collections import DotDict
+from core.modules.simulations_manager.RunpSIMS import RunpSIMS
+from core.modules.simulations_manager.psims.PSIMSPool import PSIMSPool
+
+__author__ = 'Federico Schmidt'
+
+import unittest
+
+
+class TestPSIMSPool(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_folder = tempfile.mkdtemp()
+        self.psims_path = os.path.join(self.tmp_folder, 'psims')
+        for folder in ['tapps', 'data', 'run001']:
+            os.makedirs(os.path.join(self.psims_path, folder))
+        with open(os.path.join(self.psims_path, 'psims'), mode='w') as f:
+            f.write('#!/bin/sh')
+        self.pool = PSIMSPool(self.psims_path, os.path.join(self.tmp_folder, 'slots'), max_slots=2)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_folder)
+
+    def test_slots(self):
+        with self.pool.slot() as slot_0:
+            with self.pool.slot() as slot_1:
+                self.assertNotEqual(slot_0, slot_1)
+                self.assertEqual(sorted(os.listdir(slot_0)), ['data', 'psims', 'tapps'])
+                self.assertEqual(os.path.realpath(os.path.join(slot_1, 'tapps')),
+                                 os.path.realpath(os.path.join(self.psims_path, 'tapps')))
+
+                # Both slots are in use, a third execution must wait for one of them.
+                acquired = []
+                waiting_thread = threading.Thread(target=self.acquire_slot, args=(acquired,))
+                waiting_thread.start()
+                waiting_thread.join(0.2)
+                self.assertEqual(acquired, [])
+
+            waiting_thread.join(5)
+            self.assertEqual(acquired, [slot_1])
+
+            # Run folders belong to the slot that created them.
+            os.makedirs(os.path.join(slot_0, 'run001'))
+            self.assertEqual(PSIMSPool.run_dirs(slot_0), {'run001'})
+
+        # Links are updated if the installation changes.
+        os.remove(os.path.join(self.psims_path, 'psims'))
+        self.assertEqual(sorted(os.listdir(self.pool.prepare_slot(0))), ['data', 'run001', 'tapps'])
+
+    def acquire_slot(self, acquired):
+        with self.pool.slot() as slot_path:
+            acquired.append(slot_path)
+
+
+class TestRunpSIMS(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_folder)
+
+    def test_progress_counts(self):
+        line = 'Progress: time: Mon, 04 Jan 2016 Selecting site:3 Stage in:1 Active:2 Finished successfully:10\n'
+        self.assertEqual(RunpSIMS.progress_counts(line), {'Selecting site': 3, 'Stage in': 1, 'Active': 2,
+                                                          'Finished successfully': 10})
+        self.assertEqual(RunpSIMS.progress_counts('Swift 0.94.1 swift-r7114\n'), {})
+
+    def test_output_lines(self):
+        # A long output, written in pieces that don't match line boundaries.
+        p = subprocess.Popen([sys.executable, '-c', 'import sys\n'
+                                                    'for i in range(20000): sys.stdout.write("line %d\\n" % i)\n'
+                                                    'sys.stdout.write("last")'], stdout=subprocess.PIPE)
+        lines = list(RunpSIMS.output_lines(p, chunk_size=7))
+        self.assertEqual(p.wait(), 0)
+        self.assertEqual(len(lines), 20001)
+        self.assertEqual(lines[12345], 'line 12345\n')
+        self.assertEqual(lines[-1], 'last')
+
+    def test_run(self):
+        script_path = os.path.join(self.tmp_folder, 'run_psims.sh')
+        with open(script_path, mode='w') as script:
+            script.write('cd "$1"\n'
+                         'for i in $(seq 1 3000); do echo "Output line $i"; done\n'
+                         'echo "Progress: Active:1 Finished successfully:4"\n'
+                         'echo "Progress: Finished successfully:5"\n')
+
+        runner = RunpSIMS(output_buffer_lines=10)
+        progress_monitor = NullMonitor()
+        progress_monitor.update_progress = lambda new_value: setattr(progress_monitor, 'value', new_value)
+
+        self.assertEqual(runner.__run__(script_path, self.tmp_folder, 'Test forecast', 5, progress_monitor,
+                                        verbose=False), 0)
+        self.assertEqual(progress_monitor.value, 5)
+
+    def test_parallel_runs(self):
+        psims_path = os.path.join(self.tmp_folder, 'psims')
+        os.makedirs(os.path.join(psims_path, 'tapps'))
+        markers_path = os.path.join(self.tmp_folder, 'started')
+        os.makedirs(markers_path)
+
+        # Each execution waits (up to 5 seconds) until the other one started, so it only succeeds if both run at once.
+        script_path = os.path.join(self.tmp_folder, 'run_psims.sh')
+        with open(script_path, mode='w') as script:
+            script.write('cd "$1"\n'
+                         'mkdir run001\n'
+                         'touch "%(markers)s/$$"\n'
+                         'for i in $(seq 1 50); do\n'
+                         '    [ $(ls "%(markers)s" | wc -l) -ge 2 ] && break\n'
+                         '    sleep 0.1\n'
+                         'done\n'
+                         '[ $(ls "%(markers)s" | wc -l) -ge 2 ] || exit 1\n'
+                         'echo "Progress: Finished successfully:1"\n' % {'markers': markers_path})
+
+        runner = RunpSIMS(slots_path=os.path.join(self.tmp_folder, 'slots'), max_slots=2)
+        forecasts = [DotDict({'name': 'Forecast %d' % i, 'forecast_date': '2015-01-02', 'simulation_count': 1,
+                              'paths': {'psims': psims_path, 'run_script_path': script_path}}) for i in range(2)]
+        ret_vals = {}
+
+        threads = [threading.Thread(target=lambda f=f: ret_vals.update({f.name: runner.run(f, verbose=False)}))
+                   for f in forecasts]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join(10)
+
+        self.assertEqual(ret_vals, {'Forecast 0': 0, 'Forecast 1': 0})
+        self.assertEqual(len(os.listdir(markers_path)), 2)
+
+        # Each execution ran in its own slot.
+        run_dirs = [f.paths.psims_run_dirs for f in forecasts]
+        self.assertEqual([len(d) for d in run_dirs], [1, 1])
+        self.assertNotEqual(os.path.dirname(run_dirs[0][0]), os.path.dirname(run_dirs[1][0]))
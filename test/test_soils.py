@@ -0,0 +1,136 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+from core.lib.io.file import scan_tree
+from core.lib.sync import ResourceLocks
+from core.lib.utils.extended_collections import DotDict
+from core.modules.data_updater import SoilsUpdater as soils_updater_module
+from core.modules.data_updater.SoilsUpdater import SoilsUpdater
+from core.modules.simulations_manager.soil.SoilRepository import SoilRepository
+
+__author__ = 'Federico Schmidt'
+
+
+class FakeSoilsCollection(object):
+    def __init__(self):
+        self.documents = {}
+        self.updated_ids = []
+
+    def find(self, query, projection=None):
+        return [dict(d, _id=soil_id) for soil_id, d in self.documents.iteritems()]
+
+    def bulk_write(self, requests, ordered=True):
+        for request in requests:
+            self.updated_ids.append(request._filter['_id'])
+            self.documents[request._filter['_id']] = request._doc['$set']
+
+
+class TestSoilRepository(unittest.TestCase):
+
+    def setUp(self):
+        self.soils_path = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.soils_path, 'summer'))
+        self.write_soil('summer/SOIL01.json', 'SOIL01', [('020', '0.1'), ('050', '0.2')])
+        self.write_soil('SOIL02.json', 'SOIL02', [('030', '0.15')])
+        self.repository = SoilRepository(self.soils_path, cache_size=1)
+
+    def tearDown(self):
+        shutil.rmtree(self.soils_path)
+
+    def write_soil(self, file_name, soil_id, layers, mtime=None):
+        path = os.path.join(self.soils_path, file_name)
+        with open(path, mode='w') as f:
+            json.dump({'soils': [{'soil_id': soil_id, 'soilLayer': [
+                {'sllb': sllb, 'slll': slll, 'sldul': '0.3', 'slsat': '0.4', 'slbdm': '1.3'} for sllb, slll in layers
+            ]}]}, f)
+        if mtime:
+            os.utime(path, (mtime, mtime))
+
+    def test_get_soil(self):
+        # The soils folder is scanned on first use.
+        self.assertIsNone(self.repository.catalogue)
+        self.assertEqual(sorted(self.repository.soils.keys()), ['SOIL01', 'SOIL02'])
+        self.assertIsNone(self.repository.get_soil('SOIL03'))
+
+        soil = self.repository.get_soil('SOIL01')
+        self.assertIs(self.repository.get_soil('SOIL01'), soil)
+
+        # The cache holds a single soil, the first one must be evicted.
+        self.repository.get_soil('SOIL02')
+        self.assertEqual(len(self.repository.cache), 1)
+        self.assertIsNot(self.repository.get_soil('SOIL01'), soil)
+
+    def test_modified_soil(self):
+        self.repository.build_index()
+        self.assertEqual(self.repository.layer_field('SOIL01', 'sllb').tolist(), [20, 50])
+        self.assertEqual(self.repository.layers('SOIL02').shape, (1, len(SoilRepository.layer_fields)))
+
+        self.write_soil('summer/SOIL01.json', 'SOIL01', [('020', '0.1'), ('050', '0.2'), ('100', '0.25')],
+                        mtime=os.path.getmtime(os.path.join(self.soils_path, 'SOIL02.json')) + 10)
+        self.assertEqual(self.repository.layer_field('SOIL01', 'slll').tolist(), [0.1, 0.2, 0.25])
+        self.assertEqual(len(self.repository.get_soil('SOIL01')['soils'][0]['soilLayer']), 3)
+
+    def test_manifest(self):
+        manifest_folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, manifest_folder)
+        manifest_path = os.path.join(manifest_folder, 'manifest.json')
+        repository = SoilRepository(self.soils_path, manifest_path=manifest_path)
+        self.assertEqual(len(repository.soils), 2)
+        self.assertTrue(os.path.exists(manifest_path))
+
+        # A new process reuses the manifest without scanning the folder.
+        repository = SoilRepository(self.soils_path, manifest_path=manifest_path)
+        repository.reload = None
+        repository.load()
+        self.assertEqual(repository.soils, self.repository.soils)
+
+        # Adding a soil invalidates the manifest.
+        self.write_soil('summer/SOIL03.json', 'SOIL03', [('020', '0.1')])
+        summer_folder = os.path.join(self.soils_path, 'summer')
+        os.utime(summer_folder, (0, os.path.getmtime(summer_folder) + 10))
+        repository = SoilRepository(self.soils_path, manifest_path=manifest_path)
+        self.assertEqual(sorted(repository.soils.keys()), ['SOIL01', 'SOIL02', 'SOIL03'])
+
+    def test_scan_tree(self):
+        files, dirs = scan_tree(self.soils_path, filter=lambda f: f.endswith('.json'))
+        self.assertEqual(sorted([os.path.relpath(f, self.soils_path) for f, mtime in files]),
+                         ['SOIL02.json', 'summer/SOIL01.json'])
+        self.assertEqual(sorted(dirs.keys()), [self.soils_path, os.path.join(self.soils_path, 'summer')])
+
+    def test_soils_updater(self):
+        soil_layers = [{'sllb': '020', 'slll': '0.1', 'sldul': '0.3', 'slsat': '0.4', 'slbdm': '1.3'},
+                       {'sllb': '050', 'slll': '0.2', 'sldul': '0.3', 'slsat': '0.4', 'slbdm': '1.3'}]
+        metrics = SoilsUpdater.calculate_metrics(soil_layers)
+        self.assertAlmostEqual(metrics['wilting_point'], 200 * 0.1 + 300 * 0.2)
+        self.assertAlmostEqual(metrics['field_capacity'], 500 * 0.3)
+        self.assertAlmostEqual(metrics['field_saturation'], 500 * 0.4)
+        self.assertAlmostEqual(metrics['max_available_water'], 150 - 80)
+
+        collection = FakeSoilsCollection()
+        updater = SoilsUpdater(DotDict({'database': {'yield_db': {'soils': collection}},
+                                        'resource_locks': ResourceLocks()}))
+
+        original_repository = soils_updater_module.soil_repository
+        soils_updater_module.soil_repository = self.repository
+        try:
+            updater.run()
+            self.assertEqual(sorted(collection.updated_ids), ['SOIL01', 'SOIL02'])
+            # Soils of different layer counts are computed together.
+            self.assertEqual(collection.documents['SOIL01']['metrics'], metrics)
+            self.assertAlmostEqual(collection.documents['SOIL02']['metrics']['wilting_point'], 300 * 0.15)
+
+            # Only the modified soils are updated again.
+            del collection.updated_ids[:]
+            self.write_soil('SOIL02.json', 'SOIL02', [('030', '0.2')],
+                            mtime=os.path.getmtime(os.path.join(self.soils_path, 'SOIL02.json')) + 10)
+            updater.run()
+            self.assertEqual(collection.updated_ids, ['SOIL02'])
+            self.assertAlmostEqual(collection.documents['SOIL02']['metrics']['wilting_point'], 300 * 0.2)
+
+            del collection.updated_ids[:]
+            updater.run(full_update=True)
+            self.assertEqual(sorted(collection.updated_ids), ['SOIL01', 'SOIL02'])
+        finally:
+            soils_updater_module.soil_repository = original_repository
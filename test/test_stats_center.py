@@ -1,6 +1,7 @@
 from apscheduler.executors.pool import ThreadPoolExecutor
 import time
 from core.lib.jobs.scheduler import MonitoringScheduler
+from core.lib.sync import JobsLock
 from core.modules.statistics.StatsCenter import StatsCenter
 from test.mock import TestJob
 
@@ -28,3 +29,11 @@ class TestStatsCenter(unittest.TestCase):
         self.scheduler.add_job(a_job, 'A job', trigger='interval', seconds=3)
         # time.sleep(1)
         self.assertEqual(len(self.stats.tasks.keys()), 1)
+
+    def test_locks_metrics(self):
+        lock = JobsLock()
+        self.stats.add_lock('jobs', lock)
+
+        with lock.blocking_job(priority=3):
+            pass
+        self.assertEqual(self.stats.locks_metrics()['jobs']['wait_stats'][3]['count'], 1)
@@ -2,7 +2,7 @@ import threading
 import time
 import unittest
 
-from core.lib.sync import PrioritizedRWLock, JobsLock
+from core.lib.sync import PrioritizedRWLock, JobsLock, ResourceLocks
 from test.mock import ReaderThread, WriterThread
 
 __author__ = 'Federico Schmidt'
@@ -199,3 +199,213 @@ class TestPrioritizedRWLock(unittest.TestCase):
         time.sleep(0.5)
         self.assertEqual(lock.active_readers, 0)
         self.assertEqual(lock.waiting_readers, 0)
+
+
+    def test_writers_heap_order(self):
+        lock = PrioritizedRWLock()
+        run_order = []
+        lock.acquire_write()
+
+        _threads = [WriterThread(lock, 'writer %d' % p, run_order, priority=p) for p in [3, 1, 5, 1, 4]]
+        for t in _threads:
+            t.start()
+            time.sleep(0.05)
+
+        self.assertEqual(len(lock.queued_writers), 5)
+        lock.release_write()
+        for t in _threads:
+            t.join()
+
+        # Writers with the same priority are FIFO.
+        self.assertEqual(run_order, ['writer 5', 'writer 4', 'writer 3', 'writer 1', 'writer 1'])
+
+    def test_priority_aging(self):
+        lock = PrioritizedRWLock(priority_aging=60)
+        run_order = []
+        lock.acquire_write()
+
+        # The low priority writer gains a priority point each second, so it's the first after waiting 2 seconds.
+        _threads = [WriterThread(lock, 'low priority', run_order, priority=0)]
+        _threads[0].start()
+        time.sleep(2)
+        _threads.append(WriterThread(lock, 'high priority', run_order, priority=1))
+        _threads[1].start()
+        time.sleep(0.05)
+
+        lock.release_write()
+        for t in _threads:
+            t.join()
+        self.assertEqual(run_order, ['low priority', 'high priority'])
+
+    def test_timeouts(self):
+        lock = PrioritizedRWLock()
+        lock.acquire_read()
+
+        self.assertFalse(lock.acquire_write(priority=2, timeout=0.1))
+        self.assertEqual(len(lock.queued_writers), 0)
+
+        run_order = []
+        w = WriterThread(lock, 'writer', run_order, priority=1)
+        w.start()
+        time.sleep(0.05)
+        # Readers wait for queued writers.
+        self.assertRaises(RuntimeError, lambda: lock.reader(timeout=0.1).__enter__())
+        self.assertEqual(lock.waiting_readers, 0)
+
+        lock.release_read()
+        w.join()
+
+        stats = lock.wait_stats()
+        self.assertEqual(stats[2]['timeouts'], 1)
+        self.assertEqual(stats[1]['count'], 1)
+        self.assertGreater(stats[1]['max_wait'], 0.1)
+        self.assertEqual(stats['reader']['timeouts'], 1)
+        self.assertEqual(stats['reader']['count'], 1)
+
+    def test_timeout_releases_readers(self):
+        lock = PrioritizedRWLock()
+        lock.acquire_read()
+        run_order = []
+
+        writer_result = []
+        w = threading.Thread(target=lambda: writer_result.append(lock.acquire_write(timeout=0.3)))
+        w.start()
+        time.sleep(0.05)
+        r = ReaderThread(lock, 'reader', run_order)
+        r.start()
+        time.sleep(0.05)
+        self.assertEqual(lock.waiting_readers, 1)
+
+        # The reader is released as soon as the queued writer times out.
+        w.join()
+        r.join()
+        self.assertEqual(writer_result, [False])
+        self.assertEqual(run_order, ['reader'])
+        lock.release_read()
+
+    def test_lock_metrics(self):
+        lock = JobsLock(max_records=2)
+        run_order = []
+
+        with lock.blocking_job(priority=1, job_id='update'):
+            r = ReaderThread(lock, 'reader', run_order)
+            r.start()
+            time.sleep(0.1)
+            self.assertEqual(lock.metrics_view()['holding'][0]['job_id'], 'update')
+        r.join()
+
+        with lock.parallel_job(job_id='sync'):
+            metrics = lock.metrics_view()
+            self.assertEqual([(a['job_id'], a['mode']) for a in metrics['acquisitions']],
+                             [('sync', 'read'), (None, 'read')])
+            self.assertEqual([a['job_id'] for a in metrics['holding']], ['sync'])
+
+        metrics = lock.metrics_view()
+        reader = metrics['acquisitions'][1]
+        self.assertEqual(reader['queue_depth'], 0)
+        self.assertGreater(reader['wait_time'], 0.05)
+        self.assertGreater(reader['hold_time'], 0.4)
+
+        # The first acquisition was dropped from the rolling histograms.
+        self.assertNotIn(1, [a['priority'] for a in metrics['acquisitions']])
+        self.assertEqual(sum(metrics['histograms'][1]['wait']), 0)
+        self.assertEqual(sum(metrics['histograms'][1]['hold']), 0)
+        self.assertEqual(metrics['histograms']['reader']['wait'], [1, 0, 1, 0, 0, 0, 0, 0])
+        self.assertEqual(metrics['histograms']['reader']['hold'], [1, 0, 1, 0, 0, 0, 0, 0])
+        # Wait statistics aren't rolling.
+        self.assertEqual(metrics['wait_stats'][1]['count'], 1)
+
+class ResourcesThread(threading.Thread):
+
+    def __init__(self, locks, id, run_order, shared=(), exclusive=(), priority=0):
+        super(ResourcesThread, self).__init__()
+        self.locks = locks
+        self.id = id
+        self.run_order = run_order
+        self.shared = shared
+        self.exclusive = exclusive
+        self.priority = priority
+
+    def run(self):
+        with self.locks.resources(shared=self.shared, exclusive=self.exclusive, priority=self.priority):
+            self.run_order.append('%s started' % self.id)
+            time.sleep(0.5)
+            self.run_order.append('%s ended' % self.id)
+
+
+class TestResourceLocks(unittest.TestCase):
+
+    def run_threads(self, threads):
+        for t in threads:
+            t.start()
+            # Small sleep to ensure threads are executed in this order.
+            time.sleep(0.05)
+        for t in threads:
+            t.join()
+
+    def test_disjoint_resources_run_parallel(self):
+        locks = ResourceLocks()
+        run_order = []
+
+        self.run_threads([
+            ResourcesThread(locks, 'forecast 1', run_order, shared=['config', 'station:1'], exclusive=['forecast:1']),
+            ResourcesThread(locks, 'forecast 2', run_order, shared=['config', 'station:2'], exclusive=['forecast:2']),
+            ResourcesThread(locks, 'update', run_order, exclusive=['station:3'])
+        ])
+
+        self.assertEqual(run_order[0:3], ['forecast 1 started', 'forecast 2 started', 'update started'])
+
+    def test_exclusive_resources(self):
+        locks = ResourceLocks()
+        run_order = []
+
+        self.run_threads([
+            ResourcesThread(locks, 'forecast 1', run_order, shared=['station:1', 'station:2']),
+            ResourcesThread(locks, 'forecast 2', run_order, shared=['station:2'], priority=0),
+            ResourcesThread(locks, 'update', run_order, exclusive=['station:2', 'station:1'], priority=1)
+        ])
+
+        # Forecasts share the stations, the update waits until both of them end.
+        self.assertEqual(run_order, ['forecast 1 started', 'forecast 2 started', 'forecast 1 ended',
+                                     'forecast 2 ended', 'update started', 'update ended'])
+
+    def test_exclusive_priority(self):
+        locks = ResourceLocks()
+        run_order = []
+
+        self.run_threads([
+            ResourcesThread(locks, 'forecast', run_order, shared=['config']),
+            ResourcesThread(locks, 'reload 1', run_order, exclusive=['config'], priority=0),
+            ResourcesThread(locks, 'reload 2', run_order, exclusive=['config'], priority=1)
+        ])
+
+        self.assertEqual(run_order, ['forecast started', 'forecast ended', 'reload 2 started', 'reload 2 ended',
+                                     'reload 1 started', 'reload 1 ended'])
+        self.assertEqual(sorted(locks.locks.keys()), ['config'])
+
+    def test_resources_timeout(self):
+        locks = ResourceLocks()
+        run_order = []
+        update = ResourcesThread(locks, 'update', run_order, exclusive=['station:2'])
+        update.start()
+        time.sleep(0.05)
+
+        self.assertIsNone(locks.acquire(shared=['station:1', 'station:2'], timeout=0.1))
+        # Resources acquired before the timeout are released.
+        self.assertTrue(locks.lock('station:1').acquire_write(timeout=0))
+        update.join()
+
+        stats = locks.wait_stats()
+        self.assertEqual(stats['reader']['timeouts'], 1)
+        self.assertEqual(stats[0]['count'], 2)
+
+    def test_resources_metrics(self):
+        locks = ResourceLocks()
+        with locks.resources(shared=['station:1'], exclusive=['forecast:1'], job_id='forecast'):
+            metrics = locks.metrics_view()
+
+        self.assertEqual(sorted([(a['resource'], a['mode'], a['job_id']) for a in metrics['holding']]),
+                         [('forecast:1', 'write', 'forecast'), ('station:1', 'read', 'forecast')])
+        self.assertEqual(sorted(metrics['resources'].keys()), ['forecast:1', 'station:1'])
+        self.assertEqual(locks.metrics_view()['holding'], [])
+        self.assertEqual(sum(locks.metrics_view()['histograms'][0]['hold']), 1)
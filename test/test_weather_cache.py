@@ -0,0 +1,65 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from core.modules.simulations_manager.weather.WeatherSeriesCache import WeatherSeriesCache
+
+__author__ = 'Federico Schmidt'
+
+
+class TestWeatherSeriesCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_folder = tempfile.mkdtemp()
+        self.cache = WeatherSeriesCache(os.path.join(self.tmp_folder, 'cache'))
+        self.grid_folder = os.path.join(self.tmp_folder, 'grid')
+        os.makedirs(self.grid_folder)
+
+        self.file_names = ['WTH00000.WTH', 'WTH00001.WTH']
+        for file_name in self.file_names:
+            with open(os.path.join(self.grid_folder, file_name), 'w') as f:
+                f.write(file_name)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_folder)
+
+    def test_put_get_invalidate(self):
+        key = WeatherSeriesCache.key('CombinedSeriesMaker', 87544, '2015-10-01', 5, '2015-09-30')
+        self.assertNotEqual(key, WeatherSeriesCache.key('CombinedSeriesMaker', 87544, '2015-10-01', 5, '2015-10-01'))
+
+        output_folder = os.path.join(self.tmp_folder, 'rundir')
+        os.makedirs(output_folder)
+        self.assertIsNone(self.cache.get(87544, key, output_folder))
+
+        rainfall = {'0': {'dates': [15001], 'values': [1.5]}, '1980': {'dates': [15300], 'values': [0.2]}}
+        self.cache.put(87544, key, self.grid_folder, self.file_names, [1980, 1981], rainfall)
+
+        cached = self.cache.get(87544, key, output_folder)
+        self.assertEqual(cached['scen_names'], [1980, 1981])
+        self.assertEqual(cached['rainfall'], rainfall)
+        self.assertEqual(sorted(os.listdir(output_folder)), self.file_names)
+        with open(os.path.join(output_folder, 'WTH00001.WTH')) as f:
+            self.assertEqual(f.read(), 'WTH00001.WTH')
+
+        # The linked files must survive the invalidation of the entry.
+        self.cache.invalidate([87544])
+        self.assertTrue(os.path.exists(os.path.join(output_folder, 'WTH00000.WTH')))
+        self.assertIsNone(self.cache.get(87544, key, os.path.join(self.tmp_folder, 'grid')))
+        self.assertEqual(os.listdir(self.cache.cache_path), [])
+
+    def test_max_entries(self):
+        cache = WeatherSeriesCache(os.path.join(self.tmp_folder, 'cache'), max_entries=2)
+        keys = [WeatherSeriesCache.key('CombinedSeriesMaker', 87544, forecast_date)
+                for forecast_date in ['2015-10-01', '2015-10-02', '2015-10-03']]
+
+        for age, key in zip([30, 20], keys[0:2]):
+            cache.put(87544, key, self.grid_folder, self.file_names, [1980, 1981], {})
+            entry_time = time.time() - age
+            os.utime(cache.entry_path(87544, key), (entry_time, entry_time))
+        cache.put(87544, keys[2], self.grid_folder, self.file_names, [1980, 1981], {})
+
+        # Only the newest entries of the station are kept.
+        self.assertEqual(sorted(os.listdir(os.path.join(cache.cache_path, '87544'))), sorted(keys[1:]))
+        self.assertEqual(os.listdir(cache.cache_path), ['87544'])
+        self.assertRaises(RuntimeError, WeatherSeriesCache, cache.cache_path, max_entries=0)
@@ -0,0 +1,175 @@
+from datetime import datetime, timedelta
+from pymongo.errors import BulkWriteError
+from core.lib.utils.extended_collections import DotDict
+from core.modules.data_updater.sync import YieldDatabaseSync
+from core.modules.simulations_manager.ForecastManager import ForecastManager
+
+__author__ = 'Federico Schmidt'
+
+import unittest
+
+
+class FakeCursor(list):
+    def batch_size(self, size):
+        return self
+
+    def sort(self, field, direction):
+        return FakeCursor(sorted(self, key=lambda d: d[field], reverse=direction < 0))
+
+    def limit(self, count):
+        return FakeCursor(self[:count])
+
+
+class FakeCollection(object):
+    """
+    Supports the subset of the PyMongo collection API used by YieldDatabaseSync and ForecastManager.mark_finished.
+    """
+    def __init__(self, documents=None):
+        self.documents = list(documents or [])
+        self.queries = []
+
+    def __matches__(self, document, query):
+        for field, condition in query.items():
+            if isinstance(condition, dict):
+                if '$in' in condition and document.get(field) not in condition['$in']:
+                    return False
+                if '$gte' in condition and (field not in document or document[field] < condition['$gte']):
+                    return False
+                if '$exists' in condition and (field in document) != condition['$exists']:
+                    return False
+                if '$ne' in condition and document.get(field) == condition['$ne']:
+                    return False
+            elif document.get(field) != condition:
+                return False
+        return True
+
+    def find(self, query, projection=None):
+        self.queries.append(query)
+        return FakeCursor([d for d in self.documents if self.__matches__(d, query)])
+
+    def find_one(self, query):
+        found = self.find(query)
+        return found[0] if len(found) > 0 else None
+
+    def replace_one(self, query, document, upsert=False):
+        self.documents = [d for d in self.documents if not self.__matches__(d, query)] + [document]
+
+    def insert_many(self, documents, ordered=True):
+        self.inserts = getattr(self, 'inserts', 0) + 1
+        ids = set([d['_id'] for d in self.documents])
+        duplicated = [d for d in documents if d['_id'] in ids]
+        self.documents.extend([d for d in documents if d['_id'] not in ids])
+        if len(duplicated) > 0:
+            raise BulkWriteError({'writeErrors': [{'code': 11000} for d in duplicated],
+                                  'nInserted': len(documents) - len(duplicated)})
+        return DotDict({'inserted_ids': [d['_id'] for d in documents]})
+
+    def update_one(self, query, update):
+        self.update_many(query, update, limit=1)
+
+    def update_many(self, query, update, limit=None):
+        for document in [d for d in self.documents if self.__matches__(d, query)][:limit]:
+            document.update(update['$set'])
+
+    def bulk_write(self, requests, ordered=True):
+        for request in requests:
+            self.replace_one(request._filter, request._doc, upsert=True)
+
+
+class FakeDatabase(dict):
+    def __missing__(self, name):
+        self[name] = FakeCollection()
+        return self[name]
+
+    def __getattr__(self, name):
+        return self[name]
+
+
+class TestYieldDatabaseSync(unittest.TestCase):
+
+    def test_chunks(self):
+        self.assertEqual(list(YieldDatabaseSync.chunks(xrange(5), 2)), [[0, 1], [2, 3], [4]])
+        self.assertEqual(list(YieldDatabaseSync.chunks([], 2)), [])
+
+    def test_prefetched(self):
+        self.assertEqual(list(YieldDatabaseSync.prefetched(xrange(10), 2)), range(10))
+
+        def failing():
+            yield 1
+            raise ValueError('Source read failed')
+
+        with self.assertRaises(ValueError):
+            list(YieldDatabaseSync.prefetched(failing(), 2))
+
+    def test_insert_documents(self):
+        collection = FakeCollection([{'_id': 1}])
+        self.assertEqual(YieldDatabaseSync.insert_documents(collection, [{'_id': 1}, {'_id': 2}]), 1)
+        self.assertEqual(sorted(d['_id'] for d in collection.documents), [1, 2])
+
+    def test_incremental_sync(self):
+        now = datetime.utcnow()
+        source_db, target_db = FakeDatabase(), FakeDatabase()
+        source_db['locations'] = FakeCollection([{'_id': i, 'last_modified': now - timedelta(days=10 - i)}
+                                                 for i in range(10)])
+
+        job = YieldDatabaseSync(DotDict({}))
+        job.batch_size = 3
+
+        # Without a checkpoint the collection is reconciled.
+        self.assertEqual(job.__sync_collection__('locations', source_db, target_db), 10)
+        self.assertEqual(sorted(d['_id'] for d in target_db.locations.documents), range(10))
+        checkpoint = target_db.sync_checkpoints.find_one({'_id': 'locations'})
+        self.assertEqual(checkpoint['last_modified'], now - timedelta(days=1))
+
+        # Only documents modified after the checkpoint (minus the margin) are synced again.
+        source_db.locations.replace_one({'_id': 3}, {'_id': 3, 'name': 'Updated', 'last_modified': now})
+        source_db.locations.documents.append({'_id': 10, 'last_modified': now})
+        self.assertEqual(job.__sync_collection__('locations', source_db, target_db), 3)
+        self.assertEqual(target_db.locations.find_one({'_id': 3})['name'], 'Updated')
+        self.assertEqual(len(target_db.locations.documents), 11)
+
+    def test_sync_forecast_simulations(self):
+        source_db, target_db = FakeDatabase(), FakeDatabase()
+        source_db['simulations'] = FakeCollection([{'_id': i} for i in range(1000)])
+        source_db['forecasts'] = FakeCollection([{'_id': 'f%d' % i, 'simulations': range(i * 10, (i + 1) * 10),
+                                                  'last_modified': datetime.utcnow()} for i in range(100)])
+        # Simulations that were already synced aren't copied again.
+        target_db['simulations'] = FakeCollection([{'_id': i} for i in range(5)])
+
+        job = YieldDatabaseSync(DotDict({}))
+        job.batch_size = 40
+        job.__sync_collection__('forecasts', source_db, target_db,
+                                before_write=lambda forecasts: job.__sync_simulations__(forecasts, source_db,
+                                                                                        target_db))
+        self.assertEqual(sorted(s['_id'] for s in target_db.simulations.documents), range(1000))
+        self.assertEqual(len(target_db.forecasts.documents), 100)
+        # Simulations are fetched and inserted by batches, not by forecast.
+        self.assertEqual(target_db.simulations.inserts, 1000 / job.batch_size)
+
+    def test_sync_skips_running_forecasts(self):
+        source_db = FakeDatabase()
+        source_db['simulations'] = FakeCollection([{'_id': i} for i in range(4)])
+        source_db['forecasts'] = FakeCollection([{'_id': 'finished', 'simulations': [0, 1], 'status': 'running'},
+                                                 {'_id': 'running', 'simulations': [2, 3], 'status': 'running'}])
+        source_db['reference_simulations'] = FakeCollection([{'_id': 'ref_finished'}, {'_id': 'ref_running'}])
+        ForecastManager.mark_finished(source_db, 'simulations', [0, 1], forecast_id='finished')
+        ForecastManager.mark_finished(source_db, 'reference_simulations', ['ref_finished'])
+
+        job = YieldDatabaseSync(DotDict({}))
+        # Both the first sync (a reconciliation) and the incremental ones skip running forecasts.
+        for full_reconcile in [True, False]:
+            target_db = FakeDatabase()
+            if not full_reconcile:
+                target_db['sync_checkpoints'] = FakeCollection([
+                    {'_id': name, 'last_modified': datetime.utcnow() - timedelta(days=1)}
+                    for name in ['forecasts', 'reference_simulations']])
+
+            job.__sync_collection__('forecasts', source_db, target_db, full_reconcile=full_reconcile,
+                                    before_write=lambda forecasts: job.__sync_simulations__(forecasts, source_db,
+                                                                                            target_db))
+            job.__sync_collection__('reference_simulations', source_db, target_db, full_reconcile=full_reconcile)
+
+            self.assertEqual([f['_id'] for f in target_db.forecasts.documents], ['finished'])
+            self.assertEqual(target_db.forecasts.documents[0]['status'], 'finished')
+            self.assertEqual(sorted(s['_id'] for s in target_db.simulations.documents), [0, 1])
+            self.assertEqual([s['_id'] for s in target_db.reference_simulations.documents], ['ref_finished'])